@@ -1,19 +1,45 @@
 from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, Query
+from fastapi.encoders import jsonable_encoder
 from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
+import argparse
+import asyncio
+import base64
+import csv
+import gzip
+import io
+import json
 import logging
+import re
+import time
+import unicodedata
+import hashlib
+import heapq
+import ipaddress
+import sys
+import tempfile
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field, field_validator
-from typing import List, Optional, Dict, Any, Set
+from typing import List, Optional, Dict, Any, Set, Tuple, Callable, Awaitable, IO, Iterator, AsyncIterator
 import uuid
 from datetime import datetime, timezone, timedelta
 import httpx
 import jwt
 from jwt import InvalidTokenError
 
+try:
+    from cryptography import x509
+except ImportError:  # cryptography missing; PyJWT cannot verify RS256 Firebase tokens
+    x509 = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
@@ -37,8 +63,90 @@ logger = logging.getLogger(__name__)
 
 FIREBASE_PROJECT_ID = os.getenv("FIREBASE_PROJECT_ID")
 FIREBASE_CERTS_URL = "https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com"
-_firebase_certs_cache: Dict[str, Any] = {"expires_at": datetime.min.replace(tzinfo=timezone.utc), "certs": {}}
-_mutation_rate_limit_cache: Dict[str, List[datetime]] = {}
+FIREBASE_CERTS_REFRESH_MARGIN_SECONDS = int(os.getenv("FIREBASE_CERTS_REFRESH_MARGIN_SECONDS", "300"))
+FIREBASE_CERTS_STALE_GRACE_SECONDS = int(os.getenv("FIREBASE_CERTS_STALE_GRACE_SECONDS", "600"))
+_firebase_certs_cache: Dict[str, Any] = {
+    "expires_at": datetime.min.replace(tzinfo=timezone.utc),
+    "refresh_at": datetime.min.replace(tzinfo=timezone.utc),
+    "certs": {},
+    "keys": {},
+    "refresh_task": None,
+}
+FIREBASE_TOKEN_CACHE_MAX_ENTRIES = int(os.getenv("FIREBASE_TOKEN_CACHE_MAX_ENTRIES", "5000"))
+_firebase_token_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_firebase_token_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "kid_rotations": 0}
+MUTATION_RATE_LIMIT_MAX_KEYS = int(os.getenv("MUTATION_RATE_LIMIT_MAX_KEYS", "50000"))
+MUTATION_RATE_LIMIT_PRUNE_BATCH = 8
+# key -> [bucket, current_count, previous_count, window_seconds, last_seen]
+_mutation_rate_limit_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+_mutation_rate_limit_stats: Dict[str, int] = {
+    "allowed": 0,
+    "blocked": 0,
+    "evicted_idle": 0,
+    "evicted_capacity": 0,
+    "backend_errors": 0,
+}
+PRE_AUTH_RATE_LIMIT_ENABLED = os.getenv("PRE_AUTH_RATE_LIMIT_ENABLED", "true").strip().lower() in {"1", "true", "yes"}
+
+
+def _parse_pre_auth_rate_limits(raw: str) -> List[Tuple[str, int, int]]:
+    """Parses "prefix=limit/window_seconds,..." into (path prefix, limit, window_seconds) rules."""
+    rules: List[Tuple[str, int, int]] = []
+    for entry in raw.split(","):
+        if not entry.strip():
+            continue
+        prefix, _, budget = entry.strip().rpartition("=")
+        limit, _, window_seconds = budget.partition("/")
+        rules.append((prefix.strip(), int(limit), int(window_seconds)))
+    return rules
+
+
+# Per client IP, before auth runs, so only paths abusable without a session
+# belong here; carrier NAT puts many real users behind one IP. First matching
+# prefix wins, so keep the most specific first.
+PRE_AUTH_RATE_LIMITS: List[Tuple[str, int, int]] = _parse_pre_auth_rate_limits(
+    os.getenv(
+        "PRE_AUTH_RATE_LIMITS",
+        "/api/auth/session=60/60,/api/telemetry/=600/60,/api/integrations/=300/60,/api/social/=300/60",
+    )
+)
+# Separate store so a flood of (possibly spoofed) client IPs can only evict
+# other pre-auth keys, never the per-user mutation windows.
+PRE_AUTH_RATE_LIMIT_MAX_KEYS = int(os.getenv("PRE_AUTH_RATE_LIMIT_MAX_KEYS", "20000"))
+_pre_auth_rate_limit_cache: "OrderedDict[str, List[float]]" = OrderedDict()
+_pre_auth_rate_limit_stats: Dict[str, int] = {"checked": 0, "rejected": 0, "evicted_idle": 0, "evicted_capacity": 0}
+# Peers allowed to set X-Forwarded-For; defaults to loopback and private ranges, where load balancers sit.
+TRUSTED_PROXY_NETWORKS = [
+    ipaddress.ip_network(cidr.strip())
+    for cidr in os.getenv(
+        "TRUSTED_PROXY_CIDRS",
+        "127.0.0.0/8,10.0.0.0/8,172.16.0.0/12,192.168.0.0/16,::1/128,fc00::/7",
+    ).split(",")
+    if cidr.strip()
+]
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").strip().lower()  # memory | mongo
+# Closed buckets no longer change, so the shared backend only reads each one once per process.
+_rate_limit_closed_bucket_counts: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+
+SESSION_CACHE_TTL_SECONDS = int(os.getenv("SESSION_CACHE_TTL_SECONDS", "60"))
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv("SESSION_CACHE_MAX_ENTRIES", "10000"))
+_session_user_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_session_cache_tokens_by_user: Dict[str, Set[str]] = {}
+_session_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+SESSION_EMBED_USER_SNAPSHOT = os.getenv("SESSION_EMBED_USER_SNAPSHOT", "true").strip().lower() in {"1", "true", "yes"}
+USER_SNAPSHOT_SCHEMA_VERSION = 2
+USER_SNAPSHOT_FIELDS = ("user_id", "email", "name", "picture", "created_at", "goals", "equipment")
+
+SESSION_EXPIRY_MODE = os.getenv("SESSION_EXPIRY_MODE", "ttl_index").strip().lower()  # ttl_index | sweeper
+SESSION_SWEEP_INTERVAL_SECONDS = int(os.getenv("SESSION_SWEEP_INTERVAL_SECONDS", "900"))
+_session_expiry_stats: Dict[str, Any] = {"mode": None, "reaped": 0, "sweeps": 0, "last_sweep_at": None}
+_background_tasks: Dict[str, "asyncio.Task"] = {}
+
+ENTITLEMENT_CACHE_TTL_SECONDS = int(os.getenv("ENTITLEMENT_CACHE_TTL_SECONDS", "30"))
+ENTITLEMENT_CACHE_MAX_ENTRIES = int(os.getenv("ENTITLEMENT_CACHE_MAX_ENTRIES", "10000"))
+_entitlement_cache: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_entitlement_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
 
 ALLOWED_EQUIPMENT = {
     "dumbbells",
@@ -79,21 +187,170 @@ LIFECYCLE_TEMPLATES = {
     },
 }
 EXPO_PUSH_API_URL = "https://exp.host/--/api/v2/push/send"
+EMERGENT_SESSION_DATA_URL = "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data"
+OUTBOUND_HTTP_MAX_CONNECTIONS = int(os.getenv("OUTBOUND_HTTP_MAX_CONNECTIONS", "100"))
+OUTBOUND_HTTP_MAX_KEEPALIVE = int(os.getenv("OUTBOUND_HTTP_MAX_KEEPALIVE", "20"))
+_outbound_http_clients: Dict[str, httpx.AsyncClient] = {}
 EXPO_PUSH_MAX_BATCH = 100
 
 
+def _is_trusted_proxy(host: str) -> bool:
+    try:
+        address = ipaddress.ip_address(host)
+    except ValueError:
+        return False
+    return any(address in network for network in TRUSTED_PROXY_NETWORKS)
+
+
+def _client_ip(request: Request) -> str:
+    """
+    The connecting peer, unless it is a trusted proxy: then the right-most
+    X-Forwarded-For hop that is not itself a trusted proxy. Hops to the left
+    of that are client-supplied and never used. A missing peer address (unix
+    socket) counts as a local proxy.
+    """
+    peer = request.client.host if request.client and request.client.host else None
+    if peer and not _is_trusted_proxy(peer):
+        return peer
+
+    hops = [hop.strip() for hop in request.headers.get("x-forwarded-for", "").split(",") if hop.strip()]
+    for hop in reversed(hops):
+        if not _is_trusted_proxy(hop):
+            return hop
+    return hops[0] if hops else (peer or "unknown")
+
+
 def _client_identifier(request: Request, user_id: Optional[str] = None) -> str:
     if user_id:
         return f"user:{user_id}"
+    return f"ip:{_client_ip(request)}"
+
+
+def _prune_rate_limit_keys(
+    now: float,
+    cache: "OrderedDict[str, List[float]]",
+    max_keys: int,
+    stats: Dict[str, int],
+) -> None:
+    """Drops a bounded number of idle keys from the LRU head, then enforces the hard key cap."""
+    for _ in range(MUTATION_RATE_LIMIT_PRUNE_BATCH):
+        if not cache:
+            break
+        oldest_key = next(iter(cache))
+        oldest = cache[oldest_key]
+        if now - oldest[4] <= 2 * oldest[3]:
+            break
+        del cache[oldest_key]
+        stats["evicted_idle"] += 1
+
+    while len(cache) > max(max_keys, 1):
+        cache.popitem(last=False)
+        stats["evicted_capacity"] += 1
+
+
+async def _memory_rate_limit_allow(
+    key: str,
+    limit: int,
+    window_seconds: int,
+    cache: Optional["OrderedDict[str, List[float]]"] = None,
+    max_keys: Optional[int] = None,
+    stats: Optional[Dict[str, int]] = None,
+) -> bool:
+    """
+    Sliding-window counter: the previous fixed window's count is weighted by
+    how much of it still overlaps the sliding window. O(1) time and memory per
+    key. Defaults to the mutation store; pre-auth limits pass their own.
+    """
+    if cache is None:
+        cache, max_keys, stats = _mutation_rate_limit_cache, MUTATION_RATE_LIMIT_MAX_KEYS, _mutation_rate_limit_stats
+    now = time.monotonic()
+    window = max(window_seconds, 1)
+    bucket = int(now // window)
+
+    entry = cache.get(key)
+    if entry is None or entry[0] < bucket - 1:
+        entry = [bucket, 0, 0, window, now]
+    elif entry[0] == bucket - 1:
+        entry = [bucket, 0, entry[1], window, now]
+    else:
+        entry[4] = now
 
-    forwarded_for = request.headers.get("x-forwarded-for")
-    if forwarded_for:
-        return f"ip:{forwarded_for.split(',')[0].strip()}"
+    cache[key] = entry
+    cache.move_to_end(key)
+    _prune_rate_limit_keys(now, cache, max_keys, stats)
 
-    if request.client and request.client.host:
-        return f"ip:{request.client.host}"
+    overlap = 1.0 - (now - bucket * window) / window
+    if entry[2] * overlap + entry[1] >= limit:
+        return False
+
+    entry[1] += 1
+    return True
 
-    return "ip:unknown"
+
+async def _mongo_rate_limit_allow(key: str, limit: int, window_seconds: int) -> bool:
+    """
+    Shared sliding-window counter on rate_limit_counters: one atomic $inc
+    upsert per request on the current time bucket, pipelined with a read of
+    the previous bucket only the first time this process sees it. Buckets are
+    removed by the TTL index on expires_at. Like the memory backend, only
+    allowed requests count: a rejected attempt takes its increment back.
+    """
+    now = time.time()
+    window = max(window_seconds, 1)
+    bucket = int(now // window)
+    current_id = f"{key}:{window}:{bucket}"
+    previous_id = f"{key}:{window}:{bucket - 1}"
+
+    increment = db.rate_limit_counters.find_one_and_update(
+        {"_id": current_id},
+        {
+            "$inc": {"count": 1},
+            "$setOnInsert": {"expires_at": datetime.fromtimestamp((bucket + 2) * window, tz=timezone.utc)},
+        },
+        projection={"count": 1},
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+
+    previous_count = _ttl_cache_get(_rate_limit_closed_bucket_counts, previous_id)
+    if previous_count is None:
+        current_doc, previous_doc = await asyncio.gather(
+            increment,
+            db.rate_limit_counters.find_one({"_id": previous_id}, {"count": 1}),
+        )
+        previous_count = int(previous_doc.get("count", 0)) if previous_doc else 0
+        _ttl_cache_put(
+            _rate_limit_closed_bucket_counts,
+            previous_id,
+            previous_count,
+            2 * window,
+            MUTATION_RATE_LIMIT_MAX_KEYS,
+        )
+    else:
+        current_doc = await increment
+
+    current_count = int(current_doc.get("count", 1)) if current_doc else 1
+    overlap = 1.0 - (now - bucket * window) / window
+    if previous_count * overlap + (current_count - 1) < limit:
+        return True
+
+    await db.rate_limit_counters.update_one({"_id": current_id}, {"$inc": {"count": -1}})
+    return False
+
+
+RATE_LIMIT_BACKENDS = {
+    "memory": _memory_rate_limit_allow,
+    "mongo": _mongo_rate_limit_allow,
+}
+
+
+async def ensure_rate_limit_backend() -> None:
+    if RATE_LIMIT_BACKEND == "mongo":
+        await db.rate_limit_counters.create_index(
+            "expires_at",
+            name="rate_limit_counters_expires_at_ttl",
+            expireAfterSeconds=0,
+        )
 
 
 async def enforce_mutation_rate_limit(
@@ -103,16 +360,70 @@ async def enforce_mutation_rate_limit(
     limit: int = 60,
     window_seconds: int = 60,
 ) -> None:
-    now = datetime.now(timezone.utc)
     key = f"{scope}:{_client_identifier(request, user_id)}"
-    window_start = now - timedelta(seconds=window_seconds)
+    backend = RATE_LIMIT_BACKENDS.get(RATE_LIMIT_BACKEND, _memory_rate_limit_allow)
 
-    hits = [ts for ts in _mutation_rate_limit_cache.get(key, []) if ts >= window_start]
-    if len(hits) >= limit:
+    try:
+        allowed = await backend(key, limit, window_seconds)
+    except Exception as e:
+        # Fail over to the per-process limiter rather than failing requests open or closed.
+        _mutation_rate_limit_stats["backend_errors"] += 1
+        logger.warning(f"Rate limit backend '{RATE_LIMIT_BACKEND}' failed, using memory: {e}")
+        allowed = await _memory_rate_limit_allow(key, limit, window_seconds)
+
+    if not allowed:
+        _mutation_rate_limit_stats["blocked"] += 1
         raise HTTPException(status_code=429, detail="Too many requests")
+    _mutation_rate_limit_stats["allowed"] += 1
+
 
-    hits.append(now)
-    _mutation_rate_limit_cache[key] = hits
+def _pre_auth_rate_limit_rule(path: str) -> Optional[Tuple[str, int, int]]:
+    for rule in PRE_AUTH_RATE_LIMITS:
+        if path.startswith(rule[0]):
+            return rule
+    return None
+
+
+def get_rate_limit_stats() -> Dict[str, Any]:
+    approx_bytes = sys.getsizeof(_mutation_rate_limit_cache) + sum(
+        sys.getsizeof(key) + sys.getsizeof(entry) for key, entry in _mutation_rate_limit_cache.items()
+    )
+    return {
+        **_mutation_rate_limit_stats,
+        "backend": RATE_LIMIT_BACKEND,
+        "keys": len(_mutation_rate_limit_cache),
+        "max_keys": MUTATION_RATE_LIMIT_MAX_KEYS,
+        "approx_memory_bytes": approx_bytes,
+        "pre_auth": {
+            **_pre_auth_rate_limit_stats,
+            "keys": len(_pre_auth_rate_limit_cache),
+            "max_keys": PRE_AUTH_RATE_LIMIT_MAX_KEYS,
+        },
+    }
+
+
+def get_outbound_http_client() -> httpx.AsyncClient:
+    """
+    Long-lived pooled client for hot-path outbound calls so requests reuse
+    keep-alive connections instead of paying TCP/TLS setup every time.
+    """
+    http_client = _outbound_http_clients.get("default")
+    if http_client is None or http_client.is_closed:
+        http_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(10.0, connect=5.0),
+            limits=httpx.Limits(
+                max_connections=OUTBOUND_HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=OUTBOUND_HTTP_MAX_KEEPALIVE,
+            ),
+        )
+        _outbound_http_clients["default"] = http_client
+    return http_client
+
+
+async def close_outbound_http_clients() -> None:
+    for http_client in list(_outbound_http_clients.values()):
+        await http_client.aclose()
+    _outbound_http_clients.clear()
 
 
 def validate_date_key(date_value: str) -> str:
@@ -413,6 +724,7 @@ class Workout(BaseModel):
     exercises: List[WorkoutExercise] = []
     duration_minutes: Optional[int] = None
     notes: Optional[str] = None
+    version: int = 1  # bumped on every update; see WorkoutUpdate.version
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class WorkoutCreate(BaseModel):
@@ -422,6 +734,19 @@ class WorkoutCreate(BaseModel):
     duration_minutes: Optional[int] = Field(default=None, ge=1, le=600)
     notes: Optional[str] = Field(default=None, max_length=3000)
 
+class WorkoutUpdate(WorkoutCreate):
+    # The version the client last read. When set, the update only applies if
+    # the workout is still at that version; otherwise it fails with 409.
+    version: Optional[int] = Field(default=None, ge=1)
+
+WORKOUT_BATCH_MAX_ITEMS = 100
+
+class WorkoutBatchItem(WorkoutCreate):
+    client_id: str = Field(min_length=1, max_length=64)  # client-generated idempotency key
+
+class WorkoutBatchCreate(BaseModel):
+    items: List[WorkoutBatchItem] = Field(min_length=1, max_length=WORKOUT_BATCH_MAX_ITEMS)
+
 class Food(BaseModel):
     food_id: str = Field(default_factory=lambda: f"fd_{uuid.uuid4().hex[:12]}")
     name: str
@@ -640,19 +965,170 @@ def evaluate_strava_wearable_scope(
     }
 
 
+WORKOUT_SUMMARY_VERSION = 1
+WORKOUT_SUMMARY_BACKFILL_BATCH = 500
+DEFAULT_SET_RPE = 7
+WORKOUT_SUMMARY_PROJECTION = {"_id": 0, "workout_id": 1, "date": 1, "name": 1, "summary": 1}
+
+
+def build_workout_summary(exercises: Optional[List[Dict[str, Any]]], duration_minutes: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Derived metrics stored on each workout at write time so readers project
+    this block instead of walking exercises[].sets[]. Working-set figures skip
+    warm-ups; all_sets/all_volume count every set with reps, which is what the
+    social leaderboard ranks on.
+    """
+    summary: Dict[str, Any] = {
+        "version": WORKOUT_SUMMARY_VERSION,
+        "total_volume": 0,
+        "working_sets": 0,
+        "total_reps": 0,
+        "all_sets": 0,
+        "all_volume": 0.0,
+        "duration_minutes": duration_minutes,
+        "exercises": [],
+    }
+
+    for exercise in exercises or []:
+        entry = {
+            "exercise_name": exercise.get("exercise_name"),
+            "working_sets": 0,
+            "total_reps": 0,
+            "max_weight": 0,
+            "volume": 0,
+            "rpe_sum": 0,
+            "rpe_sets": 0,
+            "avg_rpe": None,
+        }
+        for set_data in exercise.get("sets", []) or []:
+            weight = set_data.get("weight", 0) or 0
+            reps = set_data.get("reps", 0) or 0
+            if float(reps) > 0:
+                summary["all_sets"] += 1
+                summary["all_volume"] += max(float(weight), 0) * float(reps)
+
+            if set_data.get("is_warmup", False):
+                continue
+            entry["max_weight"] = max(entry["max_weight"], weight) if entry["working_sets"] else weight
+            entry["working_sets"] += 1
+            entry["total_reps"] += reps
+            entry["volume"] += weight * reps
+            if set_data.get("rpe"):
+                entry["rpe_sum"] += set_data["rpe"]
+                entry["rpe_sets"] += 1
+
+        if entry["rpe_sets"]:
+            entry["avg_rpe"] = round(entry["rpe_sum"] / entry["rpe_sets"], 1)
+        summary["working_sets"] += entry["working_sets"]
+        summary["total_reps"] += entry["total_reps"]
+        summary["total_volume"] += entry["volume"]
+        summary["exercises"].append(entry)
+
+    return summary
+
+
+def _has_current_summary(workout: Dict[str, Any]) -> bool:
+    summary = workout.get("summary")
+    return isinstance(summary, dict) and summary.get("version") == WORKOUT_SUMMARY_VERSION
+
+
+def workout_summary(workout: Dict[str, Any]) -> Dict[str, Any]:
+    if _has_current_summary(workout):
+        return workout["summary"]
+    return build_workout_summary(workout.get("exercises"), workout.get("duration_minutes"))
+
+
+async def load_workout_summaries(workouts: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Fills in `summary` on workouts read with WORKOUT_SUMMARY_PROJECTION.
+    Documents written before summaries existed (and not yet backfilled) get
+    their sets fetched in one $in query and summarized on the fly.
+    """
+    missing = [workout for workout in workouts if not _has_current_summary(workout)]
+    if not missing:
+        return workouts
+
+    workout_ids = [workout["workout_id"] for workout in missing if workout.get("workout_id")]
+    sources: Dict[str, Dict[str, Any]] = {}
+    if workout_ids:
+        docs = await db.workouts.find(
+            {"workout_id": {"$in": workout_ids}},
+            {"_id": 0, "workout_id": 1, "exercises": 1, "duration_minutes": 1},
+        ).to_list(length=len(workout_ids))
+        sources = {doc["workout_id"]: doc for doc in docs}
+
+    for workout in missing:
+        workout["summary"] = workout_summary(sources.get(workout.get("workout_id"), workout))
+    return workouts
+
+
+async def backfill_workout_summaries() -> int:
+    """Stores summaries on workouts that lack a current one, in unordered batches."""
+    updated = 0
+    batch: List[UpdateOne] = []
+    stale = {"summary.version": {"$ne": WORKOUT_SUMMARY_VERSION}}
+    try:
+        cursor = db.workouts.find(stale, {"_id": 1, "exercises": 1, "duration_minutes": 1})
+        async for doc in cursor:
+            # Re-check staleness so a concurrent update's fresh summary is never overwritten.
+            batch.append(
+                UpdateOne(
+                    {"_id": doc["_id"], **stale},
+                    {"$set": {"summary": build_workout_summary(doc.get("exercises"), doc.get("duration_minutes"))}},
+                )
+            )
+            if len(batch) >= WORKOUT_SUMMARY_BACKFILL_BATCH:
+                await db.workouts.bulk_write(batch, ordered=False)
+                updated += len(batch)
+                batch = []
+        if batch:
+            await db.workouts.bulk_write(batch, ordered=False)
+            updated += len(batch)
+    except Exception as e:
+        logger.warning(f"Workout summary backfill stopped after {updated} workouts: {e}")
+        raise
+
+    if updated:
+        logger.info(f"Backfilled summaries on {updated} workouts")
+    return updated
+
+
+async def _run_workout_summary_backfill_once() -> int:
+    """
+    Every writer stores a current summary, so once a backfill at this version
+    has finished there is nothing left to find. The marker in data_migrations
+    turns later boots into a single _id lookup instead of a collection scan.
+    """
+    marker = await db.data_migrations.find_one({"_id": "workout_summaries"}, {"version": 1})
+    if marker and marker.get("version", 0) >= WORKOUT_SUMMARY_VERSION:
+        return 0
+
+    try:
+        updated = await backfill_workout_summaries()
+    except Exception:
+        return 0  # left unmarked; the next boot resumes where this one stopped
+    await db.data_migrations.update_one(
+        {"_id": "workout_summaries"},
+        {"$set": {"version": WORKOUT_SUMMARY_VERSION, "completed_at": datetime.now(timezone.utc), "updated": updated}},
+        upsert=True,
+    )
+    return updated
+
+
+def ensure_workout_summaries() -> None:
+    task = _background_tasks.get("workout_summary_backfill")
+    if task is None or task.done():
+        _background_tasks["workout_summary_backfill"] = asyncio.ensure_future(_run_workout_summary_backfill_once())
+
+
 def aggregate_workout_social_stats(workouts: List[Dict[str, Any]]) -> Dict[str, float]:
     total_sets = 0
     total_volume = 0.0
 
     for workout in workouts:
-        for exercise in workout.get("exercises", []) or []:
-            for set_data in exercise.get("sets", []) or []:
-                reps = float(set_data.get("reps", 0) or 0)
-                weight = float(set_data.get("weight", 0) or 0)
-                if reps <= 0:
-                    continue
-                total_sets += 1
-                total_volume += max(weight, 0) * reps
+        summary = workout_summary(workout)
+        total_sets += summary["all_sets"]
+        total_volume += summary["all_volume"]
 
     return {
         "workouts": len(workouts),
@@ -662,6 +1138,203 @@ def aggregate_workout_social_stats(workouts: List[Dict[str, Any]]) -> Dict[str,
 
 # ============== Auth Helpers ==============
 
+def _ttl_cache_get(cache: "OrderedDict[str, Dict[str, Any]]", key: str) -> Optional[Any]:
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry["expires_at"] <= time.monotonic():
+        cache.pop(key, None)
+        return None
+    cache.move_to_end(key)
+    return entry["value"]
+
+
+def _ttl_cache_put(
+    cache: "OrderedDict[str, Dict[str, Any]]",
+    key: str,
+    value: Any,
+    ttl_seconds: float,
+    max_entries: int,
+) -> List[tuple]:
+    """
+    Stores a value with a monotonic-clock expiry and evicts least recently
+    used entries past max_entries. Returns the evicted (key, entry) pairs.
+    """
+    cache[key] = {"value": value, "expires_at": time.monotonic() + ttl_seconds}
+    cache.move_to_end(key)
+
+    evicted: List[tuple] = []
+    while len(cache) > max(max_entries, 1):
+        evicted.append(cache.popitem(last=False))
+    return evicted
+
+
+def _cache_session_user(session_token: str, user_doc: Dict[str, Any], session_expires_at: datetime) -> None:
+    remaining_seconds = (session_expires_at - datetime.now(timezone.utc)).total_seconds()
+    ttl_seconds = min(SESSION_CACHE_TTL_SECONDS, remaining_seconds)
+    if ttl_seconds <= 0:
+        return
+
+    user_id = user_doc["user_id"]
+    evicted = _ttl_cache_put(
+        _session_user_cache,
+        session_token,
+        {"user_id": user_id, "user": user_doc},
+        ttl_seconds,
+        SESSION_CACHE_MAX_ENTRIES,
+    )
+    _session_cache_tokens_by_user.setdefault(user_id, set()).add(session_token)
+
+    for evicted_token, entry in evicted:
+        _session_cache_stats["evictions"] += 1
+        tokens = _session_cache_tokens_by_user.get(entry["value"]["user_id"])
+        if tokens is not None:
+            tokens.discard(evicted_token)
+            if not tokens:
+                _session_cache_tokens_by_user.pop(entry["value"]["user_id"], None)
+
+
+def invalidate_session_cache(session_token: Optional[str] = None, user_id: Optional[str] = None) -> int:
+    """
+    Drops cached session->user entries for a single token and/or every
+    token belonging to a user. Returns the number of entries removed.
+    """
+    tokens: Set[str] = set()
+    if session_token:
+        tokens.add(session_token)
+    if user_id:
+        tokens.update(_session_cache_tokens_by_user.pop(user_id, set()))
+
+    removed = 0
+    for token in tokens:
+        entry = _session_user_cache.pop(token, None)
+        if entry is None:
+            continue
+        removed += 1
+        owner_tokens = _session_cache_tokens_by_user.get(entry["value"]["user_id"])
+        if owner_tokens is not None:
+            owner_tokens.discard(token)
+            if not owner_tokens:
+                _session_cache_tokens_by_user.pop(entry["value"]["user_id"], None)
+
+    _session_cache_stats["invalidations"] += removed
+    return removed
+
+
+def _cache_stats_snapshot(stats: Dict[str, int], cache: "OrderedDict[str, Dict[str, Any]]", max_entries: int) -> Dict[str, Any]:
+    lookups = stats["hits"] + stats["misses"]
+    return {
+        **stats,
+        "entries": len(cache),
+        "max_entries": max_entries,
+        "hit_rate_percent": round((stats["hits"] / max(lookups, 1)) * 100, 2),
+    }
+
+
+def get_session_cache_stats() -> Dict[str, Any]:
+    return {
+        **_cache_stats_snapshot(_session_cache_stats, _session_user_cache, SESSION_CACHE_MAX_ENTRIES),
+        "ttl_seconds": SESSION_CACHE_TTL_SECONDS,
+    }
+
+
+def get_firebase_token_cache_stats() -> Dict[str, Any]:
+    return _cache_stats_snapshot(_firebase_token_cache_stats, _firebase_token_cache, FIREBASE_TOKEN_CACHE_MAX_ENTRIES)
+
+
+def _user_doc_grants_pro(user_doc: Optional[Dict[str, Any]]) -> bool:
+    if not user_doc:
+        return False
+
+    if user_doc.get("isPro") is True:
+        return True
+
+    entitlements = user_doc.get("entitlements")
+    if isinstance(entitlements, dict) and entitlements.get("pro") is True:
+        return True
+
+    subscription = user_doc.get("subscription")
+    if isinstance(subscription, dict) and subscription.get("pro") is True:
+        return True
+
+    return False
+
+
+def _remember_user_entitlements(request: Request, user_doc: Dict[str, Any]) -> None:
+    """
+    Resolves backend entitlement flags from a users document read during this
+    request, for require_pro_user on the same request and, for up to
+    ENTITLEMENT_CACHE_TTL_SECONDS, later ones. Never pass a cached or
+    snapshotted user: the cache TTL is the only staleness bound.
+    """
+    is_pro = _user_doc_grants_pro(user_doc)
+    request.state.user_is_pro = is_pro
+    evicted = _ttl_cache_put(
+        _entitlement_cache,
+        user_doc["user_id"],
+        is_pro,
+        ENTITLEMENT_CACHE_TTL_SECONDS,
+        ENTITLEMENT_CACHE_MAX_ENTRIES,
+    )
+    _entitlement_cache_stats["evictions"] += len(evicted)
+
+
+def invalidate_user_entitlements(user_id: str) -> None:
+    """Call whenever isPro / entitlements / subscription change for a user."""
+    if _entitlement_cache.pop(user_id, None) is not None:
+        _entitlement_cache_stats["invalidations"] += 1
+    invalidate_session_cache(user_id=user_id)
+
+
+def get_entitlement_cache_stats() -> Dict[str, Any]:
+    return {
+        **_cache_stats_snapshot(_entitlement_cache_stats, _entitlement_cache, ENTITLEMENT_CACHE_MAX_ENTRIES),
+        "ttl_seconds": ENTITLEMENT_CACHE_TTL_SECONDS,
+    }
+
+
+def build_user_snapshot(user_doc: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Compact copy of the user fields auth needs, embedded in user_sessions so
+    get_current_user is a single read. Entitlements are left out on purpose:
+    they change outside this app and a session lives for days, so
+    require_pro_user resolves them from users instead.
+    """
+    snapshot = {field: user_doc[field] for field in USER_SNAPSHOT_FIELDS if field in user_doc}
+    snapshot["schema_version"] = USER_SNAPSHOT_SCHEMA_VERSION
+    snapshot["profile_version"] = int(user_doc.get("profile_version") or 0)
+    return snapshot
+
+
+def _user_from_session_snapshot(session: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    snapshot = session.get("user_snapshot")
+    if not SESSION_EMBED_USER_SNAPSHOT or not isinstance(snapshot, dict):
+        return None
+    if snapshot.get("schema_version") != USER_SNAPSHOT_SCHEMA_VERSION:
+        return None
+    if snapshot.get("user_id") != session.get("user_id") or "created_at" not in snapshot:
+        return None
+    return snapshot
+
+
+async def refresh_session_user_snapshots(user_doc: Optional[Dict[str, Any]]) -> None:
+    """
+    Rewrites the embedded snapshot on every session of the user. The
+    profile_version guard keeps a slower, older write from clobbering a newer one.
+    """
+    if not SESSION_EMBED_USER_SNAPSHOT or not user_doc:
+        return
+
+    snapshot = build_user_snapshot(user_doc)
+    await db.user_sessions.update_many(
+        {
+            "user_id": user_doc["user_id"],
+            "user_snapshot.profile_version": {"$not": {"$gt": snapshot["profile_version"]}},
+        },
+        {"$set": {"user_snapshot": snapshot}},
+    )
+
+
 async def get_current_user(request: Request) -> User:
     """Get current user from session token"""
     session_token = request.cookies.get("session_token")
@@ -674,7 +1347,13 @@ async def get_current_user(request: Request) -> User:
     
     if not session_token:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    
+
+    cached_user = _ttl_cache_get(_session_user_cache, session_token)
+    if cached_user is not None:
+        _session_cache_stats["hits"] += 1
+        return User(**cached_user["user"])
+    _session_cache_stats["misses"] += 1
+
     session = await db.user_sessions.find_one({"session_token": session_token}, {"_id": 0})
 
     # If no db session exists, treat bearer token as Firebase ID token and
@@ -691,6 +1370,7 @@ async def get_current_user(request: Request) -> User:
         if not user:
             raise HTTPException(status_code=404, detail="User not found")
 
+        _remember_user_entitlements(request, user)
         return User(**user)
 
     if not session:
@@ -703,19 +1383,32 @@ async def get_current_user(request: Request) -> User:
         expires_at = expires_at.replace(tzinfo=timezone.utc)
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Session expired")
-    
-    user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
-    
-    return User(**user)
 
+    user = _user_from_session_snapshot(session)
+    if user is None:
+        user = await db.users.find_one({"user_id": session["user_id"]}, {"_id": 0})
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+        # Only a users document read just now is fresh enough to carry entitlements.
+        _remember_user_entitlements(request, user)
+        if SESSION_EMBED_USER_SNAPSHOT:
+            # Backfill legacy / outdated sessions so the next miss is a single read.
+            # Same guard as refresh_session_user_snapshots: a profile write that
+            # landed after our read has already stored a newer snapshot.
+            snapshot = build_user_snapshot(user)
+            await db.user_sessions.update_one(
+                {
+                    "session_token": session_token,
+                    "user_snapshot.profile_version": {"$not": {"$gt": snapshot["profile_version"]}},
+                },
+                {"$set": {"user_snapshot": snapshot}},
+            )
+
+    _cache_session_user(session_token, user, expires_at)
+    return User(**user)
 
-async def _get_firebase_certs() -> Dict[str, str]:
-    now = datetime.now(timezone.utc)
-    if _firebase_certs_cache["certs"] and _firebase_certs_cache["expires_at"] > now:
-        return _firebase_certs_cache["certs"]
 
+async def _fetch_firebase_certs() -> Dict[str, str]:
     async with httpx.AsyncClient(timeout=10.0) as client:
         response = await client.get(FIREBASE_CERTS_URL)
         response.raise_for_status()
@@ -731,10 +1424,80 @@ async def _get_firebase_certs() -> Dict[str, str]:
                 except ValueError:
                     max_age_seconds = 3600
 
-        _firebase_certs_cache["certs"] = certs
-        _firebase_certs_cache["expires_at"] = now + timedelta(seconds=max_age_seconds)
+    now = datetime.now(timezone.utc)
+    previous_certs = _firebase_certs_cache["certs"]
+    # Keep parsed keys only for kids whose PEM did not change.
+    _firebase_certs_cache["keys"] = {
+        kid: key
+        for kid, key in _firebase_certs_cache["keys"].items()
+        if kid in certs and certs[kid] == previous_certs.get(kid)
+    }
+    _firebase_certs_cache["certs"] = certs
+    _firebase_certs_cache["expires_at"] = now + timedelta(seconds=max_age_seconds)
+    _firebase_certs_cache["refresh_at"] = now + timedelta(
+        seconds=max(max_age_seconds - FIREBASE_CERTS_REFRESH_MARGIN_SECONDS, max_age_seconds // 2)
+    )
+    return certs
+
+
+def _on_firebase_certs_refresh_done(task: "asyncio.Task") -> None:
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.warning(f"Firebase cert refresh failed: {exc}")
+
+
+def _schedule_firebase_certs_refresh() -> "asyncio.Task":
+    """Starts a cert refresh unless one is already in flight (single-flight)."""
+    task = _firebase_certs_cache["refresh_task"]
+    if task is None or task.done():
+        task = asyncio.ensure_future(_fetch_firebase_certs())
+        task.add_done_callback(_on_firebase_certs_refresh_done)
+        _firebase_certs_cache["refresh_task"] = task
+    return task
+
+
+async def _get_firebase_certs() -> Dict[str, str]:
+    """
+    Returns Google's signing certs. Refreshes in the background shortly before
+    max-age runs out and keeps serving the current certs (up to
+    FIREBASE_CERTS_STALE_GRACE_SECONDS past expiry) while the refresh is in
+    flight. Only callers with no usable certs wait on the shared fetch.
+    """
+    now = datetime.now(timezone.utc)
+    certs = _firebase_certs_cache["certs"]
+    if certs and _firebase_certs_cache["refresh_at"] > now:
+        return certs
+
+    stale_deadline = _firebase_certs_cache["expires_at"] + timedelta(seconds=FIREBASE_CERTS_STALE_GRACE_SECONDS)
+    if certs and stale_deadline > now:
+        _schedule_firebase_certs_refresh()
         return certs
 
+    return await asyncio.shield(_schedule_firebase_certs_refresh())
+
+
+def _get_firebase_public_key(kid: str, cert: str) -> Any:
+    """
+    Public key of the X.509 certificate Google publishes for `kid`, parsed
+    once per kid. PyJWT only accepts bare keys, not certificates.
+    """
+    key = _firebase_certs_cache["keys"].get(kid)
+    if key is not None:
+        return key
+    if x509 is None:
+        return cert
+
+    try:
+        key = x509.load_pem_x509_certificate(cert.encode("utf-8")).public_key()
+    except Exception as e:
+        logger.warning(f"Firebase cert parse failed for kid {kid}: {e}")
+        return cert
+
+    _firebase_certs_cache["keys"][kid] = key
+    return key
+
 
 async def verify_firebase_id_token(token: str) -> Optional[str]:
     payload = await verify_firebase_token_payload(token)
@@ -746,7 +1509,21 @@ async def verify_firebase_token_payload(token: str) -> Optional[Dict[str, Any]]:
         logger.warning("FIREBASE_PROJECT_ID not set; cannot verify Firebase ID token")
         return None
 
+    # Verified payloads are reused until the token's exp claim, as long as the
+    # signing kid is still published; this skips repeat RS256 verification.
+    token_key = hashlib.sha256(token.encode("utf-8")).hexdigest()
+
     try:
+        cached = _ttl_cache_get(_firebase_token_cache, token_key)
+        if cached is not None:
+            certs = await _get_firebase_certs()
+            if cached["kid"] in certs:
+                _firebase_token_cache_stats["hits"] += 1
+                return dict(cached["payload"])
+            _firebase_token_cache.pop(token_key, None)
+            _firebase_token_cache_stats["kid_rotations"] += 1
+        _firebase_token_cache_stats["misses"] += 1
+
         unverified_header = jwt.get_unverified_header(token)
         kid = unverified_header.get("kid")
         if not kid:
@@ -759,7 +1536,7 @@ async def verify_firebase_token_payload(token: str) -> Optional[Dict[str, Any]]:
 
         payload = jwt.decode(
             token,
-            cert,
+            _get_firebase_public_key(kid, cert),
             algorithms=["RS256"],
             audience=FIREBASE_PROJECT_ID,
             issuer=f"https://securetoken.google.com/{FIREBASE_PROJECT_ID}",
@@ -768,6 +1545,17 @@ async def verify_firebase_token_payload(token: str) -> Optional[Dict[str, Any]]:
         user_id = payload.get("sub")
         if not user_id:
             return None
+
+        ttl_seconds = float(payload.get("exp", 0)) - time.time()
+        if ttl_seconds > 0:
+            evicted = _ttl_cache_put(
+                _firebase_token_cache,
+                token_key,
+                {"kid": kid, "payload": dict(payload)},
+                ttl_seconds,
+                FIREBASE_TOKEN_CACHE_MAX_ENTRIES,
+            )
+            _firebase_token_cache_stats["evictions"] += len(evicted)
         return payload
     except InvalidTokenError as e:
         logger.warning(f"Firebase token verification failed: {e}")
@@ -797,33 +1585,109 @@ async def require_pro_user(request: Request, user: User = Depends(get_current_us
     Server-authoritative Pro entitlement check.
     Priority:
     1) Verified Firebase custom claims (webhook/admin-managed)
-    2) Backend user record flags (isPro / entitlements.pro / subscription.pro)
+    2) Backend user record flags (isPro / entitlements.pro / subscription.pro),
+       taken from the users document if get_current_user read one for this
+       request, else the per-user entitlement cache, else a projected read.
     """
     firebase_claims = getattr(request.state, "firebase_claims", None) or {}
     if _claims_grant_pro(firebase_claims):
         return user
 
-    user_doc = await db.users.find_one(
-        {"user_id": user.user_id},
-        {"_id": 0, "isPro": 1, "entitlements": 1, "subscription": 1},
-    )
+    is_pro = getattr(request.state, "user_is_pro", None)
+    if is_pro is None:
+        is_pro = _ttl_cache_get(_entitlement_cache, user.user_id)
+        if is_pro is not None:
+            _entitlement_cache_stats["hits"] += 1
+        else:
+            _entitlement_cache_stats["misses"] += 1
+            user_doc = await db.users.find_one(
+                {"user_id": user.user_id},
+                {"_id": 0, "user_id": 1, "isPro": 1, "entitlements": 1, "subscription": 1},
+            )
+            is_pro = _user_doc_grants_pro(user_doc)
+            if user_doc:
+                _remember_user_entitlements(request, {**user_doc, "user_id": user.user_id})
+
+    if is_pro:
+        return user
 
-    if user_doc:
-        if user_doc.get("isPro") is True:
-            return user
+    raise HTTPException(status_code=403, detail="Pro subscription required")
 
-        entitlements = user_doc.get("entitlements")
-        if isinstance(entitlements, dict) and entitlements.get("pro") is True:
-            return user
+async def sweep_expired_sessions() -> int:
+    now = datetime.now(timezone.utc)
+    result = await db.user_sessions.delete_many({"expires_at": {"$lt": now}})
+    reaped = int(getattr(result, "deleted_count", 0) or 0)
+    _session_expiry_stats["reaped"] += reaped
+    _session_expiry_stats["sweeps"] += 1
+    _session_expiry_stats["last_sweep_at"] = now
+    return reaped
 
-        subscription = user_doc.get("subscription")
-        if isinstance(subscription, dict) and subscription.get("pro") is True:
-            return user
 
-    raise HTTPException(status_code=403, detail="Pro subscription required")
+async def _session_sweeper_loop() -> None:
+    while True:
+        try:
+            reaped = await sweep_expired_sessions()
+            if reaped:
+                logger.info(f"Session sweeper reaped {reaped} expired sessions")
+        except Exception as e:
+            logger.error(f"Session sweeper failed: {e}")
+        await asyncio.sleep(SESSION_SWEEP_INTERVAL_SECONDS)
+
+
+async def ensure_session_expiry() -> str:
+    """
+    Lets MongoDB expire sessions through a TTL index on expires_at. Deployments
+    that cannot use TTL indexes (SESSION_EXPIRY_MODE=sweeper, or index creation
+    fails) get a periodic in-process sweeper instead.
+    """
+    mode = "sweeper"
+    if SESSION_EXPIRY_MODE == "ttl_index":
+        try:
+            await db.user_sessions.create_index(
+                "expires_at",
+                name="user_sessions_expires_at_ttl",
+                expireAfterSeconds=0,
+            )
+            mode = "ttl_index"
+        except Exception as e:
+            logger.warning(f"TTL index on user_sessions.expires_at unavailable, using sweeper: {e}")
+
+    if mode == "sweeper":
+        task = _background_tasks.get("session_sweeper")
+        if task is None or task.done():
+            _background_tasks["session_sweeper"] = asyncio.ensure_future(_session_sweeper_loop())
+
+    _session_expiry_stats["mode"] = mode
+    return mode
+
+
+async def get_session_expiry_stats() -> Dict[str, Any]:
+    now = datetime.now(timezone.utc)
+    live, expired_pending = await asyncio.gather(
+        db.user_sessions.count_documents({"expires_at": {"$gte": now}}),
+        db.user_sessions.count_documents({"expires_at": {"$lt": now}}),
+    )
+    last_sweep_at = _session_expiry_stats["last_sweep_at"]
+    return {
+        "mode": _session_expiry_stats["mode"],
+        "live_sessions": live,
+        "expired_pending": expired_pending,
+        "reaped": _session_expiry_stats["reaped"],
+        "sweeps": _session_expiry_stats["sweeps"],
+        "last_sweep_at": last_sweep_at.isoformat() if last_sweep_at else None,
+    }
 
 # ============== Auth Endpoints ==============
 
+DEFAULT_USER_GOALS = {
+    "daily_calories": 2000,
+    "protein_grams": 150,
+    "carbs_grams": 200,
+    "fat_grams": 65,
+    "workouts_per_week": 4
+}
+DEFAULT_USER_EQUIPMENT = ["dumbbells", "barbell", "pullup_bar"]
+
 @api_router.post("/auth/session")
 async def exchange_session(request: Request, response: Response):
     """Exchange session_id from OAuth callback for session_token"""
@@ -835,65 +1699,71 @@ async def exchange_session(request: Request, response: Response):
         raise HTTPException(status_code=400, detail="session_id required")
     
     # Call Emergent Auth to get user data
-    async with httpx.AsyncClient() as client:
-        try:
-            auth_response = await client.get(
-                "https://demobackend.emergentagent.com/auth/v1/env/oauth/session-data",
-                headers={"X-Session-ID": session_id}
-            )
-            if auth_response.status_code != 200:
-                raise HTTPException(status_code=401, detail="Invalid session_id")
-            
-            auth_data = auth_response.json()
-        except Exception as e:
-            logger.error(f"Auth error: {e}")
-            raise HTTPException(status_code=401, detail="Authentication failed")
-    
+    try:
+        auth_response = await get_outbound_http_client().get(
+            EMERGENT_SESSION_DATA_URL,
+            headers={"X-Session-ID": session_id}
+        )
+        if auth_response.status_code != 200:
+            raise HTTPException(status_code=401, detail="Invalid session_id")
+
+        auth_data = auth_response.json()
+    except Exception as e:
+        logger.error(f"Auth error: {e}")
+        raise HTTPException(status_code=401, detail="Authentication failed")
+
     email = auth_data["email"]
     name = auth_data["name"]
     picture = auth_data.get("picture")
     session_token = auth_data["session_token"]
-    
-    # Check if user exists
-    existing_user = await db.users.find_one({"email": email}, {"_id": 0})
-    
-    if existing_user:
-        user_id = existing_user["user_id"]
-        # Update user info if needed
-        await db.users.update_one(
+    now = datetime.now(timezone.utc)
+
+    # Create or refresh the user in one atomic upsert that returns the document.
+    user_upsert = {
+        "$set": {"name": name, "picture": picture},
+        "$setOnInsert": {
+            "user_id": f"user_{uuid.uuid4().hex[:12]}",
+            "email": email,
+            "created_at": now,
+            "goals": dict(DEFAULT_USER_GOALS),
+            "equipment": list(DEFAULT_USER_EQUIPMENT),
+        },
+        "$inc": {"profile_version": 1},
+    }
+    try:
+        user = await db.users.find_one_and_update(
             {"email": email},
-            {"$set": {"name": name, "picture": picture}}
+            user_upsert,
+            projection={"_id": 0},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
         )
-    else:
-        # Create new user
-        user_id = f"user_{uuid.uuid4().hex[:12]}"
-        new_user = {
-            "user_id": user_id,
-            "email": email,
-            "name": name,
-            "picture": picture,
-            "created_at": datetime.now(timezone.utc),
-            "goals": {
-                "daily_calories": 2000,
-                "protein_grams": 150,
-                "carbs_grams": 200,
-                "fat_grams": 65,
-                "workouts_per_week": 4
-            },
-            "equipment": ["dumbbells", "barbell", "pullup_bar"]
-        }
-        await db.users.insert_one(new_user)
-    
-    # Store session
-    expires_at = datetime.now(timezone.utc) + timedelta(days=7)
-    await db.user_sessions.delete_many({"user_id": user_id})  # Remove old sessions
-    await db.user_sessions.insert_one({
+    except DuplicateKeyError:
+        # A concurrent login inserted the user first; the retry matches it.
+        user = await db.users.find_one_and_update(
+            {"email": email},
+            user_upsert,
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+    user_id = user["user_id"]
+
+    # Store session, replacing any older sessions for the user concurrently.
+    expires_at = now + timedelta(days=7)
+    session_doc = {
         "user_id": user_id,
         "session_token": session_token,
         "expires_at": expires_at,
-        "created_at": datetime.now(timezone.utc)
-    })
-    
+        "created_at": now
+    }
+    if SESSION_EMBED_USER_SNAPSHOT:
+        session_doc["user_snapshot"] = build_user_snapshot(user)
+    invalidate_session_cache(user_id=user_id)
+    await asyncio.gather(
+        db.user_sessions.delete_many({"user_id": user_id, "session_token": {"$ne": session_token}}),
+        db.user_sessions.replace_one({"session_token": session_token}, session_doc, upsert=True),
+    )
+
     # Set cookie
     response.set_cookie(
         key="session_token",
@@ -904,8 +1774,7 @@ async def exchange_session(request: Request, response: Response):
         max_age=7 * 24 * 60 * 60,
         path="/"
     )
-    
-    user = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+
     return {"user": user, "session_token": session_token}
 
 @api_router.get("/auth/me")
@@ -920,6 +1789,7 @@ async def logout(request: Request, response: Response):
     session_token = request.cookies.get("session_token")
     if session_token:
         await db.user_sessions.delete_one({"session_token": session_token})
+        invalidate_session_cache(session_token=session_token)
     
     response.delete_cookie(key="session_token", path="/")
     return {"message": "Logged out"}
@@ -930,20 +1800,28 @@ async def logout(request: Request, response: Response):
 async def update_goals(goals: UserGoals, request: Request, user: User = Depends(get_current_user)):
     """Update user nutrition/fitness goals"""
     await enforce_mutation_rate_limit(request, "user.goals", user.user_id, limit=30, window_seconds=60)
-    await db.users.update_one(
+    updated_user = await db.users.find_one_and_update(
         {"user_id": user.user_id},
-        {"$set": {"goals": goals.model_dump()}}
+        {"$set": {"goals": goals.model_dump()}, "$inc": {"profile_version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
     )
+    await refresh_session_user_snapshots(updated_user)
+    invalidate_session_cache(user_id=user.user_id)
     return {"message": "Goals updated", "goals": goals.model_dump()}
 
 @api_router.put("/user/equipment")
 async def update_equipment(equipment: UserEquipment, request: Request, user: User = Depends(get_current_user)):
     """Update user's home gym equipment"""
     await enforce_mutation_rate_limit(request, "user.equipment", user.user_id, limit=30, window_seconds=60)
-    await db.users.update_one(
+    updated_user = await db.users.find_one_and_update(
         {"user_id": user.user_id},
-        {"$set": {"equipment": equipment.equipment}}
+        {"$set": {"equipment": equipment.equipment}, "$inc": {"profile_version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER,
     )
+    await refresh_session_user_snapshots(updated_user)
+    invalidate_session_cache(user_id=user.user_id)
     return {"message": "Equipment updated", "equipment": equipment.equipment}
 
 # ============== Exercise Database ==============
@@ -995,75 +1873,439 @@ DEFAULT_EXERCISES = [
     {"name": "Ab Wheel Rollouts", "category": "core", "equipment_required": [], "muscle_groups": ["abs", "core"], "is_compound": True},
 ]
 
+EXERCISE_PROJECTION = {
+    "_id": 0,
+    "exercise_id": 1,
+    "name": 1,
+    "category": 1,
+    "equipment_required": 1,
+    "muscle_groups": 1,
+    "description": 1
+}
+EXERCISE_RESPONSE_LIMIT = 100
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "30"))
+EQUIPMENT_BITS: Dict[str, int] = {name: 1 << idx for idx, name in enumerate(sorted(ALLOWED_EQUIPMENT))}
+CATALOG_CACHE_MAX_AGE_SECONDS = int(os.getenv("CATALOG_CACHE_MAX_AGE_SECONDS", "300"))
+CATALOG_CACHE_CONTROL = f"public, max-age={CATALOG_CACHE_MAX_AGE_SECONDS}"
+CATALOG_PRIVATE_CACHE_CONTROL = f"private, max-age={CATALOG_CACHE_MAX_AGE_SECONDS}"
+CATALOG_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("CATALOG_RESPONSE_CACHE_MAX_ENTRIES", "256"))
+CATALOG_GZIP_MIN_BYTES = int(os.getenv("CATALOG_GZIP_MIN_BYTES", "1024"))
+_exercise_catalog: Dict[str, Any] = {
+    "version": None,
+    "equipment_bits": dict(EQUIPMENT_BITS),
+    "buckets": {},
+}
+_exercise_catalog_lock = asyncio.Lock()
+# catalog name -> (version, monotonic time it was read)
+_catalog_version_cache: Dict[str, Tuple[int, float]] = {}
+# (catalog name, version, *filter params) -> {"body": bytes, "gzip": bytes | None}
+_catalog_response_cache: "OrderedDict[Tuple[Any, ...], Dict[str, Optional[bytes]]]" = OrderedDict()
+_catalog_response_cache_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+async def get_catalog_version(name: str) -> int:
+    version_doc = await db.catalog_versions.find_one({"_id": name}, {"version": 1})
+    return int(version_doc.get("version", 0)) if version_doc else 0
+
+
+async def current_catalog_version(name: str) -> int:
+    """Catalog version as seen by this process, re-read at most every CATALOG_VERSION_CHECK_SECONDS."""
+    cached = _catalog_version_cache.get(name)
+    now = time.monotonic()
+    if cached and now - cached[1] < CATALOG_VERSION_CHECK_SECONDS:
+        return cached[0]
+
+    version = await get_catalog_version(name)
+    _catalog_version_cache[name] = (version, now)
+    return version
+
+
+async def bump_catalog_version(name: str) -> None:
+    """Writers to a reference catalog call this so in-memory snapshots and ETags roll over."""
+    await db.catalog_versions.update_one(
+        {"_id": name},
+        {"$inc": {"version": 1}, "$set": {"updated_at": datetime.now(timezone.utc)}},
+        upsert=True,
+    )
+    _catalog_version_cache.pop(name, None)
+
+
+def catalog_etag(name: str, version: int, *params: Any) -> str:
+    digest = hashlib.sha256(f"{name}:{version}:{params!r}".encode("utf-8")).hexdigest()[:32]
+    return f'"{name}-{digest}"'
+
+
+def gzip_etag(etag: str) -> str:
+    """Strong validator for the gzip body, which differs byte-for-byte from the identity one."""
+    return f'{etag[:-1]}-gz"'
+
+
+def _if_none_match(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {candidate.strip().removeprefix("W/") for candidate in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def _accepts_gzip(request: Request) -> bool:
+    for encoding in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = encoding.strip().partition(";")
+        if name.strip().lower() in ("gzip", "*"):
+            return params.replace(" ", "").lower() not in ("q=0", "q=0.0", "q=0.00", "q=0.000")
+    return False
+
+
+def serialize_catalog_payload(payload: Any) -> Dict[str, Optional[bytes]]:
+    """Encodes a catalog payload the way JSONResponse would, plus a gzip copy when it is worth it."""
+    body = json.dumps(
+        jsonable_encoder(payload),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+    compressed = gzip.compress(body, mtime=0) if len(body) >= CATALOG_GZIP_MIN_BYTES else None
+    return {"body": body, "gzip": compressed}
+
+
+def get_catalog_response_cache_stats() -> Dict[str, Any]:
+    return {
+        **_cache_stats_snapshot(_catalog_response_cache_stats, _catalog_response_cache, CATALOG_RESPONSE_CACHE_MAX_ENTRIES),
+        "bytes": sum(
+            len(entry["body"]) + len(entry["gzip"] or b"")
+            for entry in _catalog_response_cache.values()
+        ),
+    }
+
+
+async def catalog_response(
+    request: Request,
+    name: str,
+    version: int,
+    params: Tuple[Any, ...],
+    load: Callable[[], Awaitable[Any]],
+    cache_control: str = CATALOG_CACHE_CONTROL,
+    cacheable: bool = True,
+) -> Response:
+    """
+    Serves a catalog read as raw bytes. The ETag is derived from the catalog
+    version and filter params, so a matching If-None-Match is answered with a
+    304 before any work. Otherwise the payload for this (version, params) is
+    serialized once and reused until the version moves on; old versions
+    simply age out of the LRU.
+    """
+    etag = catalog_etag(name, version, *params)
+    headers = {"Cache-Control": cache_control, "Vary": "Accept-Encoding"}
+    for candidate in (etag, gzip_etag(etag)):
+        if _if_none_match(request, candidate):
+            return Response(status_code=304, headers={**headers, "ETag": candidate})
+
+    key = (name, version, *params)
+    entry = _catalog_response_cache.get(key)
+    if entry is not None:
+        _catalog_response_cache_stats["hits"] += 1
+        _catalog_response_cache.move_to_end(key)
+    else:
+        _catalog_response_cache_stats["misses"] += 1
+        entry = serialize_catalog_payload(await load())
+        if cacheable:
+            _catalog_response_cache[key] = entry
+            while len(_catalog_response_cache) > max(CATALOG_RESPONSE_CACHE_MAX_ENTRIES, 1):
+                _catalog_response_cache.popitem(last=False)
+                _catalog_response_cache_stats["evictions"] += 1
+
+    if entry["gzip"] is not None and _accepts_gzip(request):
+        return Response(
+            content=entry["gzip"],
+            media_type="application/json",
+            headers={**headers, "ETag": gzip_etag(etag), "Content-Encoding": "gzip"},
+        )
+    return Response(content=entry["body"], media_type="application/json", headers={**headers, "ETag": etag})
+
+
+def equipment_mask(equipment: List[str], equipment_bits: Optional[Dict[str, int]] = None) -> int:
+    """Compiles an equipment list to a bitmask; unknown names contribute no bits."""
+    bits = equipment_bits if equipment_bits is not None else _exercise_catalog["equipment_bits"]
+    mask = 0
+    for item in equipment:
+        mask |= bits.get(item.strip().lower(), 0)
+    return mask
+
+
+def build_exercise_catalog(exercises: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Buckets exercises by category (None = all) as (required_mask, exercise)
+    pairs. Equipment outside ALLOWED_EQUIPMENT gets its own bit, which no
+    user mask can contain, so those exercises are never offered.
+    """
+    equipment_bits = dict(EQUIPMENT_BITS)
+    buckets: Dict[Optional[str], List[Tuple[int, Dict[str, Any]]]] = {None: []}
+    for exercise in exercises:
+        required_mask = 0
+        for item in exercise.get("equipment_required") or []:
+            name = item.strip().lower()
+            if name not in equipment_bits:
+                equipment_bits[name] = 1 << len(equipment_bits)
+            required_mask |= equipment_bits[name]
+        entry = (required_mask, exercise)
+        buckets[None].append(entry)
+        buckets.setdefault(exercise.get("category"), []).append(entry)
+    return {"equipment_bits": equipment_bits, "buckets": buckets}
+
+
+async def ensure_exercise_catalog() -> Dict[str, Any]:
+    """Returns the in-memory exercise snapshot, reloading it only when the catalog version changed."""
+    version = await current_catalog_version("exercises")
+    if version == _exercise_catalog["version"]:
+        return _exercise_catalog
+
+    async with _exercise_catalog_lock:
+        if version != _exercise_catalog["version"]:
+            exercises = await db.exercises.find({}, EXERCISE_PROJECTION).to_list(length=None)
+            _exercise_catalog.update(build_exercise_catalog(exercises))
+            _exercise_catalog["version"] = version
+    return _exercise_catalog
+
+
+def filter_exercise_catalog(catalog: Dict[str, Any], category: Optional[str], available_mask: Optional[int]) -> List[Dict[str, Any]]:
+    bucket = catalog["buckets"].get(category if category else None, [])
+    if available_mask is None:
+        exercises = [exercise for _, exercise in bucket]
+    else:
+        # Keep an exercise when every required bit is present in the available mask.
+        exercises = [exercise for required_mask, exercise in bucket if not required_mask & ~available_mask]
+    return exercises[:EXERCISE_RESPONSE_LIMIT]
+
+
 @api_router.get("/exercises")
-async def get_exercises(category: Optional[str] = None, equipment: Optional[str] = None):
+async def get_exercises(
+    request: Request,
+    category: Optional[str] = None,
+    equipment: Optional[str] = None,
+):
     """Get exercises, optionally filtered by category or equipment"""
-    # Initialize exercises in DB if empty
-    count = await db.exercises.count_documents({})
-    if count == 0:
-        for ex in DEFAULT_EXERCISES:
-            ex_obj = Exercise(**ex)
-            await db.exercises.insert_one(ex_obj.model_dump())
-    
-    query = {}
-    if category:
-        query["category"] = category
-    
-    # Optimized projection for exercises
-    projection = {
-        "_id": 0,
-        "exercise_id": 1,
-        "name": 1,
-        "category": 1,
-        "equipment_required": 1,
-        "muscle_groups": 1,
-        "description": 1
-    }
-    exercises = await db.exercises.find(query, projection).to_list(100)
-    
-    # Filter by equipment if provided
-    if equipment:
-        equipment_list = equipment.split(",")
-        exercises = [
-            ex for ex in exercises 
-            if not ex["equipment_required"] or 
-            any(eq in equipment_list for eq in ex["equipment_required"])
-        ]
-    
-    return exercises
+    catalog = await ensure_exercise_catalog()
+    available_mask = equipment_mask(equipment.split(","), catalog["equipment_bits"]) if equipment else None
+
+    async def _load():
+        return filter_exercise_catalog(catalog, category, available_mask)
+
+    return await catalog_response(
+        request,
+        "exercises",
+        catalog["version"],
+        (category or "", available_mask),
+        _load,
+    )
 
 @api_router.get("/exercises/for-user")
-async def get_exercises_for_user(user: User = Depends(get_current_user), category: Optional[str] = None):
+async def get_exercises_for_user(
+    request: Request,
+    user: User = Depends(get_current_user),
+    category: Optional[str] = None,
+):
     """Get exercises filtered by user's equipment"""
-    user_equipment = user.equipment or []
-    
-    # Always include bodyweight exercises (no equipment)
-    user_equipment_set = set(user_equipment)
-    
-    query = {}
-    if category:
-        query["category"] = category
-    
-    # Optimized projection for exercises
-    projection = {
-        "_id": 0,
-        "exercise_id": 1,
-        "name": 1,
-        "category": 1,
-        "equipment_required": 1,
-        "muscle_groups": 1,
-        "description": 1
+    catalog = await ensure_exercise_catalog()
+    # Exercises with no required equipment have an empty mask and always match.
+    available_mask = equipment_mask(user.equipment or [], catalog["equipment_bits"])
+
+    async def _load():
+        return filter_exercise_catalog(catalog, category, available_mask)
+
+    # Same bytes as /exercises for an equal mask; only the cache scope differs.
+    return await catalog_response(
+        request,
+        "exercises",
+        catalog["version"],
+        (category or "", available_mask),
+        _load,
+        cache_control=CATALOG_PRIVATE_CACHE_CONTROL,
+    )
+
+# ============== Delta Sync ==============
+
+# Synced collection -> the id clients key documents by.
+SYNC_COLLECTIONS: Dict[str, str] = {
+    "workouts": "workout_id",
+    "daily_nutrition": "nutrition_id",
+    "body_measurements": "measurement_id",
+}
+SYNC_PAGE_LIMIT = 500
+SYNC_TOMBSTONE_RETENTION_DAYS = int(os.getenv("SYNC_TOMBSTONE_RETENTION_DAYS", "90"))
+# A reservation still pending after this long belongs to a writer that died
+# mid-request; sync stops waiting for it.
+SYNC_PENDING_ABANDON_SECONDS = float(os.getenv("SYNC_PENDING_ABANDON_SECONDS", "300"))
+
+
+@asynccontextmanager
+async def tracked_changes(user_id: str, count: int = 1) -> AsyncIterator[List[Dict[str, Any]]]:
+    """
+    Reserves `count` sequence numbers from the user's counter and yields one
+    stamp (change_seq, updated_at) per change. Each document write must set
+    its stamp inside the block. The reservation stays listed as pending on the
+    counter until the block exits, and sync never reads past the lowest
+    pending sequence, so a slow write can't land behind a client's token.
+    """
+    now = datetime.now(timezone.utc)
+    counter = await db.user_change_counters.find_one_and_update(
+        {"_id": user_id},
+        [
+            {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, count]}}},
+            {"$set": {"pending": {"$concatArrays": [
+                {"$ifNull": ["$pending", []]},
+                [{"first": {"$subtract": ["$seq", count - 1]}, "at": now}],
+            ]}}},
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER,
+    )
+    first_seq = int(counter["seq"]) - count + 1
+    try:
+        yield [{"change_seq": first_seq + offset, "updated_at": now} for offset in range(count)]
+    finally:
+        await db.user_change_counters.update_one({"_id": user_id}, {"$pull": {"pending": {"first": first_seq}}})
+
+
+@asynccontextmanager
+async def tracked_change(user_id: str) -> AsyncIterator[Dict[str, Any]]:
+    """tracked_changes for a single write."""
+    async with tracked_changes(user_id) as stamps:
+        yield stamps[0]
+
+
+async def committed_change_seq(user_id: str) -> int:
+    """Highest sequence at or below which every reserved write has finished."""
+    counter = await db.user_change_counters.find_one({"_id": user_id}, {"_id": 0, "seq": 1, "pending": 1})
+    if not counter:
+        return 0
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=SYNC_PENDING_ABANDON_SECONDS)
+    pending = [entry["first"] for entry in counter.get("pending") or [] if _normalize_datetime(entry["at"]) > cutoff]
+    if len(pending) < len(counter.get("pending") or []):
+        await db.user_change_counters.update_one({"_id": user_id}, {"$pull": {"pending": {"at": {"$lte": cutoff}}}})
+    return min(pending) - 1 if pending else int(counter.get("seq") or 0)
+
+
+async def record_tombstone(user_id: str, collection_name: str, doc_id: str) -> None:
+    async with tracked_change(user_id) as stamp:
+        await db.sync_tombstones.insert_one({
+            "user_id": user_id,
+            "collection": collection_name,
+            "doc_id": doc_id,
+            "deleted_at": stamp["updated_at"],
+            **stamp,
+        })
+
+
+def encode_sync_token(seq: int, issued_at: Optional[datetime] = None) -> str:
+    issued_at = issued_at or datetime.now(timezone.utc)
+    raw = json.dumps({"s": seq, "t": int(issued_at.timestamp())}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_sync_token(token: str) -> Tuple[int, datetime]:
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)))
+        seq = int(payload["s"])
+        issued_at = datetime.fromtimestamp(int(payload["t"]), tz=timezone.utc)
+    except (ValueError, TypeError, KeyError, OverflowError):
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    if seq < 0:
+        raise HTTPException(status_code=400, detail="Invalid sync token")
+    return seq, issued_at
+
+
+async def stamp_unsequenced_documents(user_id: str) -> int:
+    """
+    Gives documents written before change tracking a sequence number, so an
+    initial sync can page through them like any other change. Runs per user,
+    only when a client syncs from scratch.
+    """
+    stamped = 0
+    for collection_name in SYNC_COLLECTIONS:
+        collection = db[collection_name]
+        docs = await collection.find(
+            {"user_id": user_id, "change_seq": None},
+            {"_id": 1, "created_at": 1},
+        ).to_list(length=None)
+        if not docs:
+            continue
+
+        async with tracked_changes(user_id, len(docs)) as stamps:
+            operations = [
+                UpdateOne(
+                    {"_id": doc["_id"], "change_seq": None},
+                    {"$set": {**stamp, "updated_at": doc.get("created_at") or stamp["updated_at"]}},
+                )
+                for doc, stamp in zip(docs, stamps)
+            ]
+            await collection.bulk_write(operations, ordered=False)
+        stamped += len(docs)
+    return stamped
+
+
+@api_router.get("/sync/changes")
+async def get_sync_changes(
+    user: User = Depends(get_current_user),
+    since: Optional[str] = None,
+    limit: int = Query(SYNC_PAGE_LIMIT, ge=1, le=SYNC_PAGE_LIMIT),
+):
+    """
+    Workouts, nutrition days and measurements created, updated or deleted
+    after `since`, oldest change first. Omit `since` for a full sync; keep
+    calling with `next_token` while `has_more` is true. `reset` means the token
+    is older than tombstone retention and the client must resync from scratch.
+    """
+    since_seq = 0
+    if since:
+        since_seq, issued_at = decode_sync_token(since)
+        if datetime.now(timezone.utc) - issued_at > timedelta(days=SYNC_TOMBSTONE_RETENTION_DAYS):
+            return {"reset": True, "changes": {}, "deleted": {}, "next_token": None, "has_more": False}
+    else:
+        await stamp_unsequenced_documents(user.user_id)
+
+    # Only changes whose writes have all finished are visible; anything above
+    # the committed mark waits for the next call.
+    committed_seq = max(await committed_change_seq(user.user_id), since_seq)
+    query = {"user_id": user.user_id, "change_seq": {"$gt": since_seq, "$lte": committed_seq}}
+    fetched = await asyncio.gather(
+        *[
+            db[collection_name].find(query, {"_id": 0}).sort("change_seq", 1).limit(limit).to_list(limit)
+            for collection_name in SYNC_COLLECTIONS
+        ],
+        db.sync_tombstones.find(query, {"_id": 0, "collection": 1, "doc_id": 1, "change_seq": 1, "updated_at": 1})
+        .sort("change_seq", 1)
+        .limit(limit)
+        .to_list(limit),
+    )
+
+    # Merge every source by sequence and keep the lowest `limit`; each source
+    # returned its own lowest `limit`, so nothing at or below the cut is missing.
+    # A source that filled its page may hold more rows past the cut, so the
+    # page is only final when every source came back short.
+    merged: List[Tuple[int, Optional[str], Dict[str, Any]]] = []
+    for collection_name, docs in zip(SYNC_COLLECTIONS, fetched[:-1]):
+        merged.extend((doc["change_seq"], collection_name, doc) for doc in docs)
+    merged.extend((doc["change_seq"], None, doc) for doc in fetched[-1])
+    merged.sort(key=lambda item: item[0])
+    has_more = len(merged) > limit or any(len(docs) >= limit for docs in fetched)
+    merged = merged[:limit]
+
+    changes: Dict[str, List[Dict[str, Any]]] = {collection_name: [] for collection_name in SYNC_COLLECTIONS}
+    deleted: Dict[str, List[str]] = {collection_name: [] for collection_name in SYNC_COLLECTIONS}
+    for _seq, collection_name, doc in merged:
+        if collection_name is None:
+            deleted.setdefault(doc["collection"], []).append(doc["doc_id"])
+        else:
+            changes[collection_name].append(doc)
+
+    return {
+        "reset": False,
+        "changes": changes,
+        "deleted": deleted,
+        "next_token": encode_sync_token(merged[-1][0] if has_more else committed_seq),
+        "has_more": has_more,
     }
-    exercises = await db.exercises.find(query, projection).to_list(100)
-    
-    # Filter: include if no equipment needed OR user has the required equipment
-    filtered = [
-        ex for ex in exercises
-        if not ex["equipment_required"] or
-        all(eq in user_equipment_set for eq in ex["equipment_required"])
-    ]
-    
-    return filtered
 
 # ============== Workout Endpoints ==============
 
@@ -1079,16 +2321,180 @@ async def create_workout(workout: WorkoutCreate, request: Request, user: User =
         duration_minutes=workout.duration_minutes,
         notes=workout.notes
     )
-    await db.workouts.insert_one(workout_obj.model_dump())
-    return workout_obj.model_dump()
+    workout_doc = workout_obj.model_dump()
+    workout_doc["summary"] = build_workout_summary(workout_doc["exercises"], workout_doc["duration_minutes"])
+    async with tracked_change(user.user_id) as stamp:
+        workout_doc.update(stamp)
+        await db.workouts.insert_one(dict(workout_doc))
+    return workout_doc
+
+@api_router.post("/workouts/batch")
+async def create_workouts_batch(payload: WorkoutBatchCreate, request: Request, user: User = Depends(get_current_user)):
+    """
+    Replays workouts logged offline in one unordered bulk write. Each item's
+    client_id is stored as client_workout_id and the insert is an upsert on
+    (user_id, client_workout_id), so resending a batch never duplicates a
+    workout. Returns one result per item, in request order.
+    """
+    await enforce_mutation_rate_limit(request, "workouts.batch", user.user_id, limit=10, window_seconds=60)
+
+    results: List[Dict[str, Any]] = []
+    pending_docs: List[Dict[str, Any]] = []
+    op_items: List[int] = []
+    seen: Set[str] = set()
+    for item in payload.items:
+        result = {"client_id": item.client_id, "status": "duplicate", "workout_id": None}
+        results.append(result)
+        if item.client_id in seen:
+            continue
+        seen.add(item.client_id)
+
+        workout_doc = Workout(
+            user_id=user.user_id,
+            date=item.date or datetime.now(timezone.utc),
+            name=item.name,
+            exercises=item.exercises,
+            duration_minutes=item.duration_minutes,
+            notes=item.notes,
+        ).model_dump()
+        workout_doc["summary"] = build_workout_summary(workout_doc["exercises"], workout_doc["duration_minutes"])
+        workout_doc["client_workout_id"] = item.client_id
+        result["workout_id"] = workout_doc["workout_id"]
+
+        pending_docs.append(workout_doc)
+        op_items.append(len(results) - 1)
+
+    # One counter round trip covers the whole batch; replays that turn out to
+    # be duplicates just leave gaps in the user's sequence.
+    upserted: Set[int] = set()
+    write_errors: Dict[int, Dict[str, Any]] = {}
+    async with tracked_changes(user.user_id, len(pending_docs)) as stamps:
+        operations: List[UpdateOne] = []
+        for workout_doc, stamp in zip(pending_docs, stamps):
+            workout_doc.update(stamp)
+            operations.append(
+                UpdateOne(
+                    {"user_id": user.user_id, "client_workout_id": workout_doc["client_workout_id"]},
+                    {"$setOnInsert": workout_doc},
+                    upsert=True,
+                )
+            )
+
+        try:
+            bulk_result = await db.workouts.bulk_write(operations, ordered=False)
+            upserted = set((bulk_result.upserted_ids or {}).keys())
+        except BulkWriteError as e:
+            details = e.details or {}
+            upserted = {entry["index"] for entry in details.get("upserted", [])}
+            write_errors = {entry["index"]: entry for entry in details.get("writeErrors", [])}
+
+    for op_index, item_index in enumerate(op_items):
+        error = write_errors.get(op_index)
+        if op_index in upserted:
+            results[item_index]["status"] = "created"
+        elif error and error.get("code") != 11000:
+            results[item_index].update({"status": "error", "workout_id": None, "error": error.get("errmsg", "write failed")})
+        else:
+            # Already stored by an earlier replay (or a concurrent one: duplicate key).
+            results[item_index]["workout_id"] = None
+
+    # Existing workouts keep their original ids; look them up for the client.
+    existing_ids = [result["client_id"] for result in results if result["status"] == "duplicate"]
+    if existing_ids:
+        existing = await db.workouts.find(
+            {"user_id": user.user_id, "client_workout_id": {"$in": existing_ids}},
+            {"_id": 0, "workout_id": 1, "client_workout_id": 1},
+        ).to_list(length=len(existing_ids))
+        workout_ids = {doc["client_workout_id"]: doc["workout_id"] for doc in existing}
+        for result in results:
+            if result["status"] == "duplicate":
+                result["workout_id"] = workout_ids.get(result["client_id"])
+
+    statuses = [result["status"] for result in results]
+    return {
+        "results": results,
+        "created": statuses.count("created"),
+        "duplicates": statuses.count("duplicate"),
+        "failed": statuses.count("error"),
+    }
+
+WORKOUT_HISTORY_SORT = [("date", -1), ("workout_id", -1)]
+WORKOUT_LIST_PROJECTIONS = {
+    "full": {"_id": 0},
+    "summary": {
+        "_id": 0,
+        "workout_id": 1,
+        "name": 1,
+        "date": 1,
+        "duration_minutes": 1,
+        "created_at": 1,
+        "version": 1,
+        "summary": 1,
+    },
+}
+
+
+def encode_workout_cursor(workout: Dict[str, Any]) -> str:
+    date_value = workout.get("date")
+    payload = {
+        "d": date_value.isoformat() if isinstance(date_value, datetime) else str(date_value),
+        "id": workout.get("workout_id"),
+    }
+    raw = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_workout_cursor(cursor: str) -> Tuple[datetime, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        payload = json.loads(raw)
+        date_value = datetime.fromisoformat(payload["d"])
+        workout_id = payload["id"]
+    except (ValueError, TypeError, KeyError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(workout_id, str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return date_value, workout_id
+
 
 @api_router.get("/workouts")
-async def get_workouts(user: User = Depends(get_current_user), limit: int = 20, skip: int = 0):
-    """Get user's workouts"""
-    workouts = await db.workouts.find(
-        {"user_id": user.user_id}, 
-        {"_id": 0}
-    ).sort("date", -1).skip(skip).limit(limit).to_list(limit)
+async def get_workouts(
+    response: Response,
+    user: User = Depends(get_current_user),
+    limit: int = 20,
+    skip: int = 0,
+    cursor: Optional[str] = None,
+    view: str = Query("full", pattern="^(full|summary)$"),
+):
+    """
+    Get user's workouts, newest first. Passing `cursor` (empty for the first
+    page) switches to keyset pagination and returns {"workouts", "next_cursor"};
+    without it the legacy skip/limit list is returned, with the next cursor in
+    the X-Next-Cursor header. `view=summary` returns header fields plus the
+    stored summary instead of every exercise and set.
+    """
+    query: Dict[str, Any] = {"user_id": user.user_id}
+    if cursor:
+        # Seek past the last (date, workout_id) seen instead of skipping documents.
+        cursor_date, cursor_workout_id = decode_workout_cursor(cursor)
+        query["$or"] = [
+            {"date": {"$lt": cursor_date}},
+            {"date": cursor_date, "workout_id": {"$lt": cursor_workout_id}},
+        ]
+
+    find_cursor = db.workouts.find(query, WORKOUT_LIST_PROJECTIONS[view]).sort(WORKOUT_HISTORY_SORT)
+    if cursor is None and skip:
+        find_cursor = find_cursor.skip(skip)
+    workouts = await find_cursor.limit(limit).to_list(limit)
+    if view == "summary":
+        await load_workout_summaries(workouts)
+
+    next_cursor = encode_workout_cursor(workouts[-1]) if workouts and len(workouts) >= limit else None
+    if cursor is not None:
+        return {"workouts": workouts, "next_cursor": next_cursor}
+
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return workouts
 
 @api_router.get("/workouts/{workout_id}")
@@ -1103,20 +2509,52 @@ async def get_workout(workout_id: str, user: User = Depends(get_current_user)):
     return workout
 
 @api_router.put("/workouts/{workout_id}")
-async def update_workout(workout_id: str, workout: WorkoutCreate, request: Request, user: User = Depends(get_current_user)):
-    """Update a workout"""
+async def update_workout(workout_id: str, workout: WorkoutUpdate, request: Request, user: User = Depends(get_current_user)):
+    """Update a workout, optionally only if it is still at `version`"""
     await enforce_mutation_rate_limit(request, "workouts.update", user.user_id, limit=30, window_seconds=60)
-    existing = await db.workouts.find_one({"workout_id": workout_id, "user_id": user.user_id})
-    if not existing:
-        raise HTTPException(status_code=404, detail="Workout not found")
-    
     update_data = workout.model_dump(exclude_unset=True)
-    await db.workouts.update_one(
-        {"workout_id": workout_id},
-        {"$set": update_data}
-    )
-    
-    updated = await db.workouts.find_one({"workout_id": workout_id}, {"_id": 0})
+    expected_version = update_data.pop("version", None)
+
+    # A pipeline update, so the summary can be finished from the stored
+    # document in the same write. Client values go in as $literal so they
+    # are never evaluated as expressions.
+    new_fields: Dict[str, Any] = {field: {"$literal": value} for field, value in update_data.items()}
+    if "exercises" in update_data:
+        summary = build_workout_summary(update_data["exercises"], update_data.get("duration_minutes"))
+        if "duration_minutes" in update_data:
+            new_fields["summary"] = {"$literal": summary}
+        else:
+            new_fields["summary"] = {"$mergeObjects": [
+                {"$literal": summary},
+                {"duration_minutes": {"$ifNull": ["$duration_minutes", None]}},
+            ]}
+    elif "duration_minutes" in update_data:
+        # Only a current summary is patched; a legacy workout keeps none and
+        # readers rebuild it from its sets (see workout_summary).
+        new_fields["summary"] = {"$cond": [
+            {"$eq": ["$summary.version", WORKOUT_SUMMARY_VERSION]},
+            {"$mergeObjects": ["$summary", {"duration_minutes": {"$literal": update_data["duration_minutes"]}}]},
+            "$summary",
+        ]}
+
+    query: Dict[str, Any] = {"workout_id": workout_id, "user_id": user.user_id}
+    if expected_version is not None:
+        query["version"] = expected_version
+    async with tracked_change(user.user_id) as stamp:
+        new_fields.update({field: {"$literal": value} for field, value in stamp.items()})
+        new_fields["version"] = {"$add": [{"$ifNull": ["$version", 0]}, 1]}
+        updated = await db.workouts.find_one_and_update(
+            query,
+            [{"$set": new_fields}],
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER,
+        )
+    if updated is None:
+        if expected_version is not None and await db.workouts.find_one(
+            {"workout_id": workout_id, "user_id": user.user_id}, {"_id": 1}
+        ):
+            raise HTTPException(status_code=409, detail="Workout was changed by another request")
+        raise HTTPException(status_code=404, detail="Workout not found")
     return updated
 
 @api_router.delete("/workouts/{workout_id}")
@@ -1126,6 +2564,7 @@ async def delete_workout(workout_id: str, request: Request, user: User = Depends
     result = await db.workouts.delete_one({"workout_id": workout_id, "user_id": user.user_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Workout not found")
+    await record_tombstone(user.user_id, "workouts", workout_id)
     return {"message": "Workout deleted"}
 
 # ============== Warm-up Calculator ==============
@@ -1182,15 +2621,16 @@ async def get_progression_suggestions(user: User = Depends(require_pro_user)):
     start_date = datetime.now(timezone.utc) - timedelta(days=30)
     workouts = await db.workouts.find(
         {"user_id": user.user_id, "date": {"$gte": start_date}},
-        {"_id": 0}
+        WORKOUT_SUMMARY_PROJECTION
     ).sort("date", -1).to_list(50)
+    await load_workout_summaries(workouts)
     
     # Analyze exercise performance
     exercise_history: Dict[str, List[Dict]] = {}
     
     for workout in workouts:
         workout_date = workout.get("date")
-        for exercise in workout.get("exercises", []):
+        for exercise in workout["summary"]["exercises"]:
             ex_name = exercise.get("exercise_name")
             if not ex_name:
                 continue
@@ -1198,20 +2638,15 @@ async def get_progression_suggestions(user: User = Depends(require_pro_user)):
             if ex_name not in exercise_history:
                 exercise_history[ex_name] = []
             
-            # Get working sets (non-warmup)
-            working_sets = [s for s in exercise.get("sets", []) if not s.get("is_warmup", False)]
-            
-            if working_sets:
-                max_weight = max(s.get("weight", 0) for s in working_sets)
-                total_reps = sum(s.get("reps", 0) for s in working_sets)
-                avg_rpe = sum(s.get("rpe", 7) for s in working_sets if s.get("rpe")) / len([s for s in working_sets if s.get("rpe")]) if any(s.get("rpe") for s in working_sets) else 7
-                sets_completed = len(working_sets)
+            # Working sets (non-warmup) only
+            if exercise["working_sets"]:
+                avg_rpe = exercise["rpe_sum"] / exercise["rpe_sets"] if exercise["rpe_sets"] else DEFAULT_SET_RPE
                 
                 exercise_history[ex_name].append({
                     "date": workout_date.isoformat() if isinstance(workout_date, datetime) else str(workout_date),
-                    "max_weight": max_weight,
-                    "sets_completed": sets_completed,
-                    "total_reps": total_reps,
+                    "max_weight": exercise["max_weight"],
+                    "sets_completed": exercise["working_sets"],
+                    "total_reps": exercise["total_reps"],
                     "avg_rpe": round(avg_rpe, 1)
                 })
     
@@ -1299,35 +2734,29 @@ async def get_progression_suggestions(user: User = Depends(require_pro_user)):
 @api_router.get("/progression/exercise/{exercise_name}")
 async def get_exercise_progression(exercise_name: str, user: User = Depends(require_pro_user)):
     """Get detailed progression history for a specific exercise"""
-    # Optimized projection - only fetch needed fields
-    projection = {
-        "_id": 0,
-        "workout_id": 1,
-        "date": 1,
-        "exercises": 1
-    }
-    # Get workouts with this exercise, limited to 50 for performance
+    # Get workouts with this exercise, limited to 50 for performance; only the stored summary is fetched
     workouts = await db.workouts.find(
         {"user_id": user.user_id, "exercises.exercise_name": exercise_name},
-        projection
+        WORKOUT_SUMMARY_PROJECTION
     ).sort("date", -1).limit(50).to_list(50)
+    await load_workout_summaries(workouts)
     
     history = []
     for workout in workouts:
         workout_date = workout.get("date")
-        for exercise in workout.get("exercises", []):
-            if exercise.get("exercise_name") == exercise_name:
-                working_sets = [s for s in exercise.get("sets", []) if not s.get("is_warmup", False)]
-                if working_sets:
-                    history.append({
-                        "date": workout_date.isoformat() if isinstance(workout_date, datetime) else str(workout_date),
-                        "workout_id": workout.get("workout_id"),
-                        "max_weight": max(s.get("weight", 0) for s in working_sets),
-                        "total_volume": sum(s.get("weight", 0) * s.get("reps", 0) for s in working_sets),
-                        "sets": len(working_sets),
-                        "total_reps": sum(s.get("reps", 0) for s in working_sets),
-                        "avg_rpe": round(sum(s.get("rpe", 7) for s in working_sets) / len(working_sets), 1)
-                    })
+        for exercise in workout["summary"]["exercises"]:
+            if exercise.get("exercise_name") == exercise_name and exercise["working_sets"]:
+                # Sets without an RPE count as DEFAULT_SET_RPE here.
+                unrated_sets = exercise["working_sets"] - exercise["rpe_sets"]
+                history.append({
+                    "date": workout_date.isoformat() if isinstance(workout_date, datetime) else str(workout_date),
+                    "workout_id": workout.get("workout_id"),
+                    "max_weight": exercise["max_weight"],
+                    "total_volume": exercise["volume"],
+                    "sets": exercise["working_sets"],
+                    "total_reps": exercise["total_reps"],
+                    "avg_rpe": round((exercise["rpe_sum"] + DEFAULT_SET_RPE * unrated_sets) / exercise["working_sets"], 1)
+                })
     
     # Calculate personal records
     if history:
@@ -1404,37 +2833,382 @@ DEFAULT_FOODS = [
     {"name": "Green Beans", "category": "vegetables", "serving_size": "100g", "calories": 31, "protein": 1.8, "carbs": 7, "fat": 0.1, "fiber": 3.4},
 ]
 
+FOOD_PROJECTION = {
+    "_id": 0,
+    "food_id": 1,
+    "name": 1,
+    "category": 1,
+    "calories": 1,
+    "protein": 1,
+    "carbs": 1,
+    "fat": 1,
+    "serving_size": 1,
+    "serving_unit": 1
+}
+FOOD_RESPONSE_LIMIT = 100
+FOOD_SEARCH_CANDIDATE_LIMIT = int(os.getenv("FOOD_SEARCH_CANDIDATE_LIMIT", "500"))
+FOOD_SEARCH_BACKFILL_BATCH = 1000
+_FOOD_NAME_SEPARATORS = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_food_name(name: str) -> str:
+    """Lowercases, strips accents and collapses punctuation so "Jalapeño, raw" == "jalapeno raw"."""
+    ascii_name = unicodedata.normalize("NFKD", name or "").encode("ascii", "ignore").decode("ascii")
+    return " ".join(_FOOD_NAME_SEPARATORS.split(ascii_name.lower())).strip()
+
+
+def food_search_fields(name: str, serving_size: str = "") -> Dict[str, Any]:
+    """
+    Indexed fields stored on every food document: name_tokens backs search,
+    name_length lets it read candidates shortest (best ranked) first, and
+    (name_normalized, serving_normalized) is the dedupe key for imports.
+    """
+    name_normalized = normalize_food_name(name)
+    return {
+        "name_normalized": name_normalized,
+        "name_tokens": sorted(set(name_normalized.split())),
+        "name_length": len(name_normalized),
+        "serving_normalized": normalize_food_name(serving_size),
+    }
+
+
+def _prefix_upper_bound(prefix: str) -> str:
+    """Smallest string greater than every string starting with `prefix`."""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def build_food_search_query(search: str, category: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Every query token must prefix-match some name token. Each clause is an
+    anchored range under $elemMatch so it stays an index range scan on
+    name_tokens instead of the old unanchored regex collection scan.
+    """
+    tokens = normalize_food_name(search).split()
+    if not tokens:
+        return None
+
+    # Longest token first: it is the most selective range for the planner.
+    clauses = []
+    for token in sorted(set(tokens), key=len, reverse=True):
+        clauses.append({"name_tokens": {"$elemMatch": {"$gte": token, "$lt": _prefix_upper_bound(token)}}})
+
+    query: Dict[str, Any] = clauses[0] if len(clauses) == 1 else {"$and": clauses}
+    if category:
+        query = {**query, "category": category}
+    return query
+
+
+def food_search_rank(search_normalized: str, name: str) -> Tuple[int, int, int, str]:
+    """Sort key, lower is better: exact > name prefix > whole-word match > word-prefix match."""
+    name_normalized = normalize_food_name(name)
+    name_tokens = name_normalized.split()
+    query_tokens = search_normalized.split()
+
+    if name_normalized == search_normalized:
+        tier = 0
+    elif name_normalized.startswith(search_normalized):
+        tier = 1
+    elif all(token in name_tokens for token in query_tokens):
+        tier = 2
+    else:
+        tier = 3
+
+    first_position = min(
+        (idx for idx, name_token in enumerate(name_tokens) if name_token.startswith(query_tokens[0])),
+        default=len(name_tokens),
+    )
+    return (tier, first_position, len(name_normalized), name_normalized)
+
+
+FOOD_SEARCH_CANDIDATE_SORT = [("name_length", 1), ("name_normalized", 1)]
+
+
+async def search_foods(search: str, category: Optional[str] = None, limit: int = FOOD_RESPONSE_LIMIT) -> List[Dict[str, Any]]:
+    """
+    Fetches candidates one rank tier at a time, each read shortest name first,
+    so the candidate cap only ever drops the worst-ranked names of a tier:
+    names starting with the search (exact match included), then names holding
+    every query word, then word-prefix matches. Later tiers are only read
+    while earlier ones leave room.
+    """
+    query = build_food_search_query(search, category)
+    if query is None:
+        return []
+
+    search_normalized = normalize_food_name(search)
+    tiers: List[Dict[str, Any]] = [
+        {"name_normalized": {"$gte": search_normalized, "$lt": _prefix_upper_bound(search_normalized)}},
+        {"name_tokens": {"$all": sorted(set(search_normalized.split()))}},
+        query,
+    ]
+    candidates: List[Dict[str, Any]] = []
+    seen: Set[str] = set()
+    for tier_query in tiers:
+        if len(candidates) >= limit:
+            break
+        if category:
+            tier_query = {**tier_query, "category": category}
+        rows = await db.foods.find(tier_query, FOOD_PROJECTION).sort(FOOD_SEARCH_CANDIDATE_SORT).limit(
+            FOOD_SEARCH_CANDIDATE_LIMIT
+        ).to_list(FOOD_SEARCH_CANDIDATE_LIMIT)
+        for food in rows:
+            if food["food_id"] not in seen:
+                seen.add(food["food_id"])
+                candidates.append(food)
+
+    candidates.sort(key=lambda food: food_search_rank(search_normalized, food.get("name", "")))
+    return candidates[:limit]
+
+
+async def ensure_food_search_index() -> int:
+    """
+    Creates the search and dedupe indexes and backfills the derived fields on
+    foods that predate them, in fixed-size batches. Returns the number of
+    documents updated.
+    """
+    try:
+        await db.foods.create_index([("name_tokens", 1), ("category", 1)], name="foods_name_tokens")
+        await db.foods.create_index([("name_tokens", 1), ("name_length", 1)], name="foods_name_tokens_length")
+        await db.foods.create_index([("name_length", 1), ("name_normalized", 1)], name="foods_name_length")
+    except Exception as e:
+        logger.warning(f"Food search index not created: {e}")
+
+    updated = 0
+    batch: List[UpdateOne] = []
+    cursor = db.foods.find(
+        {
+            "$or": [
+                {"name_tokens": {"$exists": False}},
+                {"name_length": {"$exists": False}},
+                {"serving_normalized": {"$exists": False}},
+            ]
+        },
+        {"_id": 1, "name": 1, "serving_size": 1},
+    )
+    async for doc in cursor:
+        fields = food_search_fields(doc.get("name", ""), doc.get("serving_size", ""))
+        batch.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+        if len(batch) >= FOOD_SEARCH_BACKFILL_BATCH:
+            await db.foods.bulk_write(batch, ordered=False)
+            updated += len(batch)
+            batch = []
+    if batch:
+        await db.foods.bulk_write(batch, ordered=False)
+        updated += len(batch)
+
+    if updated:
+        logger.info(f"Backfilled search fields on {updated} foods")
+
+    # After the backfill so pre-existing foods have the key before uniqueness applies.
+    try:
+        await db.foods.create_index(
+            [("name_normalized", 1), ("serving_normalized", 1)],
+            name="foods_normalized_name_serving_unique",
+            unique=True,
+        )
+    except Exception as e:
+        logger.warning(f"Food dedupe index not created: {e}")
+    return updated
+
+
+FOOD_SUGGEST_TOP_K = 10
+FOOD_SUGGEST_PRECOMPUTED_PREFIX_CHARS = 3
+FOOD_SUGGEST_MEMO_MAX_ENTRIES = int(os.getenv("FOOD_SUGGEST_MEMO_MAX_ENTRIES", "4096"))
+FOOD_SUGGEST_REFRESH_SECONDS = float(os.getenv("FOOD_SUGGEST_REFRESH_SECONDS", "3600"))
+FOOD_POPULARITY_LOOKBACK_DAYS = int(os.getenv("FOOD_POPULARITY_LOOKBACK_DAYS", "90"))
+FOOD_SUGGEST_PROJECTION = {
+    "_id": 0,
+    "food_id": 1,
+    "name": 1,
+    "category": 1,
+    "serving_size": 1,
+    "calories": 1,
+    "protein": 1,
+    "carbs": 1,
+    "fat": 1,
+}
+_food_suggest_index: Dict[str, Any] = {
+    "version": None,
+    "built_at": 0.0,
+    # Foods ordered by popularity, so a smaller ref is always a better suggestion.
+    "foods": [],
+    # Sorted normalized keys (full name plus each word-suffix) and the food ref of each key.
+    "keys": [],
+    "refs": [],
+    # Short prefixes cover huge key ranges; their top-k is computed at build time.
+    "top": {},
+    "refresh_task": None,
+}
+_food_suggest_memo: "OrderedDict[str, Tuple[int, ...]]" = OrderedDict()
+_food_suggest_stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "builds": 0}
+
+
+async def load_food_popularity() -> Dict[str, int]:
+    """Global logging counts per food_id over the popularity lookback window."""
+    cutoff = (datetime.now(timezone.utc) - timedelta(days=FOOD_POPULARITY_LOOKBACK_DAYS)).strftime("%Y-%m-%d")
+    pipeline = [
+        {"$match": {"date": {"$gte": cutoff}}},
+        {"$project": {"_id": 0, "meals": {"$objectToArray": "$meals"}}},
+        {"$unwind": "$meals"},
+        {"$unwind": "$meals.v"},
+        {"$group": {"_id": "$meals.v.food_id", "count": {"$sum": 1}}},
+    ]
+    counts: Dict[str, int] = {}
+    async for row in db.daily_nutrition.aggregate(pipeline):
+        if row.get("_id"):
+            counts[row["_id"]] = int(row.get("count", 0))
+    return counts
+
+
+def build_food_suggest_index(foods: List[Dict[str, Any]], popularity: Dict[str, int]) -> Dict[str, Any]:
+    ranked = sorted(
+        foods,
+        key=lambda food: (-popularity.get(food.get("food_id"), 0), len(food.get("name", "")), food.get("name", "")),
+    )
+
+    entries: List[Tuple[str, int]] = []
+    for ref, food in enumerate(ranked):
+        words = normalize_food_name(food.get("name", "")).split()
+        for start in range(len(words)):
+            entries.append((" ".join(words[start:]), ref))
+    entries.sort()
+
+    top: Dict[str, List[int]] = {}
+    for key, ref in entries:
+        for length in range(1, min(len(key), FOOD_SUGGEST_PRECOMPUTED_PREFIX_CHARS) + 1):
+            top.setdefault(key[:length], []).append(ref)
+
+    return {
+        "foods": ranked,
+        "keys": [key for key, _ in entries],
+        "refs": [ref for _, ref in entries],
+        "top": {
+            prefix: tuple(heapq.nsmallest(FOOD_SUGGEST_TOP_K, set(refs)))
+            for prefix, refs in top.items()
+        },
+    }
+
+
+async def _rebuild_food_suggest_index() -> None:
+    version = await current_catalog_version("foods")
+    foods = await db.foods.find({}, FOOD_SUGGEST_PROJECTION).to_list(length=None)
+    popularity = await load_food_popularity()
+    built = build_food_suggest_index(foods, popularity)
+
+    _food_suggest_index.update(built)
+    _food_suggest_index["version"] = version
+    _food_suggest_index["built_at"] = time.monotonic()
+    _food_suggest_memo.clear()
+    _food_suggest_stats["builds"] += 1
+
+
+def _on_food_suggest_rebuild_done(task: "asyncio.Task") -> None:
+    if task.cancelled():
+        return
+    exc = task.exception()
+    if exc is not None:
+        logger.warning(f"Food suggest index rebuild failed: {exc}")
+
+
+def _schedule_food_suggest_rebuild() -> "asyncio.Task":
+    task = _food_suggest_index["refresh_task"]
+    if task is None or task.done():
+        task = asyncio.ensure_future(_rebuild_food_suggest_index())
+        task.add_done_callback(_on_food_suggest_rebuild_done)
+        _food_suggest_index["refresh_task"] = task
+    return task
+
+
+async def ensure_food_suggest_index() -> Dict[str, Any]:
+    """
+    Returns the typeahead index. Only the first build is awaited; after that a
+    catalog version change or an aged popularity snapshot triggers a single
+    background rebuild while requests keep reading the current index.
+    """
+    version = await current_catalog_version("foods")
+    index = _food_suggest_index
+    if index["version"] is None:
+        await asyncio.shield(_schedule_food_suggest_rebuild())
+    elif index["version"] != version or time.monotonic() - index["built_at"] >= FOOD_SUGGEST_REFRESH_SECONDS:
+        _schedule_food_suggest_rebuild()
+    return index
+
+
+def suggest_food_refs(index: Dict[str, Any], prefix: str) -> Tuple[int, ...]:
+    top = index["top"].get(prefix)
+    if top is not None:
+        return top
+
+    cached = _food_suggest_memo.get(prefix)
+    if cached is not None:
+        _food_suggest_stats["hits"] += 1
+        _food_suggest_memo.move_to_end(prefix)
+        return cached
+
+    _food_suggest_stats["misses"] += 1
+    keys = index["keys"]
+    lo = bisect_left(keys, prefix)
+    # "\uffff" sorts after every character normalize_food_name can emit.
+    hi = bisect_left(keys, prefix + "\uffff", lo)
+    refs = tuple(heapq.nsmallest(FOOD_SUGGEST_TOP_K, set(index["refs"][lo:hi])))
+
+    _food_suggest_memo[prefix] = refs
+    while len(_food_suggest_memo) > max(FOOD_SUGGEST_MEMO_MAX_ENTRIES, 1):
+        _food_suggest_memo.popitem(last=False)
+        _food_suggest_stats["evictions"] += 1
+    return refs
+
+
+def get_food_suggest_stats() -> Dict[str, Any]:
+    return {
+        **_cache_stats_snapshot(_food_suggest_stats, _food_suggest_memo, FOOD_SUGGEST_MEMO_MAX_ENTRIES),
+        "foods": len(_food_suggest_index["foods"]),
+        "keys": len(_food_suggest_index["keys"]),
+        "precomputed_prefixes": len(_food_suggest_index["top"]),
+        "version": _food_suggest_index["version"],
+    }
+
+
 @api_router.get("/foods")
-async def get_foods(category: Optional[str] = None, search: Optional[str] = None):
+async def get_foods(
+    request: Request,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+):
     """Get foods from database"""
-    # Initialize foods if empty
-    count = await db.foods.count_documents({})
-    if count == 0:
-        for food in DEFAULT_FOODS:
-            food_obj = Food(**food)
-            await db.foods.insert_one(food_obj.model_dump())
-    
-    query = {}
-    if category:
-        query["category"] = category
-    if search:
-        query["name"] = {"$regex": search, "$options": "i"}
-    
-    # Optimized projection for foods
-    projection = {
-        "_id": 0,
-        "food_id": 1,
-        "name": 1,
-        "category": 1,
-        "calories": 1,
-        "protein": 1,
-        "carbs": 1,
-        "fat": 1,
-        "serving_size": 1,
-        "serving_unit": 1
-    }
-    foods = await db.foods.find(query, projection).limit(100).to_list(100)
-    return foods
+    version = await current_catalog_version("foods")
+
+    search_normalized = normalize_food_name(search) if search else ""
+
+    async def _load():
+        if search:
+            return await search_foods(search, category)
+        query = {"category": category} if category else {}
+        return await db.foods.find(query, FOOD_PROJECTION).limit(FOOD_RESPONSE_LIMIT).to_list(FOOD_RESPONSE_LIMIT)
+
+    # Free-text searches are unbounded; keep them from evicting the category snapshots.
+    return await catalog_response(
+        request,
+        "foods",
+        version,
+        (category or "", search_normalized),
+        _load,
+        cacheable=not search,
+    )
+
+@api_router.get("/foods/suggest")
+async def suggest_foods(
+    q: str = Query(..., min_length=1, max_length=120),
+    limit: int = Query(FOOD_SUGGEST_TOP_K, ge=1, le=FOOD_SUGGEST_TOP_K),
+):
+    """Typeahead suggestions for food names, most logged first"""
+    prefix = normalize_food_name(q)
+    if not prefix:
+        return []
+
+    index = await ensure_food_suggest_index()
+    foods = index["foods"]
+    return [foods[ref] for ref in suggest_food_refs(index, prefix)[:limit]]
 
 # ============== Body Measurements Tracking ==============
 
@@ -1456,6 +3230,7 @@ class BodyMeasurement(BaseModel):
     neck: Optional[float] = None  # inches
     shoulders: Optional[float] = None  # inches
     notes: Optional[str] = None
+    version: int = 1  # bumped on every update; see MeasurementCreate.version
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class MeasurementCreate(BaseModel):
@@ -1474,6 +3249,8 @@ class MeasurementCreate(BaseModel):
     neck: Optional[float] = Field(default=None, ge=0, le=40)
     shoulders: Optional[float] = Field(default=None, ge=0, le=90)
     notes: Optional[str] = Field(default=None, max_length=1000)
+    # Expected current version of the day's measurement; 409 if it has moved on.
+    version: Optional[int] = Field(default=None, ge=1)
 
     @field_validator("date")
     @classmethod
@@ -1488,34 +3265,41 @@ async def create_measurement(measurement: MeasurementCreate, request: Request, u
     """Create or update body measurement for a date"""
     await enforce_mutation_rate_limit(request, "measurements.write", user.user_id, limit=30, window_seconds=60)
     date = validate_date_key(measurement.date or datetime.now(timezone.utc).strftime("%Y-%m-%d"))
-    
-    # Check if measurement exists for this date
-    existing = await db.body_measurements.find_one(
-        {"user_id": user.user_id, "date": date}
-    )
-    
-    if existing:
-        # Update existing measurement
-        update_data = {k: v for k, v in measurement.model_dump().items() if v is not None}
-        update_data.pop("date", None)  # Don't update the date
-        await db.body_measurements.update_one(
-            {"user_id": user.user_id, "date": date},
-            {"$set": update_data}
-        )
-        updated = await db.body_measurements.find_one(
-            {"user_id": user.user_id, "date": date},
-            {"_id": 0}
-        )
-        return updated
-    else:
-        # Create new measurement
-        new_measurement = BodyMeasurement(
-            user_id=user.user_id,
-            date=date,
-            **measurement.model_dump(exclude={"date"})
-        )
-        await db.body_measurements.insert_one(new_measurement.model_dump())
-        return new_measurement.model_dump()
+    fields = measurement.model_dump(exclude={"date", "version"})
+
+    # One upsert on the unique (user_id, date) key: provided values are set,
+    # everything else only fills in when the day is first created.
+    update_data = {k: v for k, v in fields.items() if v is not None}
+    new_doc = BodyMeasurement(user_id=user.user_id, date=date, **fields).model_dump()
+    insert_only = {k: v for k, v in new_doc.items() if k not in update_data and k != "version"}
+
+    query: Dict[str, Any] = {"user_id": user.user_id, "date": date}
+    if measurement.version is not None:
+        query["version"] = measurement.version
+    async with tracked_change(user.user_id) as stamp:
+        measurement_upsert = {"$set": {**update_data, **stamp}, "$setOnInsert": insert_only, "$inc": {"version": 1}}
+        try:
+            updated = await db.body_measurements.find_one_and_update(
+                query,
+                measurement_upsert,
+                projection={"_id": 0},
+                upsert=measurement.version is None,
+                return_document=ReturnDocument.AFTER,
+            )
+        except DuplicateKeyError:
+            # A concurrent request created the day first; the retry updates it.
+            updated = await db.body_measurements.find_one_and_update(
+                query,
+                measurement_upsert,
+                projection={"_id": 0},
+                return_document=ReturnDocument.AFTER,
+            )
+    if updated is None:
+        # Only a versioned write can miss: 409 if the day exists at another version.
+        if await db.body_measurements.find_one({"user_id": user.user_id, "date": date}, {"_id": 1}):
+            raise HTTPException(status_code=409, detail="Measurement was changed by another request")
+        raise HTTPException(status_code=404, detail="Measurement not found")
+    return updated
 
 @api_router.get("/measurements")
 async def get_measurements(user: User = Depends(get_current_user), limit: int = 30):
@@ -1543,11 +3327,13 @@ async def delete_measurement(date: str, request: Request, user: User = Depends(g
     """Delete a body measurement"""
     await enforce_mutation_rate_limit(request, "measurements.delete", user.user_id, limit=20, window_seconds=60)
     date = validate_date_key(date)
-    result = await db.body_measurements.delete_one(
-        {"user_id": user.user_id, "date": date}
+    deleted = await db.body_measurements.find_one_and_delete(
+        {"user_id": user.user_id, "date": date},
+        projection={"_id": 0, "measurement_id": 1},
     )
-    if result.deleted_count == 0:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Measurement not found")
+    await record_tombstone(user.user_id, "body_measurements", deleted["measurement_id"])
     return {"message": "Measurement deleted"}
 
 @api_router.get("/measurements/stats/progress")
@@ -1600,6 +3386,98 @@ async def get_measurement_progress(user: User = Depends(require_pro_user), days:
 
 # ============== Nutrition Tracking ==============
 
+FOOD_HISTORY_MAX_RESULTS = 20
+FOOD_FREQUENCY_HALF_LIFE_DAYS = float(os.getenv("FOOD_FREQUENCY_HALF_LIFE_DAYS", "14"))
+# Scores are stored scaled to this epoch: a log at time t adds 2^(t / half-life),
+# so decay never needs a rewrite, $inc stays atomic, and sorting by the stored
+# score equals sorting by the decayed score.
+FOOD_FREQUENCY_EPOCH = datetime(2025, 1, 1, tzinfo=timezone.utc)
+FOOD_HISTORY_PROJECTION = {
+    "_id": 0,
+    "food_id": 1,
+    "food_name": 1,
+    "last_entry": 1,
+    "last_logged_at": 1,
+    "log_count": 1,
+    "frequency_score": 1,
+}
+
+
+def food_frequency_weight(at: Optional[datetime] = None) -> float:
+    at = at or datetime.now(timezone.utc)
+    half_lives = (at - FOOD_FREQUENCY_EPOCH).total_seconds() / (FOOD_FREQUENCY_HALF_LIFE_DAYS * 86400)
+    return 2.0 ** half_lives
+
+
+async def record_food_logged(user_id: str, entry: Dict[str, Any]) -> None:
+    """Moves the food to the front of the user's MRU list and bumps its decayed count."""
+    now = datetime.now(timezone.utc)
+    await db.user_food_stats.update_one(
+        {"user_id": user_id, "food_id": entry["food_id"]},
+        {
+            "$set": {
+                "food_name": entry["food_name"],
+                "last_entry": {
+                    field: entry[field]
+                    for field in ("food_name", "servings", "calories", "protein", "carbs", "fat")
+                },
+                "last_logged_at": now,
+            },
+            "$inc": {"log_count": 1, "frequency_score": food_frequency_weight(now)},
+        },
+        upsert=True,
+    )
+
+
+async def record_food_unlogged(user_id: str, food_id: str) -> None:
+    """Takes back one current-weight log of the food, clamped at zero."""
+    weight = food_frequency_weight()
+    await db.user_food_stats.update_one(
+        {"user_id": user_id, "food_id": food_id},
+        [
+            {
+                "$set": {
+                    "frequency_score": {"$max": [0, {"$subtract": [{"$ifNull": ["$frequency_score", 0]}, weight]}]},
+                    "log_count": {"$max": [0, {"$subtract": [{"$ifNull": ["$log_count", 0]}, 1]}]},
+                }
+            }
+        ],
+    )
+
+
+def _food_history_item(doc: Dict[str, Any], weight: float) -> Dict[str, Any]:
+    score = doc.pop("frequency_score", 0) or 0
+    doc["frequency"] = round(score / weight, 3)
+    return doc
+
+
+@api_router.get("/foods/recent")
+async def get_recent_foods(
+    user: User = Depends(get_current_user),
+    limit: int = Query(10, ge=1, le=FOOD_HISTORY_MAX_RESULTS),
+):
+    """Foods the user logged most recently, newest first"""
+    docs = await db.user_food_stats.find(
+        {"user_id": user.user_id},
+        FOOD_HISTORY_PROJECTION,
+    ).sort("last_logged_at", -1).limit(limit).to_list(limit)
+    weight = food_frequency_weight()
+    return [_food_history_item(doc, weight) for doc in docs]
+
+
+@api_router.get("/foods/frequent")
+async def get_frequent_foods(
+    user: User = Depends(get_current_user),
+    limit: int = Query(10, ge=1, le=FOOD_HISTORY_MAX_RESULTS),
+):
+    """Foods the user logs most often, weighted toward recent logs"""
+    docs = await db.user_food_stats.find(
+        {"user_id": user.user_id, "frequency_score": {"$gt": 0}},
+        FOOD_HISTORY_PROJECTION,
+    ).sort("frequency_score", -1).limit(limit).to_list(limit)
+    weight = food_frequency_weight()
+    return [_food_history_item(doc, weight) for doc in docs]
+
 @api_router.get("/nutrition/{date}")
 async def get_daily_nutrition(date: str, user: User = Depends(get_current_user)):
     """Get nutrition data for a specific date"""
@@ -1628,10 +3506,6 @@ async def add_meal_entry(date: str, entry: MealEntryCreate, request: Request, us
     """Add a food entry to a meal"""
     await enforce_mutation_rate_limit(request, "nutrition.meal.add", user.user_id, limit=40, window_seconds=60)
     date = validate_date_key(date)
-    existing = await db.daily_nutrition.find_one(
-        {"user_id": user.user_id, "date": date}
-    )
-    
     meal_entry = MealEntry(
         food_id=entry.food_id,
         food_name=entry.food_name,
@@ -1641,45 +3515,41 @@ async def add_meal_entry(date: str, entry: MealEntryCreate, request: Request, us
         carbs=entry.carbs,
         fat=entry.fat
     )
-    
-    if existing:
-        # Add to existing day
-        meals = existing.get("meals", {"breakfast": [], "lunch": [], "dinner": [], "snacks": []})
-        meals[entry.meal_type].append(meal_entry.model_dump())
-        
-        # Recalculate totals
-        totals = {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
-        for meal_type in meals.values():
-            for item in meal_type:
-                totals["calories"] += item["calories"]
-                totals["protein"] += item["protein"]
-                totals["carbs"] += item["carbs"]
-                totals["fat"] += item["fat"]
-        
-        await db.daily_nutrition.update_one(
-            {"user_id": user.user_id, "date": date},
-            {"$set": {
-                "meals": meals,
-                "total_calories": totals["calories"],
-                "total_protein": totals["protein"],
-                "total_carbs": totals["carbs"],
-                "total_fat": totals["fat"]
-            }}
-        )
-    else:
-        # Create new day
-        nutrition = DailyNutrition(
-            user_id=user.user_id,
-            date=date,
-            meals={entry.meal_type: [meal_entry.model_dump()], "breakfast": [], "lunch": [], "dinner": [], "snacks": []},
-            total_calories=entry.calories,
-            total_protein=entry.protein,
-            total_carbs=entry.carbs,
-            total_fat=entry.fat
-        )
-        # Fix duplicate meal type
-        nutrition.meals[entry.meal_type] = [meal_entry.model_dump()]
-        await db.daily_nutrition.insert_one(nutrition.model_dump())
+
+    # One upsert on the unique (user_id, date) key: the entry is pushed and
+    # the totals incremented in place, so concurrent adds neither lose each
+    # other's entries nor race to create the day.
+    new_day = DailyNutrition(user_id=user.user_id, date=date).model_dump()
+    day_upsert = {
+        "$push": {f"meals.{entry.meal_type}": meal_entry.model_dump()},
+        "$inc": {
+            "total_calories": entry.calories,
+            "total_protein": entry.protein,
+            "total_carbs": entry.carbs,
+            "total_fat": entry.fat,
+        },
+        "$setOnInsert": {
+            "nutrition_id": new_day["nutrition_id"],
+            "created_at": new_day["created_at"],
+            **{
+                f"meals.{meal_type}": []
+                for meal_type in new_day["meals"]
+                if meal_type != entry.meal_type
+            },
+        },
+    }
+    async with tracked_change(user.user_id) as stamp:
+        day_upsert["$set"] = stamp
+        try:
+            await db.daily_nutrition.update_one({"user_id": user.user_id, "date": date}, day_upsert, upsert=True)
+        except DuplicateKeyError:
+            # A concurrent first add created the day; the retry appends to it.
+            await db.daily_nutrition.update_one({"user_id": user.user_id, "date": date}, day_upsert)
+
+    try:
+        await record_food_logged(user.user_id, meal_entry.model_dump())
+    except Exception as e:
+        logger.warning(f"Food history update failed for {user.user_id}: {e}")
     
     return await get_daily_nutrition(date, user)
 
@@ -1703,7 +3573,7 @@ async def remove_meal_entry(date: str, meal_type: str, index: int, request: Requ
     if meal_type not in meals or index >= len(meals[meal_type]):
         raise HTTPException(status_code=404, detail="Meal entry not found")
     
-    meals[meal_type].pop(index)
+    removed_entry = meals[meal_type].pop(index)
     
     # Recalculate totals
     totals = {"calories": 0, "protein": 0, "carbs": 0, "fat": 0}
@@ -1714,16 +3584,24 @@ async def remove_meal_entry(date: str, meal_type: str, index: int, request: Requ
             totals["carbs"] += item["carbs"]
             totals["fat"] += item["fat"]
     
-    await db.daily_nutrition.update_one(
-        {"user_id": user.user_id, "date": date},
-        {"$set": {
-            "meals": meals,
-            "total_calories": totals["calories"],
-            "total_protein": totals["protein"],
-            "total_carbs": totals["carbs"],
-            "total_fat": totals["fat"]
-        }}
-    )
+    async with tracked_change(user.user_id) as stamp:
+        await db.daily_nutrition.update_one(
+            {"user_id": user.user_id, "date": date},
+            {"$set": {
+                "meals": meals,
+                "total_calories": totals["calories"],
+                "total_protein": totals["protein"],
+                "total_carbs": totals["carbs"],
+                "total_fat": totals["fat"],
+                **stamp,
+            }}
+        )
+
+    if removed_entry.get("food_id"):
+        try:
+            await record_food_unlogged(user.user_id, removed_entry["food_id"])
+        except Exception as e:
+            logger.warning(f"Food history update failed for {user.user_id}: {e}")
     
     return await get_daily_nutrition(date, user)
 
@@ -1736,20 +3614,15 @@ async def get_workout_volume(user: User = Depends(require_pro_user), days: int =
     
     workouts = await db.workouts.find(
         {"user_id": user.user_id, "date": {"$gte": start_date}},
-        {"_id": 0}
+        WORKOUT_SUMMARY_PROJECTION
     ).sort("date", 1).to_list(100)
+    await load_workout_summaries(workouts)
     
     volume_data = []
     for workout in workouts:
-        total_volume = 0
-        for exercise in workout.get("exercises", []):
-            for set_data in exercise.get("sets", []):
-                if not set_data.get("is_warmup", False):
-                    total_volume += set_data.get("weight", 0) * set_data.get("reps", 0)
-        
         volume_data.append({
             "date": workout["date"].isoformat() if isinstance(workout["date"], datetime) else workout["date"],
-            "volume": total_volume,
+            "volume": workout["summary"]["total_volume"],
             "workout_name": workout.get("name", "Workout")
         })
     
@@ -2015,23 +3888,29 @@ DEFAULT_TEMPLATES = [
 ]
 
 @api_router.get("/templates")
-async def get_workout_templates(difficulty: Optional[str] = None, type: Optional[str] = None):
+async def get_workout_templates(
+    request: Request,
+    difficulty: Optional[str] = None,
+    type: Optional[str] = None,
+):
     """Get workout templates/programs"""
-    # Initialize templates if empty
-    count = await db.workout_templates.count_documents({})
-    if count == 0:
-        for template in DEFAULT_TEMPLATES:
-            template_obj = WorkoutTemplate(**template)
-            await db.workout_templates.insert_one(template_obj.model_dump())
-    
-    query = {}
-    if difficulty:
-        query["difficulty"] = difficulty
-    if type:
-        query["type"] = type
-    
-    templates = await db.workout_templates.find(query, {"_id": 0}).to_list(20)
-    return templates
+    version = await current_catalog_version("workout_templates")
+
+    async def _load():
+        query = {}
+        if difficulty:
+            query["difficulty"] = difficulty
+        if type:
+            query["type"] = type
+        return await db.workout_templates.find(query, {"_id": 0}).to_list(20)
+
+    return await catalog_response(
+        request,
+        "workout_templates",
+        version,
+        (difficulty or "", type or ""),
+        _load,
+    )
 
 @api_router.get("/templates/{template_id}")
 async def get_workout_template(template_id: str):
@@ -2076,8 +3955,368 @@ async def start_program(template_id: str, request: Request, user: User = Depends
         notes=f"Program: {template['name']}\nDay: {first_day['day']}"
     )
     
-    await db.workouts.insert_one(workout.model_dump())
-    return workout.model_dump()
+    workout_doc = workout.model_dump()
+    workout_doc["summary"] = build_workout_summary(workout_doc["exercises"], workout_doc["duration_minutes"])
+    async with tracked_change(user.user_id) as stamp:
+        workout_doc.update(stamp)
+        await db.workouts.insert_one(dict(workout_doc))
+    return workout_doc
+
+# ============== Index Registry ==============
+
+# Indexes every hot query relies on, ensured idempotently at startup. Indexes
+# whose lifecycle depends on other state are owned elsewhere: the reference
+# catalog natural keys (bootstrap_reference_data), the food search/dedupe keys
+# (ensure_food_search_index, after its backfill), the session expiry TTL
+# (ensure_session_expiry) and the rate-limit counter TTL (ensure_rate_limit_backend).
+INDEX_REGISTRY: List[Dict[str, Any]] = [
+    {"collection": "users", "keys": [("user_id", 1)], "name": "users_user_id_unique", "unique": True},
+    # exchange_session upserts on email and relies on this to turn a login race into a retry.
+    {"collection": "users", "keys": [("email", 1)], "name": "users_email_unique", "unique": True},
+    {"collection": "user_sessions", "keys": [("session_token", 1)], "name": "user_sessions_token_unique", "unique": True},
+    {"collection": "user_sessions", "keys": [("user_id", 1)], "name": "user_sessions_user_id"},
+    {"collection": "workouts", "keys": [("workout_id", 1)], "name": "workouts_workout_id_unique", "unique": True},
+    {
+        "collection": "workouts",
+        "keys": [("user_id", 1), ("date", -1), ("workout_id", -1)],
+        "name": "workouts_user_date_workout_id",
+    },
+    {
+        "collection": "workouts",
+        "keys": [("user_id", 1), ("exercises.exercise_name", 1), ("date", -1)],
+        "name": "workouts_user_exercise_name_date",
+    },
+    # Idempotency key for offline batch replays; workouts created one by one have none.
+    {
+        "collection": "workouts",
+        "keys": [("user_id", 1), ("client_workout_id", 1)],
+        "name": "workouts_user_client_id_unique",
+        "unique": True,
+        "partialFilterExpression": {"client_workout_id": {"$exists": True}},
+    },
+    {"collection": "daily_nutrition", "keys": [("user_id", 1), ("date", 1)], "name": "daily_nutrition_user_date_unique", "unique": True},
+    {"collection": "daily_nutrition", "keys": [("date", 1)], "name": "daily_nutrition_date"},
+    {"collection": "body_measurements", "keys": [("user_id", 1), ("date", -1)], "name": "body_measurements_user_date_unique", "unique": True},
+    {"collection": "notification_profiles", "keys": [("user_id", 1)], "name": "notification_profiles_user_id_unique", "unique": True},
+    # Only profiles with a push token are scheduled; sparse keeps the rest out of the index.
+    {"collection": "notification_profiles", "keys": [("expo_push_token", 1)], "name": "notification_profiles_push_token", "sparse": True},
+    {
+        "collection": "notification_profiles",
+        "keys": [("first_workout_completed_at", 1)],
+        "name": "notification_profiles_first_workout",
+        "sparse": True,
+    },
+    {"collection": "paywall_events", "keys": [("created_at", 1), ("feature", 1)], "name": "paywall_events_created_feature"},
+    {"collection": "paywall_events", "keys": [("user_id", 1), ("created_at", -1)], "name": "paywall_events_user_created"},
+    {"collection": "user_friendships", "keys": [("members", 1), ("status", 1)], "name": "user_friendships_members_status"},
+    {"collection": "user_friend_invites", "keys": [("invite_id", 1)], "name": "user_friend_invites_invite_id_unique", "unique": True},
+    {"collection": "user_friend_invites", "keys": [("to_user_id", 1), ("status", 1)], "name": "user_friend_invites_to_status"},
+    # Outgoing lookups and the stale-invite sweep only ever ask for pending invites.
+    {
+        "collection": "user_friend_invites",
+        "keys": [("from_user_id", 1), ("created_at", 1)],
+        "name": "user_friend_invites_pending_from",
+        "partialFilterExpression": {"status": "pending"},
+    },
+    {"collection": "user_food_stats", "keys": [("user_id", 1), ("food_id", 1)], "name": "user_food_stats_user_food", "unique": True},
+    {"collection": "user_food_stats", "keys": [("user_id", 1), ("last_logged_at", -1)], "name": "user_food_stats_recent"},
+    {"collection": "user_food_stats", "keys": [("user_id", 1), ("frequency_score", -1)], "name": "user_food_stats_frequent"},
+    # Delta sync pages each synced collection (and the tombstones) by the user's change sequence.
+    *[
+        {"collection": collection_name, "keys": [("user_id", 1), ("change_seq", 1)], "name": f"{collection_name}_user_change_seq"}
+        for collection_name in ("workouts", "daily_nutrition", "body_measurements", "sync_tombstones")
+    ],
+    {
+        "collection": "sync_tombstones",
+        "keys": [("deleted_at", 1)],
+        "name": "sync_tombstones_ttl",
+        "expireAfterSeconds": SYNC_TOMBSTONE_RETENTION_DAYS * 86400,
+    },
+]
+
+_EXPLAIN_USER_ID = "user_explain_probe"
+_EXPLAIN_SINCE = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+# (label, collection, filter, sort) for the queries behind the busiest endpoints.
+HOT_QUERIES: List[Tuple[str, str, Dict[str, Any], Optional[List[Tuple[str, int]]]]] = [
+    ("session lookup", "user_sessions", {"session_token": "probe"}, None),
+    ("session replace", "user_sessions", {"user_id": _EXPLAIN_USER_ID, "session_token": {"$ne": "probe"}}, None),
+    ("login upsert", "users", {"email": "probe@example.com"}, None),
+    ("user by id", "users", {"user_id": _EXPLAIN_USER_ID}, None),
+    ("workout history", "workouts", {"user_id": _EXPLAIN_USER_ID}, WORKOUT_HISTORY_SORT),
+    ("workout by id", "workouts", {"workout_id": "probe", "user_id": _EXPLAIN_USER_ID}, None),
+    ("workouts since", "workouts", {"user_id": _EXPLAIN_USER_ID, "date": {"$gte": _EXPLAIN_SINCE}}, [("date", -1)]),
+    (
+        "exercise progression",
+        "workouts",
+        {"user_id": _EXPLAIN_USER_ID, "exercises.exercise_name": "Bench Press"},
+        [("date", -1)],
+    ),
+    ("nutrition day", "daily_nutrition", {"user_id": _EXPLAIN_USER_ID, "date": "2026-01-01"}, None),
+    ("food popularity window", "daily_nutrition", {"date": {"$gte": "2026-01-01"}}, None),
+    ("measurements", "body_measurements", {"user_id": _EXPLAIN_USER_ID}, [("date", -1)]),
+    ("push-token profiles", "notification_profiles", {"expo_push_token": {"$exists": True}}, None),
+    ("paywall funnel", "paywall_events", {"created_at": {"$gte": _EXPLAIN_SINCE}, "feature": "progression"}, None),
+    (
+        "paywall user history",
+        "paywall_events",
+        {"user_id": _EXPLAIN_USER_ID, "event_type": {"$in": ["cta_click"]}, "created_at": {"$gte": _EXPLAIN_SINCE}},
+        None,
+    ),
+    ("friendships", "user_friendships", {"members": _EXPLAIN_USER_ID, "status": "accepted"}, None),
+    ("incoming invites", "user_friend_invites", {"to_user_id": _EXPLAIN_USER_ID, "status": "pending"}, None),
+    ("outgoing invites", "user_friend_invites", {"from_user_id": _EXPLAIN_USER_ID, "status": "pending"}, None),
+    ("recent foods", "user_food_stats", {"user_id": _EXPLAIN_USER_ID}, [("last_logged_at", -1)]),
+    ("sync changes", "workouts", {"user_id": _EXPLAIN_USER_ID, "change_seq": {"$gt": 0}}, [("change_seq", 1)]),
+    ("sync tombstones", "sync_tombstones", {"user_id": _EXPLAIN_USER_ID, "change_seq": {"$gt": 0}}, [("change_seq", 1)]),
+    ("food search", "foods", build_food_search_query("chicken breast") or {}, FOOD_SEARCH_CANDIDATE_SORT),
+    ("food search prefix", "foods", {"name_normalized": {"$gte": "chicken", "$lt": "chickeo"}}, FOOD_SEARCH_CANDIDATE_SORT),
+    ("food search words", "foods", {"name_tokens": {"$all": ["chicken"]}}, FOOD_SEARCH_CANDIDATE_SORT),
+]
+
+
+async def ensure_indexes() -> Dict[str, List[str]]:
+    """
+    Creates every registered index. create_index is a no-op when the same
+    index already exists, so this is safe on every boot; failures (e.g. legacy
+    duplicates blocking a unique index) are logged and reported, not raised.
+    """
+    report: Dict[str, List[str]] = {"ensured": [], "failed": []}
+    for spec in INDEX_REGISTRY:
+        options = {key: value for key, value in spec.items() if key not in ("collection", "keys")}
+        try:
+            await db[spec["collection"]].create_index(spec["keys"], **options)
+            report["ensured"].append(spec["name"])
+        except Exception as e:
+            logger.warning(f"Index {spec['collection']}.{spec['name']} not created: {e}")
+            report["failed"].append(spec["name"])
+    return report
+
+
+def _plan_nodes(plan: Any) -> Iterator[Dict[str, Any]]:
+    """Every stage node in an explain() plan tree, for both classic and SBE plan shapes."""
+    if isinstance(plan, dict):
+        if isinstance(plan.get("stage"), str):
+            yield plan
+        for value in plan.values():
+            yield from _plan_nodes(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            yield from _plan_nodes(item)
+
+
+async def explain_hot_queries() -> List[Dict[str, Any]]:
+    """Runs explain() on each HOT_QUERIES entry and flags winning plans that scan the collection."""
+    report = []
+    for label, collection_name, query, sort in HOT_QUERIES:
+        cursor = db[collection_name].find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        try:
+            explained = await cursor.explain()
+        except Exception as e:
+            report.append({"query": label, "collection": collection_name, "error": str(e)})
+            continue
+
+        nodes = list(_plan_nodes(explained.get("queryPlanner", {}).get("winningPlan", {})))
+        stages = [node["stage"] for node in nodes]
+        report.append({
+            "query": label,
+            "collection": collection_name,
+            "stages": stages,
+            "indexes": [node["indexName"] for node in nodes if node.get("indexName")],
+            "collscan": "COLLSCAN" in stages,
+        })
+    return report
+
+# ============== Reference Data Bootstrap ==============
+
+# (collection, model, defaults, natural key fields, derived fields)
+REFERENCE_DATA_SEEDS = [
+    ("exercises", Exercise, DEFAULT_EXERCISES, ("name",), None),
+    ("foods", Food, DEFAULT_FOODS, ("name", "serving_size"), lambda doc: food_search_fields(doc["name"], doc["serving_size"])),
+    ("workout_templates", WorkoutTemplate, DEFAULT_TEMPLATES, ("name",), None),
+]
+
+
+async def bootstrap_reference_data() -> Dict[str, int]:
+    """
+    Seeds the default catalogs once at startup. Each collection gets a unique
+    index on its natural key and one unordered bulk of $setOnInsert upserts,
+    so reruns and concurrently booting workers never insert duplicates and
+    catalog reads no longer count documents per request.
+    """
+    inserted: Dict[str, int] = {}
+    for collection_name, model, defaults, key_fields, derive in REFERENCE_DATA_SEEDS:
+        collection = db[collection_name]
+        try:
+            await collection.create_index(
+                [(field, 1) for field in key_fields],
+                name=f"{collection_name}_{'_'.join(key_fields)}_unique",
+                unique=True,
+            )
+        except Exception as e:
+            # Legacy duplicates from request-time seeding block the unique index;
+            # the keyed upserts below stay idempotent regardless.
+            logger.warning(f"Unique index on {collection_name} not created: {e}")
+
+        operations = []
+        for item in defaults:
+            doc = model(**item).model_dump()
+            if derive:
+                doc.update(derive(doc))
+            operations.append(
+                UpdateOne(
+                    {field: doc[field] for field in key_fields},
+                    {"$setOnInsert": doc},
+                    upsert=True,
+                )
+            )
+
+        try:
+            result = await collection.bulk_write(operations, ordered=False)
+            inserted[collection_name] = int(getattr(result, "upserted_count", 0) or 0)
+            if inserted[collection_name]:
+                await bump_catalog_version(collection_name)
+        except Exception as e:
+            logger.error(f"Seeding {collection_name} failed: {e}")
+            inserted[collection_name] = 0
+
+    return inserted
+
+# ============== Food Catalog Import ==============
+
+FOOD_IMPORT_FORMATS = ("csv", "ndjson")
+FOOD_IMPORT_BATCH_SIZE = int(os.getenv("FOOD_IMPORT_BATCH_SIZE", "1000"))
+FOOD_IMPORT_SPOOL_BYTES = int(os.getenv("FOOD_IMPORT_SPOOL_BYTES", str(8 * 1024 * 1024)))
+FOOD_IMPORT_MAX_ERROR_SAMPLES = 20
+
+
+def iter_food_import_rows(text_stream: IO[str], fmt: str) -> Iterator[Tuple[int, Any]]:
+    """Yields (line number, raw row) one at a time; NDJSON lines are parsed during validation."""
+    if fmt == "csv":
+        reader = csv.DictReader(text_stream)
+        for row in reader:
+            yield reader.line_num, row
+        return
+
+    for line_number, line in enumerate(text_stream, start=1):
+        if line.strip():
+            yield line_number, line
+
+
+def food_import_doc(row: Any) -> Dict[str, Any]:
+    """Validates one import row against Food. Raises ValueError for unusable rows."""
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("Row must be an object")
+
+    # CSV exports leave optional columns blank; treat those as missing.
+    cleaned = {
+        key.strip(): value.strip() if isinstance(value, str) else value
+        for key, value in row.items()
+        if isinstance(key, str) and value is not None and value != ""
+    }
+    doc = Food(**cleaned).model_dump()
+    doc.update(food_search_fields(doc["name"], doc["serving_size"]))
+    if not doc["name_normalized"]:
+        raise ValueError("Food name has no searchable characters")
+    return doc
+
+
+async def _write_food_import_batch(batch: Dict[Tuple[str, str], Dict[str, Any]], stats: Dict[str, Any]) -> None:
+    operations = []
+    for (name_normalized, serving_normalized), doc in batch.items():
+        food_id = doc.pop("food_id")
+        operations.append(
+            UpdateOne(
+                {"name_normalized": name_normalized, "serving_normalized": serving_normalized},
+                {"$set": doc, "$setOnInsert": {"food_id": food_id}},
+                upsert=True,
+            )
+        )
+
+    try:
+        result = await db.foods.bulk_write(operations, ordered=False)
+        stats["inserted"] += int(getattr(result, "upserted_count", 0) or 0)
+        stats["updated"] += int(getattr(result, "modified_count", 0) or 0)
+    except BulkWriteError as e:
+        # Unordered: every other operation in the batch was still applied.
+        details = e.details or {}
+        stats["inserted"] += int(details.get("nUpserted", 0))
+        stats["updated"] += int(details.get("nModified", 0))
+        stats["write_errors"] += len(details.get("writeErrors", []))
+
+
+def _food_import_rate(stats: Dict[str, Any], started: float) -> Dict[str, Any]:
+    elapsed = max(time.monotonic() - started, 1e-6)
+    return {
+        **stats,
+        "elapsed_seconds": round(elapsed, 3),
+        "rows_per_second": round(stats["rows"] / elapsed, 1),
+    }
+
+
+async def import_foods(
+    text_stream: IO[str],
+    fmt: str,
+    batch_size: int = FOOD_IMPORT_BATCH_SIZE,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """
+    Streams a CSV or NDJSON food file into the catalog. Rows are validated
+    against Food and deduped on normalized name + serving, both within a batch
+    (last row wins) and against the collection via keyed upserts. Only one
+    batch is held in memory at a time, so file size does not matter.
+    """
+    if fmt not in FOOD_IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {fmt}")
+
+    await ensure_food_search_index()
+
+    stats: Dict[str, Any] = {
+        "format": fmt,
+        "rows": 0,
+        "valid": 0,
+        "invalid": 0,
+        "duplicates": 0,
+        "inserted": 0,
+        "updated": 0,
+        "write_errors": 0,
+        "errors": [],
+    }
+    started = time.monotonic()
+    batch: Dict[Tuple[str, str], Dict[str, Any]] = {}
+
+    for line_number, row in iter_food_import_rows(text_stream, fmt):
+        stats["rows"] += 1
+        try:
+            doc = food_import_doc(row)
+        except ValueError as e:
+            stats["invalid"] += 1
+            if len(stats["errors"]) < FOOD_IMPORT_MAX_ERROR_SAMPLES:
+                stats["errors"].append({"line": line_number, "error": str(e)[:300]})
+            continue
+
+        stats["valid"] += 1
+        key = (doc["name_normalized"], doc["serving_normalized"])
+        if key in batch:
+            stats["duplicates"] += 1
+        batch[key] = doc
+
+        if len(batch) >= batch_size:
+            await _write_food_import_batch(batch, stats)
+            batch = {}
+            if progress:
+                progress(_food_import_rate(stats, started))
+
+    if batch:
+        await _write_food_import_batch(batch, stats)
+
+    if stats["inserted"] or stats["updated"]:
+        await bump_catalog_version("foods")
+    return _food_import_rate(stats, started)
 
 # ============== Lifecycle Notifications ==============
 
@@ -3157,7 +5396,7 @@ async def private_leaderboard(
 
     workouts = await db.workouts.find(
         {"user_id": {"$in": list(participant_ids)}},
-        {"_id": 0, "user_id": 1, "date": 1, "exercises": 1},
+        {"_id": 0, "workout_id": 1, "user_id": 1, "date": 1, "summary": 1},
     ).to_list(length=50000)
 
     cutoff = datetime.now(timezone.utc) - timedelta(days=days)
@@ -3168,10 +5407,11 @@ async def private_leaderboard(
         except Exception:
             return False
 
+    in_range = [workout for workout in workouts if _in_range(workout.get("date"))]
+    await load_workout_summaries(in_range)
+
     grouped: Dict[str, List[Dict[str, Any]]] = {pid: [] for pid in participant_ids}
-    for workout in workouts:
-        if not _in_range(workout.get("date")):
-            continue
+    for workout in in_range:
         uid = workout.get("user_id")
         if uid in grouped:
             grouped[uid].append(workout)
@@ -3202,6 +5442,76 @@ async def private_leaderboard(
         "leaderboard": leaderboard,
     }
 
+# ============== Internal Runtime Stats ==============
+
+@api_router.get("/internal/cache/stats")
+async def get_internal_cache_stats(request: Request, _: None = Depends(require_internal_cron)):
+    """In-process cache counters for latency/capacity monitoring."""
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "session_cache": get_session_cache_stats(),
+        "firebase_token_cache": get_firebase_token_cache_stats(),
+        "entitlement_cache": get_entitlement_cache_stats(),
+        "catalog_response_cache": get_catalog_response_cache_stats(),
+        "food_suggest": get_food_suggest_stats(),
+        "rate_limiter": get_rate_limit_stats(),
+    }
+
+
+@api_router.get("/internal/sessions/stats")
+async def get_internal_session_stats(request: Request, _: None = Depends(require_internal_cron)):
+    """Live vs expired/reaped session counts for capacity monitoring."""
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "sessions": await get_session_expiry_stats(),
+    }
+
+
+@api_router.get("/internal/indexes/report")
+async def get_internal_index_report(request: Request, _: None = Depends(require_internal_cron)):
+    """explain() for every registered hot query; any COLLSCAN is a missing or unused index."""
+    queries = await explain_hot_queries()
+    return {
+        "generated_at": datetime.now(timezone.utc).isoformat(),
+        "collscans": [row["query"] for row in queries if row.get("collscan")],
+        "queries": queries,
+    }
+
+
+@api_router.post("/internal/foods/import")
+async def import_foods_endpoint(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(csv|ndjson)$"),
+    _: None = Depends(require_internal_cron),
+):
+    """Bulk-load foods from a CSV or NDJSON request body."""
+    # Spool the body (to disk past FOOD_IMPORT_SPOOL_BYTES) so large uploads don't sit in memory.
+    with tempfile.SpooledTemporaryFile(max_size=FOOD_IMPORT_SPOOL_BYTES) as spool:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+
+        text_stream = io.TextIOWrapper(spool, encoding="utf-8-sig", newline="")
+        try:
+            stats = await import_foods(text_stream, format)
+        finally:
+            text_stream.detach()
+
+    logger.info(
+        f"Food import finished: {stats['rows']} rows, {stats['inserted']} inserted, "
+        f"{stats['updated']} updated, {stats['invalid']} invalid ({stats['rows_per_second']} rows/s)"
+    )
+    return stats
+
+
+@api_router.post("/internal/entitlements/{user_id}/invalidate")
+async def invalidate_entitlements_endpoint(user_id: str, request: Request, _: None = Depends(require_internal_cron)):
+    """Drop cached entitlement/session state after a subscription change (webhooks, admin tools)."""
+    user_doc = await db.users.find_one({"user_id": user_id}, {"_id": 0})
+    await refresh_session_user_snapshots(user_doc)
+    invalidate_user_entitlements(user_id)
+    return {"invalidated": True, "user_id": user_id}
+
 # ============== Health Check ==============
 
 @api_router.get("/health")
@@ -3212,6 +5522,36 @@ async def health_check():
 # Include the router
 app.include_router(api_router)
 
+@app.middleware("http")
+async def pre_auth_rate_limit(request: Request, call_next):
+    """
+    Per-IP limits by route prefix, applied before dependency resolution so
+    abusive clients are rejected without session lookups or token verification.
+    Always uses the in-process limiter to stay free of DB round trips.
+    """
+    if PRE_AUTH_RATE_LIMIT_ENABLED and request.method != "OPTIONS":
+        rule = _pre_auth_rate_limit_rule(request.url.path)
+        if rule:
+            prefix, limit, window_seconds = rule
+            _pre_auth_rate_limit_stats["checked"] += 1
+            key = f"preauth:{prefix}:{_client_identifier(request)}"
+            allowed = await _memory_rate_limit_allow(
+                key,
+                limit,
+                window_seconds,
+                cache=_pre_auth_rate_limit_cache,
+                max_keys=PRE_AUTH_RATE_LIMIT_MAX_KEYS,
+                stats=_pre_auth_rate_limit_stats,
+            )
+            if not allowed:
+                _pre_auth_rate_limit_stats["rejected"] += 1
+                return JSONResponse(
+                    status_code=429,
+                    content={"detail": "Too many requests"},
+                    headers={"Retry-After": str(window_seconds)},
+                )
+    return await call_next(request)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -3221,6 +5561,67 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def startup_bootstrap():
+    await bootstrap_reference_data()
+    await ensure_food_search_index()
+    await ensure_indexes()
+    ensure_workout_summaries()
+    await ensure_session_expiry()
+    await ensure_rate_limit_backend()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in _background_tasks.values():
+        task.cancel()
     client.close()
+    await close_outbound_http_clients()
+
+
+def _run_cli(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="GainTrack backend maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import-foods", help="Stream a CSV or NDJSON file into the foods catalog")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=FOOD_IMPORT_FORMATS, help="Defaults to the file extension")
+    import_parser.add_argument("--batch-size", type=int, default=FOOD_IMPORT_BATCH_SIZE)
+
+    report_parser = commands.add_parser("index-report", help="Explain the hot queries and flag collection scans")
+    report_parser.add_argument("--ensure", action="store_true", help="Ensure registered indexes before explaining")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "index-report":
+        async def _report() -> Dict[str, Any]:
+            ensured = await ensure_indexes() if args.ensure else None
+            return {"indexes": ensured, "queries": await explain_hot_queries()}
+
+        report = asyncio.run(_report())
+        for row in report["queries"]:
+            status = "ERROR" if "error" in row else ("COLLSCAN" if row["collscan"] else "ok")
+            detail = row.get("error") or " > ".join(row["stages"])
+            print(f"{status:9} {row['collection']:22} {row['query']:24} {detail}")
+        if report["indexes"] and report["indexes"]["failed"]:
+            print(f"Indexes not created: {', '.join(report['indexes']['failed'])}")
+        return 1 if any(row.get("collscan") or "error" in row for row in report["queries"]) else 0
+
+    if args.command == "import-foods":
+        fmt = args.format or ("csv" if args.path.lower().endswith(".csv") else "ndjson")
+
+        def _report(progress: Dict[str, Any]) -> None:
+            logger.info(f"Imported {progress['rows']} rows ({progress['rows_per_second']} rows/s)")
+
+        async def _import() -> Dict[str, Any]:
+            with open(args.path, encoding="utf-8-sig", newline="") as handle:
+                return await import_foods(handle, fmt, batch_size=max(args.batch_size, 1), progress=_report)
+
+        stats = asyncio.run(_import())
+        print(json.dumps(stats, indent=2))
+        return 1 if stats["write_errors"] else 0
+
+    return 2
+
+
+if __name__ == "__main__":
+    sys.exit(_run_cli())
@@ -1,8 +1,11 @@
+import gzip
+import io
+import json
 import importlib.util
 from pathlib import Path
 from types import SimpleNamespace
 from unittest.mock import AsyncMock
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
 import pytest
 from pydantic import ValidationError
@@ -616,3 +619,1734 @@ async def test_get_kpi_summary_handles_empty_inputs(backend_server):
     assert result["engagement"]["unique_users"] == 0
     assert result["engagement"]["top_actions"] == []
 
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_serves_repeat_sessions_from_cache(backend_server):
+    session_doc = {
+        "user_id": "u-cache-1",
+        "session_token": "sess-cache-1",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=1),
+    }
+    user_doc = {
+        "user_id": "u-cache-1",
+        "email": "cache@example.com",
+        "name": "Cache User",
+        "created_at": datetime.now(timezone.utc),
+    }
+    user_sessions = SimpleNamespace(
+        find_one=AsyncMock(return_value=session_doc),
+        update_one=AsyncMock(return_value=None),
+    )
+    users = SimpleNamespace(find_one=AsyncMock(return_value=user_doc))
+    backend_server.db = SimpleNamespace(user_sessions=user_sessions, users=users)
+
+    request = _make_request(headers=[(b"authorization", b"Bearer sess-cache-1")])
+    first = await backend_server.get_current_user(request)
+    second = await backend_server.get_current_user(request)
+
+    assert first.user_id == second.user_id == "u-cache-1"
+    assert user_sessions.find_one.await_count == 1
+    assert users.find_one.await_count == 1
+    stats = backend_server.get_session_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_update_goals_invalidates_cached_sessions(backend_server):
+    user_doc = {
+        "user_id": "u-cache-2",
+        "email": "cache2@example.com",
+        "name": "Cache User Two",
+        "created_at": datetime.now(timezone.utc),
+    }
+    expires_at = datetime.now(timezone.utc) + backend_server.timedelta(days=1)
+    backend_server._cache_session_user("sess-cache-2", user_doc, expires_at)
+    backend_server._cache_session_user("sess-cache-3", user_doc, expires_at)
+
+    backend_server.db = SimpleNamespace(
+        users=SimpleNamespace(find_one_and_update=AsyncMock(return_value={**user_doc, "profile_version": 1})),
+        user_sessions=SimpleNamespace(update_many=AsyncMock(return_value=None)),
+    )
+    user = backend_server.User(**user_doc)
+
+    await backend_server.update_goals(backend_server.UserGoals(), _make_request(), user)
+
+    assert "sess-cache-2" not in backend_server._session_user_cache
+    assert "sess-cache-3" not in backend_server._session_user_cache
+    assert backend_server.get_session_cache_stats()["invalidations"] == 2
+
+
+def test_session_cache_evicts_least_recently_used(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "SESSION_CACHE_MAX_ENTRIES", 2)
+    expires_at = datetime.now(timezone.utc) + backend_server.timedelta(days=1)
+    for idx in range(3):
+        backend_server._cache_session_user(
+            f"sess-lru-{idx}",
+            {"user_id": f"u-lru-{idx}", "email": "lru@example.com", "name": "LRU", "created_at": expires_at},
+            expires_at,
+        )
+
+    assert list(backend_server._session_user_cache.keys()) == ["sess-lru-1", "sess-lru-2"]
+    assert "u-lru-0" not in backend_server._session_cache_tokens_by_user
+    assert backend_server.get_session_cache_stats()["evictions"] == 1
+
+
+@pytest.mark.asyncio
+async def test_verify_firebase_payload_reuses_verified_token_until_kid_rotates(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "FIREBASE_PROJECT_ID", "gaintrack-test")
+    monkeypatch.setattr(backend_server.jwt, "get_unverified_header", lambda _token: {"kid": "kid-1"})
+    certs = {"kid-1": "fake-cert"}
+    monkeypatch.setattr(backend_server, "_get_firebase_certs", AsyncMock(side_effect=lambda: certs))
+
+    decode_calls = []
+
+    def _decode(*_args, **_kwargs):
+        decode_calls.append(1)
+        return {"sub": "firebase-user", "exp": backend_server.time.time() + 600}
+
+    monkeypatch.setattr(backend_server.jwt, "decode", _decode)
+
+    first = await backend_server.verify_firebase_token_payload("id-token")
+    second = await backend_server.verify_firebase_token_payload("id-token")
+    assert first["sub"] == second["sub"] == "firebase-user"
+    assert len(decode_calls) == 1
+    assert backend_server.get_firebase_token_cache_stats()["hits"] == 1
+
+    certs.pop("kid-1")
+    certs["kid-2"] = "rotated-cert"
+    assert await backend_server.verify_firebase_token_payload("id-token") is None
+    assert backend_server.get_firebase_token_cache_stats()["kid_rotations"] == 1
+
+
+@pytest.mark.asyncio
+async def test_verify_firebase_payload_parses_published_x509_certificate(backend_server, monkeypatch):
+    pytest.importorskip("cryptography")
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.x509.oid import NameOID
+
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, "securetoken.system.gserviceaccount.com")])
+    now = datetime.now(timezone.utc)
+    cert_pem = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(hours=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+        .public_bytes(serialization.Encoding.PEM)
+        .decode()
+    )
+
+    monkeypatch.setattr(backend_server, "FIREBASE_PROJECT_ID", "gaintrack-test")
+    monkeypatch.setattr(backend_server, "_get_firebase_certs", AsyncMock(return_value={"kid-x509": cert_pem}))
+    token = backend_server.jwt.encode(
+        {
+            "sub": "firebase-x509",
+            "aud": "gaintrack-test",
+            "iss": "https://securetoken.google.com/gaintrack-test",
+            "iat": int(now.timestamp()),
+            "exp": int(now.timestamp()) + 600,
+        },
+        private_key,
+        algorithm="RS256",
+        headers={"kid": "kid-x509"},
+    )
+
+    payload = await backend_server.verify_firebase_token_payload(token)
+
+    assert payload["sub"] == "firebase-x509"
+    cached_key = backend_server._firebase_certs_cache["keys"]["kid-x509"]
+    assert cached_key.public_numbers() == private_key.public_key().public_numbers()
+    assert backend_server._get_firebase_public_key("kid-x509", cert_pem) is cached_key
+
+
+def _fake_certs_client_factory(backend_server, monkeypatch, certs_by_call, max_age=3600):
+    import asyncio
+    import httpx
+
+    calls = []
+    real_client = httpx.AsyncClient
+
+    async def _handler(_request):
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        body = certs_by_call[min(len(calls), len(certs_by_call)) - 1]
+        return httpx.Response(200, json=body, headers={"Cache-Control": f"public, max-age={max_age}"})
+
+    def _client(*args, **kwargs):
+        kwargs["transport"] = httpx.MockTransport(_handler)
+        return real_client(*args, **kwargs)
+
+    monkeypatch.setattr(backend_server.httpx, "AsyncClient", _client)
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_get_firebase_certs_single_flight_on_cold_cache(backend_server, monkeypatch):
+    import asyncio
+
+    calls = _fake_certs_client_factory(backend_server, monkeypatch, [{"kid-1": "pem-1"}])
+
+    results = await asyncio.gather(*[backend_server._get_firebase_certs() for _ in range(10)])
+
+    assert all(result == {"kid-1": "pem-1"} for result in results)
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_get_firebase_certs_serves_stale_while_refreshing(backend_server, monkeypatch):
+    calls = _fake_certs_client_factory(backend_server, monkeypatch, [{"kid-2": "pem-2"}])
+    now = datetime.now(timezone.utc)
+    backend_server._firebase_certs_cache.update(
+        {
+            "certs": {"kid-1": "pem-1"},
+            "keys": {"kid-1": "parsed-1"},
+            "refresh_at": now - backend_server.timedelta(seconds=1),
+            "expires_at": now + backend_server.timedelta(seconds=60),
+        }
+    )
+
+    stale = await backend_server._get_firebase_certs()
+    assert stale == {"kid-1": "pem-1"}
+
+    await backend_server._firebase_certs_cache["refresh_task"]
+    assert len(calls) == 1
+    assert await backend_server._get_firebase_certs() == {"kid-2": "pem-2"}
+    assert backend_server._firebase_certs_cache["keys"] == {}
+
+
+@pytest.mark.asyncio
+async def test_require_pro_user_reuses_entitlements_loaded_by_auth(backend_server):
+    session_doc = {
+        "user_id": "u-pro-fused",
+        "session_token": "sess-pro-fused",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=1),
+    }
+    user_doc = {
+        "user_id": "u-pro-fused",
+        "email": "pro@example.com",
+        "name": "Pro User",
+        "created_at": datetime.now(timezone.utc),
+        "entitlements": {"pro": True},
+    }
+    users = SimpleNamespace(find_one=AsyncMock(return_value=user_doc))
+    backend_server.db = SimpleNamespace(
+        user_sessions=SimpleNamespace(
+            find_one=AsyncMock(return_value=session_doc),
+            update_one=AsyncMock(return_value=None),
+        ),
+        users=users,
+    )
+
+    request = _make_request(headers=[(b"authorization", b"Bearer sess-pro-fused")])
+    user = await backend_server.get_current_user(request)
+    result = await backend_server.require_pro_user(request, user)
+
+    assert result.user_id == "u-pro-fused"
+    assert users.find_one.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_invalidate_user_entitlements_forces_fresh_read(backend_server):
+    users = SimpleNamespace(find_one=AsyncMock(return_value={"user_id": "u-pro-2", "isPro": True}))
+    backend_server.db = SimpleNamespace(users=users)
+    user = backend_server.User(
+        user_id="u-pro-2",
+        email="pro2@example.com",
+        name="Pro Two",
+        created_at=datetime.now(timezone.utc),
+    )
+
+    await backend_server.require_pro_user(_make_request(), user)
+    await backend_server.require_pro_user(_make_request(), user)
+    assert users.find_one.await_count == 1
+
+    users.find_one.return_value = {"user_id": "u-pro-2", "isPro": False}
+    backend_server.invalidate_user_entitlements("u-pro-2")
+
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.require_pro_user(_make_request(), user)
+    assert exc.value.status_code == 403
+    assert users.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_entitlement_cache_bounds_staleness_across_session_cache_hits(backend_server):
+    user_doc = {
+        "user_id": "u-pro-ttl",
+        "email": "ttl@example.com",
+        "name": "TTL User",
+        "created_at": datetime.now(timezone.utc),
+        "isPro": True,
+    }
+    session_doc = {
+        "user_id": "u-pro-ttl",
+        "session_token": "sess-pro-ttl",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=1),
+        "user_snapshot": backend_server.build_user_snapshot(user_doc),
+    }
+    users = SimpleNamespace(find_one=AsyncMock(return_value=user_doc))
+    backend_server.db = SimpleNamespace(
+        user_sessions=SimpleNamespace(find_one=AsyncMock(return_value=session_doc)),
+        users=users,
+    )
+
+    async def _pro_request():
+        request = _make_request(headers=[(b"authorization", b"Bearer sess-pro-ttl")])
+        return await backend_server.require_pro_user(request, await backend_server.get_current_user(request))
+
+    await _pro_request()
+    await _pro_request()  # session cache hit; entitlement cache answers
+    assert users.find_one.await_count == 1
+
+    users.find_one.return_value = {**user_doc, "isPro": False}
+    backend_server._entitlement_cache["u-pro-ttl"]["expires_at"] = 0
+    with pytest.raises(HTTPException) as exc:
+        await _pro_request()
+    assert exc.value.status_code == 403
+    assert users.find_one.await_count == 2
+
+
+@pytest.mark.asyncio
+async def test_get_current_user_uses_embedded_session_snapshot(backend_server):
+    user_doc = {
+        "user_id": "u-snap-1",
+        "email": "snap@example.com",
+        "name": "Snapshot User",
+        "created_at": datetime.now(timezone.utc),
+        "equipment": ["barbell"],
+        "subscription": {"pro": True, "store": "app_store"},
+    }
+    session_doc = {
+        "user_id": "u-snap-1",
+        "session_token": "sess-snap-1",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=1),
+        "user_snapshot": backend_server.build_user_snapshot(user_doc),
+    }
+    users = SimpleNamespace(find_one=AsyncMock(return_value=user_doc))
+    backend_server.db = SimpleNamespace(
+        user_sessions=SimpleNamespace(find_one=AsyncMock(return_value=session_doc)),
+        users=users,
+    )
+
+    request = _make_request(headers=[(b"authorization", b"Bearer sess-snap-1")])
+    user = await backend_server.get_current_user(request)
+
+    assert user.equipment == ["barbell"]
+    assert not hasattr(request.state, "user_is_pro")
+    assert "subscription" not in session_doc["user_snapshot"]
+    assert "isPro" not in session_doc["user_snapshot"]
+    users.find_one.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_revoked_pro_is_not_served_from_session_snapshot(backend_server):
+    user_doc = {
+        "user_id": "u-revoked",
+        "email": "revoked@example.com",
+        "name": "Revoked User",
+        "created_at": datetime.now(timezone.utc),
+    }
+    # A snapshot written while the user was Pro, then the subscription lapsed.
+    snapshot = {**backend_server.build_user_snapshot({**user_doc, "isPro": True}), "isPro": True}
+    session_doc = {
+        "user_id": "u-revoked",
+        "session_token": "sess-revoked",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=7),
+        "user_snapshot": snapshot,
+    }
+    users = SimpleNamespace(find_one=AsyncMock(return_value={**user_doc, "isPro": False}))
+    backend_server.db = SimpleNamespace(
+        user_sessions=SimpleNamespace(find_one=AsyncMock(return_value=session_doc)),
+        users=users,
+    )
+
+    request = _make_request(headers=[(b"authorization", b"Bearer sess-revoked")])
+    user = await backend_server.get_current_user(request)
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.require_pro_user(request, user)
+
+    assert exc.value.status_code == 403
+    assert users.find_one.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_snapshot_backfill_does_not_clobber_a_newer_profile_write(backend_server):
+    stale_doc = {
+        "user_id": "u-snap-race",
+        "email": "race@example.com",
+        "name": "Race User",
+        "created_at": datetime.now(timezone.utc),
+        "equipment": ["barbell"],
+        "profile_version": 3,
+    }
+    session_doc = {
+        "user_id": "u-snap-race",
+        "session_token": "sess-snap-race",
+        "expires_at": datetime.now(timezone.utc) + backend_server.timedelta(days=7),
+    }
+    newer_snapshot = backend_server.build_user_snapshot({**stale_doc, "equipment": ["bands"], "profile_version": 4})
+
+    async def _read_user(*_args, **_kwargs):
+        # update_equipment commits v4 and refreshes the sessions after our read.
+        session_doc["user_snapshot"] = newer_snapshot
+        return stale_doc
+
+    async def _update_one(filter_doc, update_doc):
+        current = session_doc.get("user_snapshot", {}).get("profile_version")
+        guard = filter_doc["user_snapshot.profile_version"]["$not"]["$gt"]
+        if current is None or not current > guard:
+            session_doc.update(update_doc["$set"])
+
+    backend_server.db = SimpleNamespace(
+        user_sessions=SimpleNamespace(find_one=AsyncMock(return_value=dict(session_doc)), update_one=_update_one),
+        users=SimpleNamespace(find_one=_read_user),
+    )
+
+    user = await backend_server.get_current_user(_make_request(headers=[(b"authorization", b"Bearer sess-snap-race")]))
+
+    assert user.equipment == ["barbell"]
+    assert session_doc["user_snapshot"] is newer_snapshot
+
+
+@pytest.mark.asyncio
+async def test_update_equipment_refreshes_session_snapshots_with_version_guard(backend_server):
+    updated_doc = {
+        "user_id": "u-snap-2",
+        "email": "snap2@example.com",
+        "name": "Snapshot Two",
+        "created_at": datetime.now(timezone.utc),
+        "equipment": ["bands"],
+        "profile_version": 4,
+    }
+    user_sessions = SimpleNamespace(update_many=AsyncMock(return_value=None))
+    backend_server.db = SimpleNamespace(
+        users=SimpleNamespace(find_one_and_update=AsyncMock(return_value=updated_doc)),
+        user_sessions=user_sessions,
+    )
+    user = backend_server.User(**updated_doc)
+
+    await backend_server.update_equipment(backend_server.UserEquipment(equipment=["bands"]), _make_request(), user)
+
+    filter_doc, update_doc = user_sessions.update_many.await_args.args
+    assert filter_doc["user_snapshot.profile_version"] == {"$not": {"$gt": 4}}
+    assert update_doc["$set"]["user_snapshot"]["equipment"] == ["bands"]
+    assert update_doc["$set"]["user_snapshot"]["profile_version"] == 4
+
+
+def _make_json_request(body):
+    payload = json.dumps(body).encode()
+
+    async def _receive():
+        return {"type": "http.request", "body": payload, "more_body": False}
+
+    scope = {
+        "type": "http",
+        "method": "POST",
+        "path": "/",
+        "headers": [(b"content-type", b"application/json")],
+    }
+    return Request(scope, _receive)
+
+
+@pytest.mark.asyncio
+async def test_exchange_session_upserts_user_and_replaces_sessions(backend_server, monkeypatch):
+    class _FakeAuthResponse:
+        status_code = 200
+
+        @staticmethod
+        def json():
+            return {
+                "email": "login@example.com",
+                "name": "Login User",
+                "picture": None,
+                "session_token": "sess-login-1",
+            }
+
+    fake_client = SimpleNamespace(get=AsyncMock(return_value=_FakeAuthResponse()))
+    monkeypatch.setattr(backend_server, "get_outbound_http_client", lambda: fake_client)
+
+    user_doc = {
+        "user_id": "u-login-1",
+        "email": "login@example.com",
+        "name": "Login User",
+        "created_at": datetime.now(timezone.utc),
+        "profile_version": 1,
+    }
+    users = SimpleNamespace(find_one_and_update=AsyncMock(return_value=user_doc))
+    user_sessions = SimpleNamespace(
+        delete_many=AsyncMock(return_value=None),
+        replace_one=AsyncMock(return_value=None),
+    )
+    backend_server.db = SimpleNamespace(users=users, user_sessions=user_sessions)
+
+    result = await backend_server.exchange_session(
+        _make_json_request({"session_id": "sid-1"}),
+        backend_server.Response(),
+    )
+
+    assert result["user"]["user_id"] == "u-login-1"
+    assert users.find_one_and_update.await_args.kwargs["upsert"] is True
+    delete_filter = user_sessions.delete_many.await_args.args[0]
+    assert delete_filter == {"user_id": "u-login-1", "session_token": {"$ne": "sess-login-1"}}
+    replace_args = user_sessions.replace_one.await_args
+    assert replace_args.args[0] == {"session_token": "sess-login-1"}
+    assert replace_args.args[1]["user_snapshot"]["user_id"] == "u-login-1"
+    assert replace_args.kwargs["upsert"] is True
+
+
+@pytest.mark.asyncio
+async def test_ensure_session_expiry_prefers_ttl_index(backend_server):
+    user_sessions = SimpleNamespace(create_index=AsyncMock(return_value="user_sessions_expires_at_ttl"))
+    backend_server.db = SimpleNamespace(user_sessions=user_sessions)
+
+    mode = await backend_server.ensure_session_expiry()
+
+    assert mode == "ttl_index"
+    assert user_sessions.create_index.await_args.kwargs["expireAfterSeconds"] == 0
+    assert "session_sweeper" not in backend_server._background_tasks
+
+
+@pytest.mark.asyncio
+async def test_ensure_session_expiry_falls_back_to_sweeper(backend_server):
+    user_sessions = SimpleNamespace(
+        create_index=AsyncMock(side_effect=RuntimeError("TTL indexes not supported")),
+        delete_many=AsyncMock(return_value=SimpleNamespace(deleted_count=3)),
+    )
+    backend_server.db = SimpleNamespace(user_sessions=user_sessions)
+
+    mode = await backend_server.ensure_session_expiry()
+    sweeper = backend_server._background_tasks["session_sweeper"]
+    sweeper.cancel()
+
+    assert mode == "sweeper"
+    assert await backend_server.sweep_expired_sessions() == 3
+    assert backend_server._session_expiry_stats["reaped"] >= 3
+
+
+@pytest.mark.asyncio
+async def test_enforce_mutation_rate_limit_caps_tracked_keys(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "MUTATION_RATE_LIMIT_MAX_KEYS", 3)
+
+    for idx in range(5):
+        request = _make_request(headers=[(b"x-forwarded-for", f"10.0.1.{idx}".encode())])
+        await backend_server.enforce_mutation_rate_limit(request, "test.cap", limit=5, window_seconds=60)
+
+    stats = backend_server.get_rate_limit_stats()
+    assert stats["keys"] == 3
+    assert stats["evicted_capacity"] == 2
+    assert stats["approx_memory_bytes"] > 0
+    assert "test.cap:ip:10.0.1.0" not in backend_server._mutation_rate_limit_cache
+
+
+@pytest.mark.asyncio
+async def test_enforce_mutation_rate_limit_evicts_idle_keys(backend_server):
+    idle_request = _make_request(headers=[(b"x-forwarded-for", b"10.0.2.1")])
+    await backend_server.enforce_mutation_rate_limit(idle_request, "test.idle", limit=5, window_seconds=10)
+
+    # Age the entry past two windows of inactivity.
+    backend_server._mutation_rate_limit_cache["test.idle:ip:10.0.2.1"][4] -= 25
+    active_request = _make_request(headers=[(b"x-forwarded-for", b"10.0.2.2")])
+    await backend_server.enforce_mutation_rate_limit(active_request, "test.idle", limit=5, window_seconds=10)
+
+    assert list(backend_server._mutation_rate_limit_cache.keys()) == ["test.idle:ip:10.0.2.2"]
+    assert backend_server.get_rate_limit_stats()["evicted_idle"] == 1
+
+
+class _FakeRateLimitCounters:
+    def __init__(self):
+        self.counts = {}
+        self.find_one = AsyncMock(side_effect=self._find_one)
+
+    async def find_one_and_update(self, filter_doc, update, **_kwargs):
+        counter_id = filter_doc["_id"]
+        self.counts[counter_id] = self.counts.get(counter_id, 0) + update["$inc"]["count"]
+        return {"_id": counter_id, "count": self.counts[counter_id]}
+
+    async def _find_one(self, filter_doc, _projection=None):
+        count = self.counts.get(filter_doc["_id"])
+        return {"count": count} if count is not None else None
+
+    async def update_one(self, filter_doc, update):
+        self.counts[filter_doc["_id"]] += update["$inc"]["count"]
+
+
+@pytest.mark.asyncio
+async def test_mongo_rate_limit_backend_shares_counters(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "RATE_LIMIT_BACKEND", "mongo")
+    counters = _FakeRateLimitCounters()
+    backend_server.db = SimpleNamespace(rate_limit_counters=counters)
+    request = _make_request(headers=[(b"x-forwarded-for", b"10.0.3.1")])
+
+    for _ in range(3):
+        await backend_server.enforce_mutation_rate_limit(request, "test.shared", limit=3, window_seconds=3600)
+
+    # Another worker's local state is irrelevant; the shared bucket is already full.
+    backend_server._mutation_rate_limit_cache.clear()
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.enforce_mutation_rate_limit(request, "test.shared", limit=3, window_seconds=3600)
+
+    assert exc.value.status_code == 429
+    assert counters.find_one.await_count == 1
+    # Rejected attempts are not counted, matching the memory backend.
+    with pytest.raises(HTTPException):
+        await backend_server.enforce_mutation_rate_limit(request, "test.shared", limit=3, window_seconds=3600)
+    assert sum(counters.counts.values()) == 3
+
+
+@pytest.mark.asyncio
+async def test_rate_limit_falls_back_to_memory_when_shared_backend_fails(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "RATE_LIMIT_BACKEND", "mongo")
+    backend_server.db = SimpleNamespace(
+        rate_limit_counters=SimpleNamespace(
+            find_one_and_update=AsyncMock(side_effect=RuntimeError("mongo down")),
+            find_one=AsyncMock(side_effect=RuntimeError("mongo down")),
+        )
+    )
+    request = _make_request(headers=[(b"x-forwarded-for", b"10.0.3.2")])
+
+    await backend_server.enforce_mutation_rate_limit(request, "test.fallback", limit=1, window_seconds=60)
+    with pytest.raises(HTTPException):
+        await backend_server.enforce_mutation_rate_limit(request, "test.fallback", limit=1, window_seconds=60)
+
+    assert backend_server.get_rate_limit_stats()["backend_errors"] == 2
+
+
+def test_pre_auth_rate_limit_rejects_before_session_lookup(backend_server, monkeypatch):
+    from fastapi.testclient import TestClient
+
+    monkeypatch.setattr(backend_server, "PRE_AUTH_RATE_LIMITS", backend_server._parse_pre_auth_rate_limits("/api/auth/=2/60"))
+    user_sessions = SimpleNamespace(find_one=AsyncMock(return_value=None))
+    backend_server.db = SimpleNamespace(user_sessions=user_sessions)
+    monkeypatch.setattr(backend_server, "verify_firebase_token_payload", AsyncMock(return_value=None))
+
+    test_client = TestClient(backend_server.app)
+    headers = {"Authorization": "Bearer bad-token", "X-Forwarded-For": "10.0.4.1"}
+
+    assert test_client.get("/api/auth/me", headers=headers).status_code == 401
+    assert test_client.get("/api/auth/me", headers=headers).status_code == 401
+    rejected = test_client.get("/api/auth/me", headers=headers)
+
+    assert rejected.status_code == 429
+    assert rejected.headers["Retry-After"] == "60"
+    assert user_sessions.find_one.await_count == 2
+    assert test_client.get("/api/health", headers=headers).status_code == 200
+
+
+def test_default_pre_auth_limits_only_cover_login_not_session_checks(backend_server):
+    # Every app launch calls /api/auth/me; only the login exchange is limited per IP.
+    assert backend_server._pre_auth_rate_limit_rule("/api/auth/session") == ("/api/auth/session", 60, 60)
+    assert backend_server._pre_auth_rate_limit_rule("/api/auth/me") is None
+    assert backend_server._pre_auth_rate_limit_rule("/api/workouts") is None
+    assert backend_server._parse_pre_auth_rate_limits(" /api/a/=5/10, ,/api/=100/60") == [
+        ("/api/a/", 5, 10),
+        ("/api/", 100, 60),
+    ]
+
+
+@pytest.mark.asyncio
+async def test_pre_auth_ip_churn_cannot_evict_user_mutation_windows(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "PRE_AUTH_RATE_LIMIT_MAX_KEYS", 3)
+    user_request = _make_request()
+    await backend_server.enforce_mutation_rate_limit(user_request, "test.user", "u-steady", limit=5, window_seconds=60)
+
+    for idx in range(10):
+        await backend_server._memory_rate_limit_allow(
+            f"preauth:/api/:ip:203.0.113.{idx}",
+            100,
+            60,
+            cache=backend_server._pre_auth_rate_limit_cache,
+            max_keys=backend_server.PRE_AUTH_RATE_LIMIT_MAX_KEYS,
+            stats=backend_server._pre_auth_rate_limit_stats,
+        )
+
+    assert "test.user:user:u-steady" in backend_server._mutation_rate_limit_cache
+    assert len(backend_server._pre_auth_rate_limit_cache) == 3
+    assert backend_server.get_rate_limit_stats()["pre_auth"]["evicted_capacity"] == 7
+
+
+def test_client_ip_ignores_forwarded_for_from_untrusted_peers(backend_server):
+    def _request(peer, forwarded_for):
+        return Request({
+            "type": "http",
+            "method": "GET",
+            "path": "/",
+            "headers": [(b"x-forwarded-for", forwarded_for.encode())],
+            "client": (peer, 443),
+        })
+
+    # Direct internet client: its own header is ignored.
+    assert backend_server._client_ip(_request("198.51.100.7", "1.2.3.4")) == "198.51.100.7"
+    # Behind a private load balancer: the hop it appended wins over a spoofed left-most value.
+    assert backend_server._client_ip(_request("10.0.0.5", "1.2.3.4, 198.51.100.7")) == "198.51.100.7"
+
+
+@pytest.mark.asyncio
+async def test_bootstrap_reference_data_upserts_defaults_by_natural_key(backend_server):
+    collections = {}
+    for name in ("exercises", "foods", "workout_templates"):
+        collections[name] = SimpleNamespace(
+            create_index=AsyncMock(return_value=f"{name}_unique"),
+            bulk_write=AsyncMock(return_value=SimpleNamespace(upserted_count=0)),
+        )
+    backend_server.db = collections
+
+    await backend_server.bootstrap_reference_data()
+
+    exercise_ops = collections["exercises"].bulk_write.await_args.args[0]
+    assert len(exercise_ops) == len(backend_server.DEFAULT_EXERCISES)
+    assert collections["exercises"].bulk_write.await_args.kwargs["ordered"] is False
+    assert collections["foods"].create_index.await_args.kwargs["unique"] is True
+    assert collections["foods"].create_index.await_args.args[0] == [("name", 1), ("serving_size", 1)]
+
+
+@pytest.mark.asyncio
+async def test_get_foods_does_not_count_documents(backend_server):
+    cursor = SimpleNamespace(limit=lambda _n: SimpleNamespace(to_list=AsyncMock(return_value=[])))
+    foods = SimpleNamespace(find=lambda *_args, **_kwargs: cursor, count_documents=AsyncMock())
+    backend_server.db = SimpleNamespace(
+        foods=foods,
+        catalog_versions=SimpleNamespace(find_one=AsyncMock(return_value=None)),
+    )
+
+    response = await backend_server.get_foods(_make_request())
+    assert json.loads(response.body) == []
+    foods.count_documents.assert_not_awaited()
+
+
+def _exercise_catalog_db(exercises, version=1):
+    versions = {"exercises": version}
+    find_calls = []
+
+    def _find(*_args, **_kwargs):
+        find_calls.append(1)
+        return SimpleNamespace(to_list=AsyncMock(return_value=exercises))
+
+    async def _find_version(filter_doc, _projection=None):
+        return {"version": versions[filter_doc["_id"]]}
+
+    return (
+        SimpleNamespace(
+            exercises=SimpleNamespace(find=_find),
+            catalog_versions=SimpleNamespace(find_one=_find_version),
+        ),
+        versions,
+        find_calls,
+    )
+
+
+@pytest.mark.asyncio
+async def test_exercise_catalog_filters_with_equipment_masks(backend_server):
+    exercises = [
+        {"exercise_id": "ex1", "name": "Bench Press", "category": "chest", "equipment_required": ["barbell", "bench"]},
+        {"exercise_id": "ex2", "name": "Push-ups", "category": "chest", "equipment_required": []},
+        {"exercise_id": "ex3", "name": "Barbell Rows", "category": "back", "equipment_required": ["barbell"]},
+        {"exercise_id": "ex4", "name": "Sled Push", "category": "legs", "equipment_required": ["sled"]},
+    ]
+    backend_server.db, _, _ = _exercise_catalog_db(exercises)
+
+    barbell_only = await backend_server.get_exercises(_make_request(), category=None, equipment="barbell")
+    assert [ex["exercise_id"] for ex in json.loads(barbell_only.body)] == ["ex2", "ex3"]
+
+    chest = await backend_server.get_exercises(_make_request(), category="chest", equipment=None)
+    assert [ex["exercise_id"] for ex in json.loads(chest.body)] == ["ex1", "ex2"]
+
+    user = backend_server.User(
+        user_id="u-eq",
+        email="eq@example.com",
+        name="Equipment User",
+        created_at=datetime.now(timezone.utc),
+        equipment=["barbell", "bench"],
+    )
+    for_user = await backend_server.get_exercises_for_user(_make_request(), user, category=None)
+    assert [ex["exercise_id"] for ex in json.loads(for_user.body)] == ["ex1", "ex2", "ex3"]
+
+
+@pytest.mark.asyncio
+async def test_exercise_catalog_reloads_only_when_version_changes(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "CATALOG_VERSION_CHECK_SECONDS", 0)
+    exercises = [{"exercise_id": "ex1", "name": "Planks", "category": "core", "equipment_required": []}]
+    backend_server.db, versions, find_calls = _exercise_catalog_db(exercises)
+
+    await backend_server.get_exercises(_make_request(), category=None, equipment=None)
+    await backend_server.get_exercises(_make_request(), category=None, equipment=None)
+    assert len(find_calls) == 1
+
+    versions["exercises"] = 2
+    await backend_server.get_exercises(_make_request(), category=None, equipment=None)
+    assert len(find_calls) == 2
+
+
+def test_catalog_endpoints_answer_if_none_match_without_querying(backend_server):
+    from fastapi.testclient import TestClient
+
+    templates = [{"template_id": "tmpl_1", "name": "Beginner 5x5", "difficulty": "beginner", "type": "strength"}]
+    find_calls = []
+
+    def _find(*_args, **_kwargs):
+        find_calls.append(1)
+        return SimpleNamespace(to_list=AsyncMock(return_value=templates))
+
+    catalog_versions = SimpleNamespace(find_one=AsyncMock(return_value={"version": 7}))
+    backend_server.db = SimpleNamespace(
+        workout_templates=SimpleNamespace(find=_find),
+        catalog_versions=catalog_versions,
+    )
+    test_client = TestClient(backend_server.app)
+
+    first = test_client.get("/api/templates?difficulty=beginner")
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"].startswith("public")
+    etag = first.headers["ETag"]
+
+    second = test_client.get("/api/templates?difficulty=beginner", headers={"If-None-Match": etag})
+    assert second.status_code == 304
+    assert second.headers["ETag"] == etag
+    assert len(find_calls) == 1
+    assert catalog_versions.find_one.await_count == 1
+
+    other_filter = test_client.get("/api/templates?difficulty=advanced", headers={"If-None-Match": etag})
+    assert other_filter.status_code == 200
+
+
+@pytest.mark.asyncio
+async def test_catalog_responses_reuse_serialized_bytes_and_gzip(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "CATALOG_GZIP_MIN_BYTES", 16)
+    templates = [{"template_id": f"tmpl_{idx}", "name": f"Program {idx}", "difficulty": "beginner"} for idx in range(5)]
+    find_calls = []
+
+    def _find(*_args, **_kwargs):
+        find_calls.append(1)
+        return SimpleNamespace(to_list=AsyncMock(return_value=templates))
+
+    backend_server.db = SimpleNamespace(
+        workout_templates=SimpleNamespace(find=_find),
+        catalog_versions=SimpleNamespace(find_one=AsyncMock(return_value={"version": 3})),
+    )
+
+    plain = await backend_server.get_workout_templates(_make_request(), difficulty="beginner")
+    assert json.loads(plain.body) == templates
+    assert "Content-Encoding" not in plain.headers
+
+    gzipped = await backend_server.get_workout_templates(
+        _make_request(headers=[(b"accept-encoding", b"gzip, deflate")]),
+        difficulty="beginner",
+    )
+    assert gzipped.headers["Content-Encoding"] == "gzip"
+    assert gzip.decompress(gzipped.body) == plain.body
+    # Byte-different representations never share a strong validator.
+    assert gzipped.headers["ETag"] == plain.headers["ETag"][:-1] + '-gz"'
+    assert len(find_calls) == 1
+
+    revalidated = await backend_server.get_workout_templates(
+        _make_request(headers=[(b"accept-encoding", b"gzip"), (b"if-none-match", gzipped.headers["ETag"].encode())]),
+        difficulty="beginner",
+    )
+    assert revalidated.status_code == 304
+    assert revalidated.headers["ETag"] == gzipped.headers["ETag"]
+
+    stats = backend_server.get_catalog_response_cache_stats()
+    assert stats["hits"] == 1
+    assert stats["misses"] == 1
+
+
+def _foods_collection(backend_server, names):
+    docs = [
+        {"food_id": f"fd_{idx}", "name": name, **backend_server.food_search_fields(name)}
+        for idx, name in enumerate(names)
+    ]
+    find_args = []
+
+    def _in_range(value, bounds):
+        return bounds["$gte"] <= value < bounds["$lt"]
+
+    def _matches(doc, query):
+        if "$and" in query:
+            return all(_matches(doc, clause) for clause in query["$and"])
+        if "name_tokens" in query and "$all" in query["name_tokens"]:
+            return set(query["name_tokens"]["$all"]) <= set(doc["name_tokens"])
+        if "name_tokens" in query:
+            return any(_in_range(token, query["name_tokens"]["$elemMatch"]) for token in doc["name_tokens"])
+        return _in_range(doc["name_normalized"], query["name_normalized"])
+
+    def _find(query, _projection):
+        find_args.append(query)
+        rows = [doc for doc in docs if _matches(doc, query)]
+        cursor = SimpleNamespace()
+        cursor.sort = lambda spec: rows.sort(key=lambda doc: tuple(doc[field] for field, _direction in spec)) or cursor
+        cursor.limit = lambda n: SimpleNamespace(to_list=AsyncMock(return_value=[dict(doc) for doc in rows[:n]]))
+        return cursor
+
+    return SimpleNamespace(find=_find), find_args
+
+
+@pytest.mark.asyncio
+async def test_food_search_uses_token_index_and_ranks_matches(backend_server):
+    foods, find_args = _foods_collection(
+        backend_server,
+        ["Rotisserie Chicken, Breast Meat", "Chicken Breast Sandwich", "Chicken Breast", "Grilled Breasts of Chicken"],
+    )
+    backend_server.db = SimpleNamespace(foods=foods)
+
+    results = await backend_server.search_foods("  CHICKEN breast")
+
+    # exact, name prefix, whole-word match, word-prefix match ("breasts")
+    assert [food["name"] for food in results] == [
+        "Chicken Breast",
+        "Chicken Breast Sandwich",
+        "Rotisserie Chicken, Breast Meat",
+        "Grilled Breasts of Chicken",
+    ]
+    assert find_args[0] == {"name_normalized": {"$gte": "chicken breast", "$lt": "chicken breasu"}}
+    assert find_args[1] == {"name_tokens": {"$all": ["breast", "chicken"]}}
+    assert find_args[2] == {
+        "$and": [
+            {"name_tokens": {"$elemMatch": {"$gte": "chicken", "$lt": "chickeo"}}},
+            {"name_tokens": {"$elemMatch": {"$gte": "breast", "$lt": "breasu"}}},
+        ]
+    }
+    assert backend_server.food_search_fields("Jalapeño, raw", "1 Pepper (14g)") == {
+        "name_normalized": "jalapeno raw",
+        "name_tokens": ["jalapeno", "raw"],
+        "name_length": 12,
+        "serving_normalized": "1 pepper 14g",
+    }
+
+
+@pytest.mark.asyncio
+async def test_food_search_finds_best_match_beyond_candidate_cap(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "FOOD_SEARCH_CANDIDATE_LIMIT", 5)
+    # Plenty of word matches stored ahead of the exact and prefix matches.
+    names = [f"Fried Chicken Variety {idx}" for idx in range(20)] + ["Chicken Thigh", "Chicken"]
+    foods, _find_args = _foods_collection(backend_server, names)
+    backend_server.db = SimpleNamespace(foods=foods)
+
+    results = await backend_server.search_foods("chicken", limit=3)
+
+    assert [food["name"] for food in results][:2] == ["Chicken", "Chicken Thigh"]
+
+
+@pytest.mark.asyncio
+async def test_food_search_reads_prefix_matches_shortest_first(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "FOOD_SEARCH_CANDIDATE_LIMIT", 5)
+    # More name-prefix matches than the cap, all sorting alphabetically before the best one.
+    names = [f"Chicken A La King Style {idx}" for idx in range(10)] + ["Chicken Wings"]
+    foods, find_args = _foods_collection(backend_server, names)
+    backend_server.db = SimpleNamespace(foods=foods)
+
+    results = await backend_server.search_foods("chicken", limit=3)
+
+    assert results[0]["name"] == "Chicken Wings"
+    # The prefix tier alone fills the page; the word tiers are never read.
+    assert len(find_args) == 1
+
+
+@pytest.mark.asyncio
+async def test_food_search_reads_whole_word_matches_before_word_prefixes(backend_server, monkeypatch):
+    monkeypatch.setattr(backend_server, "FOOD_SEARCH_CANDIDATE_LIMIT", 5)
+    # Word-prefix matches ("eggplant") outnumber the cap and are stored first.
+    names = [f"Baked Eggplant {idx}" for idx in range(10)] + ["Scrambled Egg"]
+    foods, _find_args = _foods_collection(backend_server, names)
+    backend_server.db = SimpleNamespace(foods=foods)
+
+    results = await backend_server.search_foods("egg", limit=3)
+
+    assert [food["name"] for food in results] == ["Scrambled Egg", "Baked Eggplant 0", "Baked Eggplant 1"]
+
+
+def _change_counters(counters=None):
+    """Fake user_change_counters: seq plus the list of pending reservations."""
+    counters = {} if counters is None else counters
+
+    async def _find_one_and_update(query, pipeline, **_kwargs):
+        count = pipeline[0]["$set"]["seq"]["$add"][1]
+        reserved_at = pipeline[1]["$set"]["pending"]["$concatArrays"][1][0]["at"]
+        counter = counters.setdefault(query["_id"], {"seq": 0, "pending": []})
+        counter["seq"] += count
+        counter["pending"].append({"first": counter["seq"] - count + 1, "at": reserved_at})
+        return {"_id": query["_id"], **counter}
+
+    async def _find_one(query, _projection):
+        counter = counters.get(query["_id"])
+        return dict(counter) if counter else None
+
+    async def _update_one(query, update):
+        counter = counters[query["_id"]]
+        condition = update["$pull"]["pending"]
+        if "first" in condition:
+            counter["pending"] = [entry for entry in counter["pending"] if entry["first"] != condition["first"]]
+        else:
+            counter["pending"] = [entry for entry in counter["pending"] if entry["at"] > condition["at"]["$lte"]]
+
+    return SimpleNamespace(
+        find_one_and_update=_find_one_and_update,
+        find_one=_find_one,
+        update_one=_update_one,
+        counters=counters,
+    )
+
+
+class _AsyncRows:
+    def __init__(self, rows):
+        self._rows = list(rows)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._rows:
+            raise StopAsyncIteration
+        return self._rows.pop(0)
+
+
+@pytest.mark.asyncio
+async def test_food_suggest_ranks_prefix_matches_by_popularity(backend_server):
+    foods = [
+        {"food_id": "fd_breast", "name": "Chicken Breast"},
+        {"food_id": "fd_thigh", "name": "Chicken Thigh"},
+        {"food_id": "fd_chickpea", "name": "Chickpeas"},
+        {"food_id": "fd_turkey", "name": "Turkey Breast"},
+    ]
+    pipelines = []
+
+    def _aggregate(pipeline):
+        pipelines.append(pipeline)
+        return _AsyncRows([{"_id": "fd_thigh", "count": 40}, {"_id": "fd_turkey", "count": 5}])
+
+    backend_server.db = SimpleNamespace(
+        foods=SimpleNamespace(find=lambda *_args, **_kwargs: SimpleNamespace(to_list=AsyncMock(return_value=foods))),
+        daily_nutrition=SimpleNamespace(aggregate=_aggregate),
+        catalog_versions=SimpleNamespace(find_one=AsyncMock(return_value={"version": 1})),
+    )
+
+    short_prefix = await backend_server.suggest_foods(q="Chi", limit=10)
+    assert [food["food_id"] for food in short_prefix] == ["fd_thigh", "fd_chickpea", "fd_breast"]
+
+    word_suffix = await backend_server.suggest_foods(q="breast", limit=10)
+    assert [food["food_id"] for food in word_suffix] == ["fd_turkey", "fd_breast"]
+
+    assert await backend_server.suggest_foods(q="chicken  b", limit=1) == [foods[0]]
+    await backend_server.suggest_foods(q="chicken b", limit=10)
+
+    stats = backend_server.get_food_suggest_stats()
+    assert stats["builds"] == 1
+    assert stats["hits"] == 1
+    assert len(pipelines) == 1
+
+
+@pytest.mark.asyncio
+async def test_import_foods_streams_validated_deduped_batches(backend_server):
+    bulk_batches = []
+
+    async def _bulk_write(operations, ordered):
+        assert ordered is False
+        bulk_batches.append(operations)
+        return SimpleNamespace(upserted_count=len(operations), modified_count=0)
+
+    foods = SimpleNamespace(
+        create_index=AsyncMock(return_value="ok"),
+        find=lambda *_args, **_kwargs: _AsyncRows([]),
+        bulk_write=_bulk_write,
+    )
+    catalog_versions = SimpleNamespace(update_one=AsyncMock(return_value=None))
+    backend_server.db = SimpleNamespace(foods=foods, catalog_versions=catalog_versions)
+
+    csv_body = io.StringIO(
+        "name,category,serving_size,calories,protein,carbs,fat,fiber\n"
+        "Chicken Breast,protein,100g,165,31,0,3.6,\n"
+        "chicken  breast,protein,100 g,170,31,0,4,0\n"
+        "Chicken Breast,protein,100G,166,31,0,3.6,0\n"
+        "Mystery Bar,snacks,1 bar,not-a-number,10,20,5,1\n"
+        "Oats,carbs,100g dry,389,17,66,7,11\n"
+    )
+
+    stats = await backend_server.import_foods(csv_body, "csv", batch_size=3)
+
+    assert stats["rows"] == 5
+    assert stats["valid"] == 4
+    assert stats["invalid"] == 1
+    assert stats["errors"][0]["line"] == 5
+    assert stats["duplicates"] == 1
+    assert stats["inserted"] == 3
+    assert stats["rows_per_second"] > 0
+    # "100g" and "100G" share a batch and collapse (last row wins); "100 g" normalizes differently.
+    first_batch = bulk_batches[0]
+    assert first_batch[0]._filter == {"name_normalized": "chicken breast", "serving_normalized": "100g"}
+    assert first_batch[0]._doc["$set"]["calories"] == 166
+    assert "food_id" in first_batch[0]._doc["$setOnInsert"]
+    catalog_versions.update_one.assert_awaited_once()
+
+    ndjson_body = io.StringIO(
+        '{"name": "Banana", "category": "carbs", "serving_size": "1 medium", "calories": 105, "protein": 1.3, "carbs": 27, "fat": 0.4}\n'
+        "\n"
+        "not json\n"
+    )
+    stats = await backend_server.import_foods(ndjson_body, "ndjson")
+    assert (stats["rows"], stats["valid"], stats["invalid"]) == (2, 1, 1)
+    assert stats["errors"][0]["line"] == 3
+
+
+@pytest.mark.asyncio
+async def test_meal_logging_maintains_recent_and_frequent_foods(backend_server):
+    user = backend_server.User(
+        user_id="u-food-history",
+        email="food@example.com",
+        name="Food User",
+        created_at=datetime.now(timezone.utc),
+    )
+    oats = {"food_id": "fd_oats", "food_name": "Oats", "servings": 1, "calories": 389, "protein": 17, "carbs": 66, "fat": 7}
+    day = {"meals": {"breakfast": [oats], "lunch": [], "dinner": [], "snacks": []}}
+    user_food_stats = SimpleNamespace(update_one=AsyncMock(return_value=None))
+    backend_server.db = SimpleNamespace(
+        daily_nutrition=SimpleNamespace(
+            find_one=AsyncMock(return_value=day),
+            update_one=AsyncMock(return_value=None),
+        ),
+        user_food_stats=user_food_stats,
+        user_change_counters=_change_counters(),
+    )
+    entry = backend_server.MealEntryCreate(
+        meal_type="breakfast",
+        food_id="fd_oats",
+        food_name="Oats",
+        servings=1,
+        calories=389,
+        protein=17,
+        carbs=66,
+        fat=7,
+    )
+
+    await backend_server.add_meal_entry("2026-03-01", entry, _make_request(), user)
+
+    logged_filter, logged_update = user_food_stats.update_one.await_args.args
+    assert logged_filter == {"user_id": "u-food-history", "food_id": "fd_oats"}
+    assert logged_update["$set"]["last_entry"]["calories"] == 389
+    assert logged_update["$inc"]["log_count"] == 1
+    assert user_food_stats.update_one.await_args.kwargs["upsert"] is True
+
+    await backend_server.remove_meal_entry("2026-03-01", "breakfast", 0, _make_request(), user)
+
+    unlogged_filter, pipeline = user_food_stats.update_one.await_args.args
+    assert unlogged_filter == {"user_id": "u-food-history", "food_id": "fd_oats"}
+    assert "$max" in pipeline[0]["$set"]["frequency_score"]
+
+    weight = backend_server.food_frequency_weight()
+    docs = [{"food_id": "fd_oats", "food_name": "Oats", "frequency_score": 3 * weight}]
+    cursor = SimpleNamespace(
+        sort=lambda *_args: SimpleNamespace(limit=lambda _n: SimpleNamespace(to_list=AsyncMock(return_value=docs)))
+    )
+    backend_server.db = SimpleNamespace(user_food_stats=SimpleNamespace(find=lambda *_args: cursor))
+
+    frequent = await backend_server.get_frequent_foods(user, limit=5)
+    assert frequent[0]["food_id"] == "fd_oats"
+    assert frequent[0]["frequency"] == pytest.approx(3, rel=1e-3)
+
+
+@pytest.mark.asyncio
+async def test_add_meal_entry_upserts_day_and_retries_concurrent_create(backend_server):
+    user = backend_server.User(
+        user_id="u-meal-race",
+        email="race@example.com",
+        name="Race User",
+        created_at=datetime.now(timezone.utc),
+    )
+    day_writes = []
+
+    async def _update_one(query, update, **kwargs):
+        day_writes.append((query, update, kwargs))
+        if len(day_writes) == 1:
+            raise backend_server.DuplicateKeyError("E11000 duplicate key")
+
+    backend_server.db = SimpleNamespace(
+        daily_nutrition=SimpleNamespace(update_one=_update_one, find_one=AsyncMock(return_value=None)),
+        user_food_stats=SimpleNamespace(update_one=AsyncMock(return_value=None)),
+        user_change_counters=_change_counters(),
+    )
+    entry = backend_server.MealEntryCreate(
+        meal_type="lunch", food_id="fd_rice", food_name="Rice", servings=1, calories=200, protein=4, carbs=45, fat=0.5
+    )
+
+    await backend_server.add_meal_entry("2026-03-02", entry, _make_request(), user)
+
+    (query, update, first_kwargs), (_query, _update, retry_kwargs) = day_writes
+    assert query == {"user_id": "u-meal-race", "date": "2026-03-02"}
+    assert first_kwargs == {"upsert": True} and retry_kwargs == {}
+    assert update["$push"]["meals.lunch"]["food_id"] == "fd_rice"
+    assert update["$inc"]["total_calories"] == 200
+    assert "meals.lunch" not in update["$setOnInsert"]
+    assert update["$setOnInsert"]["meals.breakfast"] == []
+
+
+@pytest.mark.asyncio
+async def test_get_workouts_keyset_cursor_pagination(backend_server):
+    user = backend_server.User(
+        user_id="u-history",
+        email="history@example.com",
+        name="History User",
+        created_at=datetime.now(timezone.utc),
+    )
+    pages = [
+        [
+            {"workout_id": "w3", "date": datetime(2026, 3, 3, 9, 0)},
+            {"workout_id": "w2", "date": datetime(2026, 3, 2, 9, 0)},
+        ],
+        [{"workout_id": "w1", "date": datetime(2026, 3, 2, 9, 0)}],
+    ]
+    queries = []
+
+    class _Cursor:
+        def __init__(self, query):
+            queries.append(query)
+
+        def sort(self, spec):
+            assert spec == [("date", -1), ("workout_id", -1)]
+            return self
+
+        def skip(self, count):
+            raise AssertionError("cursor pagination must not skip")
+
+        def limit(self, _n):
+            return self
+
+        async def to_list(self, _n):
+            return pages[len(queries) - 1]
+
+    backend_server.db = SimpleNamespace(workouts=SimpleNamespace(find=lambda query, _projection: _Cursor(query)))
+
+    first = await backend_server.get_workouts(backend_server.Response(), user, limit=2, cursor="", view="full")
+    assert [w["workout_id"] for w in first["workouts"]] == ["w3", "w2"]
+    assert first["next_cursor"]
+    assert queries[0] == {"user_id": "u-history"}
+
+    second = await backend_server.get_workouts(backend_server.Response(), user, limit=2, cursor=first["next_cursor"], view="full")
+    assert second["next_cursor"] is None
+    assert queries[1]["$or"] == [
+        {"date": {"$lt": datetime(2026, 3, 2, 9, 0)}},
+        {"date": datetime(2026, 3, 2, 9, 0), "workout_id": {"$lt": "w2"}},
+    ]
+
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.get_workouts(backend_server.Response(), user, limit=2, cursor="not-a-cursor", view="full")
+    assert exc.value.status_code == 400
+
+
+class _FakeDatabase(dict):
+    def __getattr__(self, name):
+        return self[name]
+
+
+@pytest.mark.asyncio
+async def test_index_registry_ensure_and_explain_report(backend_server):
+    created = []
+
+    def _collection(name):
+        async def _create_index(keys, **options):
+            if options["name"] == "daily_nutrition_user_date_unique":
+                raise RuntimeError("E11000 duplicate key")
+            created.append((name, options["name"]))
+            return options["name"]
+
+        def _find(query):
+            plan = {"stage": "COLLSCAN"} if name == "paywall_events" else {
+                "stage": "FETCH",
+                "inputStage": {"stage": "IXSCAN", "indexName": f"{name}_idx"},
+            }
+            cursor = SimpleNamespace(explain=AsyncMock(return_value={"queryPlanner": {"winningPlan": plan}}))
+            cursor.sort = lambda _spec: cursor
+            return cursor
+
+        return SimpleNamespace(create_index=_create_index, find=_find)
+
+    names = {spec["collection"] for spec in backend_server.INDEX_REGISTRY}
+    names.update(entry[1] for entry in backend_server.HOT_QUERIES)
+    backend_server.db = _FakeDatabase({name: _collection(name) for name in names})
+
+    report = await backend_server.ensure_indexes()
+    assert report["failed"] == ["daily_nutrition_user_date_unique"]
+    assert len(report["ensured"]) == len(backend_server.INDEX_REGISTRY) - 1
+    assert ("users", "users_email_unique") in created
+
+    queries = await backend_server.explain_hot_queries()
+    collscans = {row["query"] for row in queries if row["collscan"]}
+    assert collscans == {"paywall funnel", "paywall user history"}
+    session_row = next(row for row in queries if row["query"] == "session lookup")
+    assert session_row["stages"] == ["FETCH", "IXSCAN"]
+    assert session_row["indexes"] == ["user_sessions_idx"]
+
+
+@pytest.mark.asyncio
+async def test_workout_summary_written_on_create_and_used_by_readers(backend_server):
+    user = backend_server.User(
+        user_id="u-summary",
+        email="summary@example.com",
+        name="Summary User",
+        created_at=datetime.now(timezone.utc),
+    )
+    inserted = []
+    backend_server.db = SimpleNamespace(
+        workouts=SimpleNamespace(insert_one=AsyncMock(side_effect=inserted.append)),
+        user_change_counters=_change_counters(),
+    )
+    payload = backend_server.WorkoutCreate(
+        name="Push",
+        duration_minutes=55,
+        exercises=[
+            {
+                "exercise_id": "ex1",
+                "exercise_name": "Bench Press",
+                "sets": [
+                    {"set_number": 1, "weight": 45, "reps": 10, "is_warmup": True},
+                    {"set_number": 2, "weight": 135, "reps": 8, "rpe": 7},
+                    {"set_number": 3, "weight": 145, "reps": 6, "rpe": 9},
+                    {"set_number": 4, "weight": 145, "reps": 5},
+                ],
+            }
+        ],
+    )
+
+    created = await backend_server.create_workout(payload, _make_request(), user)
+
+    summary = inserted[0]["summary"]
+    assert created["summary"] == summary
+    assert "_id" not in created
+    assert summary["working_sets"] == 3
+    assert summary["total_reps"] == 19
+    assert summary["total_volume"] == 135 * 8 + 145 * 6 + 145 * 5
+    assert summary["all_sets"] == 4
+    assert summary["all_volume"] == 45 * 10 + summary["total_volume"]
+    assert summary["duration_minutes"] == 55
+    bench = summary["exercises"][0]
+    assert (bench["max_weight"], bench["rpe_sets"], bench["avg_rpe"]) == (145, 2, 8.0)
+
+    # One stored summary plus one legacy workout that still needs its sets fetched.
+    listed = [
+        {"workout_id": "wk_new", "date": datetime(2026, 3, 2), "summary": summary},
+        {"workout_id": "wk_old", "date": datetime(2026, 3, 1)},
+    ]
+    legacy = {"workout_id": "wk_old", "exercises": [{"exercise_name": "Bench Press", "sets": [{"weight": 100, "reps": 5}]}]}
+    finds = []
+
+    def _find(query, projection):
+        finds.append((query, projection))
+        if "workout_id" in query:
+            return SimpleNamespace(to_list=AsyncMock(return_value=[legacy]))
+        return SimpleNamespace(
+            sort=lambda *_args: SimpleNamespace(
+                limit=lambda _n: SimpleNamespace(to_list=AsyncMock(return_value=listed))
+            )
+        )
+
+    backend_server.db = SimpleNamespace(workouts=SimpleNamespace(find=_find))
+
+    progression = await backend_server.get_exercise_progression("Bench Press", user)
+
+    assert finds[0][1] == backend_server.WORKOUT_SUMMARY_PROJECTION
+    assert finds[1][0] == {"workout_id": {"$in": ["wk_old"]}}
+    assert [row["max_weight"] for row in progression["history"]] == [145, 100]
+    # Unrated working set counts as RPE 7: (7 + 9 + 7) / 3
+    assert progression["history"][0]["avg_rpe"] == 7.7
+    assert progression["history"][1]["avg_rpe"] == 7
+
+
+@pytest.mark.asyncio
+async def test_get_workouts_summary_view_projects_headers_and_summary(backend_server):
+    user = backend_server.User(
+        user_id="u-summary-view",
+        email="view@example.com",
+        name="View User",
+        created_at=datetime.now(timezone.utc),
+    )
+    stored = backend_server.build_workout_summary([], 40)
+    rows = [{"workout_id": "wk_1", "name": "Legs", "date": datetime(2026, 3, 1), "summary": stored}]
+    projections = []
+
+    def _find(_query, projection):
+        projections.append(projection)
+        cursor = SimpleNamespace(to_list=AsyncMock(return_value=rows))
+        cursor.sort = lambda _spec: cursor
+        cursor.limit = lambda _n: cursor
+        return cursor
+
+    backend_server.db = SimpleNamespace(workouts=SimpleNamespace(find=_find))
+
+    result = await backend_server.get_workouts(backend_server.Response(), user, limit=20, skip=0, cursor=None, view="summary")
+
+    assert result == rows
+    assert "exercises" not in projections[0]
+    assert projections[0]["summary"] == 1
+    assert projections[0]["workout_id"] == 1
+
+
+@pytest.mark.asyncio
+async def test_create_workouts_batch_is_idempotent_per_client_id(backend_server):
+    user = backend_server.User(
+        user_id="u-batch",
+        email="batch@example.com",
+        name="Batch User",
+        created_at=datetime.now(timezone.utc),
+    )
+    bulk_calls = []
+
+    async def _bulk_write(operations, ordered):
+        bulk_calls.append((operations, ordered))
+        # First op is new, second was stored by an earlier replay.
+        return SimpleNamespace(upserted_ids={0: "oid-1"})
+
+    lookups = []
+
+    def _find(query, _projection):
+        lookups.append(query)
+        return SimpleNamespace(
+            to_list=AsyncMock(return_value=[{"workout_id": "wk_existing", "client_workout_id": "offline-2"}])
+        )
+
+    backend_server.db = SimpleNamespace(
+        workouts=SimpleNamespace(bulk_write=_bulk_write, find=_find),
+        user_change_counters=_change_counters(),
+    )
+    payload = backend_server.WorkoutBatchCreate(
+        items=[
+            {"client_id": "offline-1", "name": "Pull"},
+            {"client_id": "offline-2", "name": "Legs"},
+            {"client_id": "offline-1", "name": "Pull (resent)"},
+        ]
+    )
+
+    response = await backend_server.create_workouts_batch(payload, _make_request(), user)
+
+    operations, ordered = bulk_calls[0]
+    assert ordered is False
+    assert len(operations) == 2
+    assert operations[0]._filter == {"user_id": "u-batch", "client_workout_id": "offline-1"}
+    assert operations[0]._doc["$setOnInsert"]["summary"]["version"] == backend_server.WORKOUT_SUMMARY_VERSION
+    assert [op._doc["$setOnInsert"]["change_seq"] for op in operations] == [1, 2]
+    assert [result["status"] for result in response["results"]] == ["created", "duplicate", "duplicate"]
+    assert response["results"][1]["workout_id"] == "wk_existing"
+    assert response["results"][0]["workout_id"].startswith("wk_")
+    assert (response["created"], response["duplicates"], response["failed"]) == (1, 2, 0)
+    assert lookups[0]["client_workout_id"] == {"$in": ["offline-2", "offline-1"]}
+
+
+@pytest.mark.asyncio
+async def test_sync_changes_merges_collections_and_tombstones_by_sequence(backend_server):
+    user = backend_server.User(
+        user_id="u-sync",
+        email="sync@example.com",
+        name="Sync User",
+        created_at=datetime.now(timezone.utc),
+    )
+    stamped = datetime.now(timezone.utc) - timedelta(minutes=5)
+    rows = {
+        "workouts": [
+            {"workout_id": "wk_1", "change_seq": 3, "updated_at": stamped},
+            {"workout_id": "wk_2", "change_seq": 7, "updated_at": stamped},
+        ],
+        "daily_nutrition": [{"nutrition_id": "nt_1", "change_seq": 4, "updated_at": stamped}],
+        "body_measurements": [],
+        "sync_tombstones": [
+            {"collection": "workouts", "doc_id": "wk_old", "change_seq": 5, "updated_at": stamped},
+        ],
+    }
+
+    def _collection(name):
+        def _find(query, _projection):
+            bounds = query["change_seq"]
+            matched = [row for row in rows[name] if bounds["$gt"] < row["change_seq"] <= bounds["$lte"]]
+            cursor = SimpleNamespace()
+            cursor.sort = lambda *_args: cursor
+            cursor.limit = lambda limit: SimpleNamespace(to_list=AsyncMock(return_value=matched[:limit]))
+            return cursor
+
+        return SimpleNamespace(find=_find)
+
+    # Sequence 9 is reserved by a write that has not landed yet.
+    counters = _change_counters({"u-sync": {"seq": 9, "pending": [{"first": 9, "at": datetime.now(timezone.utc)}]}})
+    backend_server.db = _FakeDatabase({name: _collection(name) for name in rows})
+    backend_server.db["user_change_counters"] = counters
+
+    token = backend_server.encode_sync_token(2)
+    page = await backend_server.get_sync_changes(user, since=token, limit=3)
+    assert [doc["workout_id"] for doc in page["changes"]["workouts"]] == ["wk_1"]
+    assert [doc["nutrition_id"] for doc in page["changes"]["daily_nutrition"]] == ["nt_1"]
+    assert page["deleted"]["workouts"] == ["wk_old"]
+    assert page["has_more"] is True
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 5
+
+    page = await backend_server.get_sync_changes(user, since=page["next_token"], limit=3)
+    assert [doc["workout_id"] for doc in page["changes"]["workouts"]] == ["wk_2"]
+    assert page["has_more"] is False
+    # However long the pending write takes, the token stops below it.
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 8
+
+    rows["body_measurements"].append({"measurement_id": "bm_1", "change_seq": 9, "updated_at": stamped})
+    await counters.update_one({"_id": "u-sync"}, {"$pull": {"pending": {"first": 9}}})
+    page = await backend_server.get_sync_changes(user, since=page["next_token"], limit=3)
+    assert [doc["measurement_id"] for doc in page["changes"]["body_measurements"]] == ["bm_1"]
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 9
+
+    # A reservation whose writer died stops holding sync back after the abandon window.
+    counters.counters["u-sync"]["pending"].append(
+        {"first": 10, "at": datetime.now(timezone.utc) - timedelta(seconds=backend_server.SYNC_PENDING_ABANDON_SECONDS + 1)}
+    )
+    counters.counters["u-sync"]["seq"] = 10
+    page = await backend_server.get_sync_changes(user, since=page["next_token"], limit=3)
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 10
+    assert counters.counters["u-sync"]["pending"] == []
+
+    expired = backend_server.encode_sync_token(
+        7, datetime.now(timezone.utc) - timedelta(days=backend_server.SYNC_TOMBSTONE_RETENTION_DAYS + 1)
+    )
+    assert (await backend_server.get_sync_changes(user, since=expired, limit=3))["reset"] is True
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.get_sync_changes(user, since="not-a-token", limit=3)
+    assert exc.value.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_sync_changes_pages_through_a_single_overflowing_collection(backend_server):
+    user = backend_server.User(
+        user_id="u-sync-full",
+        email="full@example.com",
+        name="Full Sync",
+        created_at=datetime.now(timezone.utc),
+    )
+    stamped = datetime.now(timezone.utc) - timedelta(minutes=5)
+    rows = {name: [] for name in (*backend_server.SYNC_COLLECTIONS, "sync_tombstones")}
+    rows["workouts"] = [{"workout_id": f"wk_{seq}", "change_seq": seq, "updated_at": stamped} for seq in (1, 2, 3)]
+
+    def _collection(name):
+        def _find(query, _projection):
+            bounds = query["change_seq"]
+            matched = [row for row in rows[name] if bounds["$gt"] < row["change_seq"] <= bounds["$lte"]]
+            cursor = SimpleNamespace()
+            cursor.sort = lambda *_args: cursor
+            cursor.limit = lambda limit: SimpleNamespace(to_list=AsyncMock(return_value=matched[:limit]))
+            return cursor
+
+        return SimpleNamespace(find=_find)
+
+    backend_server.db = _FakeDatabase({name: _collection(name) for name in rows})
+    backend_server.db["user_change_counters"] = _change_counters({"u-sync-full": {"seq": 3, "pending": []}})
+    backend_server.stamp_unsequenced_documents = AsyncMock(return_value=0)
+
+    seen = []
+    page = await backend_server.get_sync_changes(user, since=None, limit=2)
+    seen += [doc["workout_id"] for doc in page["changes"]["workouts"]]
+    # Only workouts overflowed, so the merged page alone is not over the limit.
+    assert page["has_more"] is True
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 2
+
+    page = await backend_server.get_sync_changes(user, since=page["next_token"], limit=2)
+    seen += [doc["workout_id"] for doc in page["changes"]["workouts"]]
+    assert page["has_more"] is False
+    assert backend_server.decode_sync_token(page["next_token"])[0] == 3
+    assert seen == ["wk_1", "wk_2", "wk_3"]
+
+
+@pytest.mark.asyncio
+async def test_tracked_change_stays_pending_until_the_write_finishes(backend_server):
+    counters = _change_counters()
+    backend_server.db = SimpleNamespace(user_change_counters=counters)
+
+    async with backend_server.tracked_changes("u-pending", 2) as stamps:
+        assert [stamp["change_seq"] for stamp in stamps] == [1, 2]
+        assert await backend_server.committed_change_seq("u-pending") == 0
+    assert await backend_server.committed_change_seq("u-pending") == 2
+
+    with pytest.raises(RuntimeError):
+        async with backend_server.tracked_change("u-pending"):
+            raise RuntimeError("write failed")
+    assert await backend_server.committed_change_seq("u-pending") == 3
+
+
+_MISSING = object()
+
+
+def _eval_update_expression(expr, doc):
+    """Evaluates the aggregation operators update_workout's pipeline uses against `doc`."""
+    if isinstance(expr, str) and expr.startswith("$"):
+        value = doc
+        for part in expr[1:].split("."):
+            value = value.get(part, _MISSING) if isinstance(value, dict) else _MISSING
+        return value
+    if not isinstance(expr, dict):
+        return expr
+    if "$literal" in expr:
+        return expr["$literal"]
+    if "$mergeObjects" in expr:
+        merged = {}
+        for part in expr["$mergeObjects"]:
+            value = _eval_update_expression(part, doc)
+            merged.update({} if value is _MISSING else {k: v for k, v in value.items() if v is not _MISSING})
+        return merged
+    if "$ifNull" in expr:
+        value, default = expr["$ifNull"]
+        value = _eval_update_expression(value, doc)
+        return value if value not in (None, _MISSING) else _eval_update_expression(default, doc)
+    if "$cond" in expr:
+        condition, then, otherwise = expr["$cond"]
+        return _eval_update_expression(then if _eval_update_expression(condition, doc) else otherwise, doc)
+    if "$eq" in expr:
+        left, right = (_eval_update_expression(part, doc) for part in expr["$eq"])
+        return left == right
+    if "$add" in expr:
+        return sum(_eval_update_expression(part, doc) for part in expr["$add"])
+    return {key: _eval_update_expression(value, doc) for key, value in expr.items()}
+
+
+def _apply_pipeline_update(doc, pipeline):
+    updated = dict(doc)
+    for stage in pipeline:
+        for field, expr in stage["$set"].items():
+            value = _eval_update_expression(expr, doc)
+            if value is _MISSING:
+                updated.pop(field, None)  # a missing field reference leaves the field absent
+            else:
+                updated[field] = value
+    return updated
+
+
+@pytest.mark.asyncio
+async def test_workout_and_measurement_updates_are_single_conditional_writes(backend_server):
+    user = backend_server.User(
+        user_id="u-atomic",
+        email="atomic@example.com",
+        name="Atomic User",
+        created_at=datetime.now(timezone.utc),
+    )
+    bench = {
+        "exercise_id": "ex1",
+        "exercise_name": "Bench Press",
+        "sets": [{"set_number": 1, "weight": 135, "reps": 8, "rpe": 8}],
+    }
+    stored = {
+        "wk_current": {
+            "workout_id": "wk_current",
+            "exercises": [bench],
+            "duration_minutes": 40,
+            "summary": backend_server.build_workout_summary([bench], 40),
+            "version": 2,
+        },
+        # Written before summaries existed.
+        "wk_legacy": {"workout_id": "wk_legacy", "name": "$notes", "exercises": [bench], "duration_minutes": 40},
+    }
+    workout_calls = []
+
+    async def _workout_update(query, pipeline, **kwargs):
+        workout_calls.append((query, pipeline, kwargs))
+        doc = stored.get(query["workout_id"])
+        if doc is None or ("version" in query and doc.get("version") != query["version"]):
+            return None
+        stored[query["workout_id"]] = _apply_pipeline_update(doc, pipeline)
+        return stored[query["workout_id"]]
+
+    measurement_calls = []
+    measurement_exists = AsyncMock(return_value={"_id": "oid"})
+
+    async def _measurement_update(query, update, **kwargs):
+        measurement_calls.append((query, update, kwargs))
+        if query.get("version") == 1:
+            return None
+        return {"date": query["date"], "weight": 180.5, "version": 1}
+
+    backend_server.db = SimpleNamespace(
+        workouts=SimpleNamespace(
+            find_one_and_update=_workout_update,
+            find_one=AsyncMock(side_effect=lambda query, _projection: stored.get(query["workout_id"])),
+        ),
+        body_measurements=SimpleNamespace(find_one_and_update=_measurement_update, find_one=measurement_exists),
+        user_change_counters=_change_counters(),
+    )
+
+    updated = await backend_server.update_workout(
+        "wk_current", backend_server.WorkoutUpdate(duration_minutes=50, version=2), _make_request(), user
+    )
+    query, _pipeline, kwargs = workout_calls[0]
+    assert query == {"workout_id": "wk_current", "user_id": "u-atomic", "version": 2}
+    assert kwargs["return_document"] == backend_server.ReturnDocument.AFTER
+    assert updated["version"] == 3
+    assert updated["summary"] == backend_server.build_workout_summary([bench], 50)
+
+    # New exercises without a duration keep the stored duration in the summary.
+    squat = {"exercise_id": "ex2", "exercise_name": "Squat", "sets": [{"set_number": 1, "weight": 225, "reps": 5}]}
+    updated = await backend_server.update_workout(
+        "wk_current", backend_server.WorkoutUpdate(exercises=[squat]), _make_request(), user
+    )
+    assert updated["summary"] == backend_server.build_workout_summary([squat], 50)
+
+    # A duration-only edit never leaves a partial summary on a legacy workout,
+    # and readers still rebuild its summary from the sets.
+    updated = await backend_server.update_workout(
+        "wk_legacy", backend_server.WorkoutUpdate(duration_minutes=55), _make_request(), user
+    )
+    assert "summary" not in updated
+    assert updated["name"] == "$notes"
+    assert backend_server.workout_summary(updated) == backend_server.build_workout_summary([bench], 55)
+
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.update_workout(
+            "wk_current", backend_server.WorkoutUpdate(name="Renamed", version=1), _make_request(), user
+        )
+    assert exc.value.status_code == 409
+
+    created = await backend_server.create_measurement(
+        backend_server.MeasurementCreate(date="2026-03-01", weight=180.5), _make_request(), user
+    )
+    assert created["version"] == 1
+    query, update, kwargs = measurement_calls[0]
+    assert query == {"user_id": "u-atomic", "date": "2026-03-01"}
+    assert kwargs["upsert"] is True
+    assert update["$set"]["weight"] == 180.5
+    assert "weight" not in update["$setOnInsert"] and update["$setOnInsert"]["waist"] is None
+    assert update["$setOnInsert"]["measurement_id"].startswith("bm_")
+
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.create_measurement(
+            backend_server.MeasurementCreate(date="2026-03-01", weight=181, version=1), _make_request(), user
+        )
+    assert exc.value.status_code == 409
+    assert measurement_calls[1][2]["upsert"] is False
+
+    measurement_exists.return_value = None
+    with pytest.raises(HTTPException) as exc:
+        await backend_server.create_measurement(
+            backend_server.MeasurementCreate(date="2026-03-09", weight=181, version=1), _make_request(), user
+        )
+    assert exc.value.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_workout_summary_backfill_runs_once_per_summary_version(backend_server):
+    legacy = {"_id": "oid-1", "exercises": [], "duration_minutes": 30}
+    find_calls = []
+
+    def _find(query, _projection):
+        find_calls.append(query)
+        return _AsyncRows([legacy])
+
+    workouts = SimpleNamespace(find=_find, bulk_write=AsyncMock(return_value=None))
+    data_migrations = SimpleNamespace(find_one=AsyncMock(return_value=None), update_one=AsyncMock(return_value=None))
+    backend_server.db = SimpleNamespace(workouts=workouts, data_migrations=data_migrations)
+
+    assert await backend_server._run_workout_summary_backfill_once() == 1
+    marker_filter, marker_update = data_migrations.update_one.await_args.args
+    assert marker_filter == {"_id": "workout_summaries"}
+    assert marker_update["$set"]["version"] == backend_server.WORKOUT_SUMMARY_VERSION
+
+    data_migrations.find_one.return_value = {"_id": "workout_summaries", "version": backend_server.WORKOUT_SUMMARY_VERSION}
+    assert await backend_server._run_workout_summary_backfill_once() == 0
+    assert len(find_calls) == 1
+
+    # An interrupted backfill is not marked done.
+    data_migrations.find_one.return_value = None
+    data_migrations.update_one.reset_mock()
+    workouts.bulk_write.side_effect = RuntimeError("primary stepped down")
+    assert await backend_server._run_workout_summary_backfill_once() == 0
+    data_migrations.update_one.assert_not_awaited()